@@ -1,18 +1,25 @@
 from sentence_transformers import SentenceTransformer
-from flask import Flask, request, jsonify, session, send_from_directory
+from flask import Flask, request, jsonify, session, send_from_directory, g, has_app_context, has_request_context
 from flask_cors import CORS
 import sqlite3
 import numpy as np
-from sklearn.metrics.pairwise import cosine_similarity
+from scipy import sparse
 import jwt
 import datetime
 from functools import wraps, lru_cache
 import hashlib
+import base64
+import json
 import os
 from werkzeug.utils import secure_filename
 from werkzeug.exceptions import RequestEntityTooLarge
 import time
 import threading
+import queue
+import sys
+import atexit
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
 
 # Helper function to safely get values from sqlite3.Row objects
 def row_get(row, key, default=None):
@@ -84,60 +91,776 @@ JWT_ALGORITHM = 'HS256'
 JWT_EXPIRATION_HOURS = 24
 
 # Initialize AI Model
+EMBEDDING_MODEL_NAME = 'all-MiniLM-L6-v2'
 print("Loading AI model...")
-ai_model = SentenceTransformer('all-MiniLM-L6-v2')
+ai_model = SentenceTransformer(EMBEDDING_MODEL_NAME)
 print("AI model loaded successfully!")
 
-# Database connection with optimizations
+# Number of texts handed to the transformer per forward pass
+EMBEDDING_BATCH_SIZE = int(os.getenv('EMBEDDING_BATCH_SIZE', '64'))
+
+def encode_texts(texts, batch_size=None):
+    """
+    Encode many texts in batches and return the embeddings in input order
+    
+    Texts are sorted by length before batching so each batch pads to a similar
+    length, then the results are scattered back to their original positions.
+    """
+    batch_size = batch_size or EMBEDDING_BATCH_SIZE
+    if not texts:
+        return np.empty((0, 0), dtype=np.float32)
+    
+    order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+    embeddings = None
+    for start in range(0, len(order), batch_size):
+        batch_indices = order[start:start + batch_size]
+        batch = ai_model.encode([texts[i] for i in batch_indices],
+                                batch_size=len(batch_indices),
+                                convert_to_numpy=True,
+                                show_progress_bar=False)
+        if embeddings is None:
+            embeddings = np.empty((len(texts), batch.shape[1]), dtype=np.float32)
+        embeddings[batch_indices] = batch
+    
+    return embeddings
+
+# Search queries arriving within this window are encoded together in one forward pass
+QUERY_BATCH_MAX_SIZE = int(os.getenv('QUERY_BATCH_MAX_SIZE', '32'))
+QUERY_BATCH_MAX_WAIT_MS = float(os.getenv('QUERY_BATCH_MAX_WAIT_MS', '5'))
+
+class QueryEncoder:
+    """
+    Micro-batcher for query embeddings
+    
+    Request threads submit query strings and get a Future back; a single worker
+    thread collects queued queries until max_batch_size is reached or max_wait_ms
+    has passed since the first one arrived, then encodes the batch in one call.
+    """
+    
+    def __init__(self, max_batch_size=QUERY_BATCH_MAX_SIZE, max_wait_ms=QUERY_BATCH_MAX_WAIT_MS):
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max(0.0, max_wait_ms) / 1000.0
+        self._queue = queue.Queue()
+        self._worker = None
+        self._worker_lock = threading.Lock()
+        self.batches = 0
+        self.queries = 0
+    
+    def _ensure_worker(self):
+        # Started lazily so the thread belongs to the process that serves requests
+        if self._worker is not None and self._worker.is_alive():
+            return
+        with self._worker_lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._run, name='query-encoder', daemon=True)
+                self._worker.start()
+    
+    def submit(self, text):
+        """Queue a query for encoding and return a Future resolving to its embedding"""
+        future = Future()
+        self._ensure_worker()
+        self._queue.put((text, future))
+        return future
+    
+    def encode(self, text, timeout=None):
+        """Encode a single query, waiting for the batch it joins"""
+        return self.submit(text).result(timeout)
+    
+    def _collect(self):
+        """Block for the first query, then gather more until the batch is full or the window closes"""
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+    
+    def _run(self):
+        while True:
+            batch = self._collect()
+            # Identical queries in the same window share one encoding
+            texts = list(dict.fromkeys(text for text, _ in batch))
+            try:
+                embeddings = encode_texts(texts, batch_size=len(texts))
+            except Exception as e:
+                print(f"Error encoding query batch: {e}")
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            
+            by_text = dict(zip(texts, embeddings))
+            for text, future in batch:
+                future.set_result(by_text[text])
+            self.batches += 1
+            self.queries += len(batch)
+
+query_encoder = QueryEncoder()
+
+# Database connection pool
+DB_PATH = 'bookgenie.db'
+# Connections the request pool may open; further checkouts wait up to DB_POOL_TIMEOUT seconds
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', '32'))
+DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', '10'))
+# Separate pool for work outside requests (recommendation generators, event writer, scheduler,
+# cache refreshes), so request threads holding connections can never starve it
+DB_BACKGROUND_POOL_SIZE = int(os.getenv('DB_BACKGROUND_POOL_SIZE', '16'))
+
 _db_lock = threading.Lock()
 
-def get_db():
-    """Get database connection with optimizations enabled"""
-    conn = sqlite3.connect('bookgenie.db', check_same_thread=False)
-    conn.row_factory = sqlite3.Row
+class PooledConnection:
+    """
+    A pooled sqlite3 connection; close() hands it back to the pool
+    
+    Everything else is passed through to the underlying connection.
+    """
+    
+    def __init__(self, pool, conn):
+        self._pool = pool
+        self._conn = conn
+        self._checked_out_at = time.perf_counter()
+    
+    def __getattr__(self, name):
+        if self._conn is None:
+            raise sqlite3.ProgrammingError('Cannot operate on a closed database.')
+        return getattr(self._conn, name)
     
-    # Enable WAL mode for better concurrency
-    conn.execute('PRAGMA journal_mode=WAL')
+    def __enter__(self):
+        return self._conn.__enter__()
     
-    # Optimize for performance
-    conn.execute('PRAGMA synchronous=NORMAL')  # Faster than FULL, still safe
-    conn.execute('PRAGMA cache_size=-64000')  # 64MB cache
-    conn.execute('PRAGMA temp_store=MEMORY')  # Store temp tables in memory
-    conn.execute('PRAGMA mmap_size=268435456')  # 256MB memory-mapped I/O
+    def __exit__(self, *exc_info):
+        return self._conn.__exit__(*exc_info)
     
+    def close(self):
+        if self._conn is not None:
+            conn, self._conn = self._conn, None
+            self._pool.release(conn, time.perf_counter() - self._checked_out_at)
+
+class ConnectionPool:
+    """
+    Bounded pool of SQLite connections, configured once when opened
+    
+    Idle connections are reused most-recently-returned first so their page
+    cache stays warm. When all connections are checked out, callers wait for
+    one to be returned (counted in the waiter stats).
+    """
+    
+    def __init__(self, path=DB_PATH, size=DB_POOL_SIZE, timeout=DB_POOL_TIMEOUT):
+        self.path = path
+        self.size = size
+        self.timeout = timeout
+        self._idle = []
+        self._opened = 0
+        self._available = threading.Condition(threading.Lock())
+        self.waiting = 0
+        self.checkouts = 0
+        self.waits = 0
+        self.timeouts = 0
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+        self.held_seconds = 0.0
+        self.max_held_seconds = 0.0
+    
+    def _connect(self):
+        conn = sqlite3.connect(self.path, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        
+        # Enable WAL mode for better concurrency
+        conn.execute('PRAGMA journal_mode=WAL')
+        
+        # Optimize for performance
+        conn.execute('PRAGMA synchronous=NORMAL')  # Faster than FULL, still safe
+        conn.execute('PRAGMA cache_size=-64000')  # 64MB cache
+        conn.execute('PRAGMA temp_store=MEMORY')  # Store temp tables in memory
+        conn.execute('PRAGMA mmap_size=268435456')  # 256MB memory-mapped I/O
+        
+        return conn
+    
+    def acquire(self):
+        """Check out a connection, opening one if the pool is not yet full"""
+        start = time.perf_counter()
+        with self._available:
+            if not self._idle and self._opened >= self.size:
+                self.waiting += 1
+                self.waits += 1
+                try:
+                    # Capacity freed by a discarded connection lets a waiter open a new one
+                    if not self._available.wait_for(lambda: self._idle or self._opened < self.size,
+                                                    timeout=self.timeout):
+                        self.timeouts += 1
+                        raise sqlite3.OperationalError('Timed out waiting for a database connection')
+                finally:
+                    self.waiting -= 1
+            conn = self._idle.pop() if self._idle else None
+            if conn is None:
+                self._opened += 1
+            waited = time.perf_counter() - start
+            self.checkouts += 1
+            self.wait_seconds += waited
+            self.max_wait_seconds = max(self.max_wait_seconds, waited)
+        
+        if conn is None:
+            try:
+                conn = self._connect()
+            except Exception:
+                with self._available:
+                    self._opened -= 1
+                    self._available.notify()
+                raise
+        return conn
+    
+    def release(self, conn, held_seconds=0.0):
+        """Return a connection, rolling back anything its holder left uncommitted"""
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error as e:
+            print(f"Discarding broken database connection: {e}")
+            conn.close()
+            conn = None
+        with self._available:
+            if conn is None:
+                self._opened -= 1
+            else:
+                self._idle.append(conn)
+            self.held_seconds += held_seconds
+            self.max_held_seconds = max(self.max_held_seconds, held_seconds)
+            self._available.notify()
+    
+    def stats(self):
+        with self._available:
+            return {
+                'size': self.size,
+                'open': self._opened,
+                'idle': len(self._idle),
+                'in_use': self._opened - len(self._idle),
+                'waiting': self.waiting,
+                'checkouts': self.checkouts,
+                'waits': self.waits,
+                'timeouts': self.timeouts,
+                'avg_wait_ms': round(self.wait_seconds / self.checkouts * 1000, 3) if self.checkouts else 0.0,
+                'max_wait_ms': round(self.max_wait_seconds * 1000, 3),
+                'avg_checkout_ms': round(self.held_seconds / self.checkouts * 1000, 3) if self.checkouts else 0.0,
+                'max_checkout_ms': round(self.max_held_seconds * 1000, 3)
+            }
+
+db_pool = ConnectionPool()
+background_db_pool = ConnectionPool(size=DB_BACKGROUND_POOL_SIZE)
+
+def get_db():
+    """
+    Get a pooled database connection; close() returns it to its pool
+    
+    Every call checks out its own connection, so each caller has its own
+    transaction. Request threads use the request pool; other threads use the
+    background pool. Connections left open when a request or app context
+    (e.g. a background cache refresh) ends are returned to their pool.
+    """
+    if has_request_context():
+        conn = PooledConnection(db_pool, db_pool.acquire())
+    else:
+        conn = PooledConnection(background_db_pool, background_db_pool.acquire())
+    if has_app_context():
+        g.setdefault('db_connections', []).append(conn)
     return conn
 
-# Simple in-memory cache for frequently accessed data
-_cache = {}
-_cache_timestamps = {}
-CACHE_TTL = 300  # 5 minutes cache TTL
+@app.teardown_request
+@app.teardown_appcontext
+def release_db(exc=None):
+    """Return connections the request (or app context) did not close to the pool"""
+    for conn in g.pop('db_connections', []):
+        conn.close()
+
+# Write-behind logging of high-volume events
+# Queued events are written in one transaction every EVENT_FLUSH_INTERVAL_MS or EVENT_FLUSH_MAX_ROWS rows
+EVENT_FLUSH_INTERVAL_MS = float(os.getenv('EVENT_FLUSH_INTERVAL_MS', '50'))
+EVENT_FLUSH_MAX_ROWS = int(os.getenv('EVENT_FLUSH_MAX_ROWS', '500'))
+
+# Tables written through the event writer, with the columns an event may set
+EVENT_TABLES = {
+    'search_history': ('user_id', 'query', 'results_count'),
+    'reading_history': ('user_id', 'book_id', 'duration_minutes'),
+    'user_book_interactions': ('user_id', 'book_id', 'interaction_type', 'interaction_value'),
+    'recommendation_feedback': ('user_id', 'recommendation_id', 'recommendation_type', 'book_id',
+                                'position', 'query_context')
+}
+
+class EventWriter:
+    """
+    Write-behind queue for append-only event tables
+    
+    Request threads enqueue rows and return without touching the database; a
+    single writer thread collects them until max_rows is reached or max_wait_ms
+    has passed since the first one arrived, inserts each table's rows with one
+    executemany and commits once. created_at is stamped at enqueue time, so
+    rows keep the time the event happened. An event's optional after(conn)
+    callback runs on the writer thread once the event is committed (for model
+    updates and cache invalidation that must see it). Pending events are
+    flushed at interpreter exit.
+    """
+    
+    def __init__(self, max_rows=EVENT_FLUSH_MAX_ROWS, max_wait_ms=EVENT_FLUSH_INTERVAL_MS):
+        self.max_rows = max(1, max_rows)
+        self.max_wait = max(0.0, max_wait_ms) / 1000.0
+        self._queue = queue.Queue()
+        self._worker = None
+        self._worker_lock = threading.Lock()
+        self.flushes = 0
+        self.events = 0
+        self.failed = 0
+        self.max_batch = 0
+    
+    def _ensure_worker(self):
+        # Started lazily so the thread belongs to the process that serves requests
+        if self._worker is not None and self._worker.is_alive():
+            return
+        with self._worker_lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._run, name='event-writer', daemon=True)
+                self._worker.start()
+    
+    def write(self, table, after=None, **values):
+        """Queue one row for table (created_at defaults to now, UTC like CURRENT_TIMESTAMP)"""
+        columns = EVENT_TABLES.get(table)
+        if columns is None:
+            raise ValueError(f'Unknown event table: {table}')
+        unknown = set(values) - set(columns) - {'created_at'}
+        if unknown:
+            raise ValueError(f'Unknown columns for {table}: {", ".join(sorted(unknown))}')
+        unbindable = [column for column, value in values.items()
+                      if value is not None and not isinstance(value, (int, float, str, bytes))]
+        if unbindable:
+            raise ValueError(f'Values for {", ".join(unbindable)} must be numbers or strings')
+        values.setdefault('created_at', time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime()))
+        
+        self._ensure_worker()
+        self._queue.put((table, tuple(values), tuple(values.values()), after))
+    
+    def flush(self, timeout=None):
+        """Block until every event queued before this call is committed"""
+        marker = Future()
+        self._ensure_worker()
+        self._queue.put(marker)
+        return marker.result(timeout)
+    
+    def _collect(self):
+        """Block for the first event, then gather more until the batch is full, the window closes or a flush is requested"""
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_rows and not isinstance(batch[-1], Future):
+            remaining = deadline - time.monotonic()
+            try:
+                batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+    
+    @staticmethod
+    def _insert_sql(table, columns):
+        return f'INSERT INTO {table} ({", ".join(columns)}) VALUES ({", ".join("?" * len(columns))})'
+    
+    def _write_each(self, conn, events):
+        """Write events one per transaction after a failed batch, dropping (and logging) only the bad ones"""
+        written = []
+        for event in events:
+            table, columns, row, _ = event
+            try:
+                conn.execute(self._insert_sql(table, columns), row)
+                conn.commit()
+                written.append(event)
+            except (sqlite3.Error, OverflowError) as e:
+                conn.rollback()
+                self.failed += 1
+                print(f"Dropping queued {table} event {dict(zip(columns, row))}: {e}")
+        return written
+    
+    def _write(self, events):
+        # Rows with the same table and columns share one executemany
+        groups = {}
+        for table, columns, row, _ in events:
+            groups.setdefault((table, columns), []).append(row)
+        
+        conn = get_db()
+        try:
+            written = events
+            try:
+                for (table, columns), rows in groups.items():
+                    conn.executemany(self._insert_sql(table, columns), rows)
+                conn.commit()
+            except (sqlite3.Error, OverflowError) as e:
+                conn.rollback()
+                print(f"Error writing {len(events)} queued events, retrying one at a time: {e}")
+                written = self._write_each(conn, events)
+            self.flushes += 1
+            self.events += len(written)
+            self.max_batch = max(self.max_batch, len(events))
+            
+            for _, _, _, after in written:
+                if after is None:
+                    continue
+                try:
+                    after(conn)
+                except Exception as e:
+                    print(f"Error in event callback: {e}")
+        finally:
+            conn.close()
+    
+    def _run(self):
+        while True:
+            batch = self._collect()
+            events = [item for item in batch if not isinstance(item, Future)]
+            if events:
+                try:
+                    self._write(events)
+                except Exception as e:
+                    print(f"Error flushing event queue: {e}")
+                    self.failed += len(events)
+            for item in batch:
+                if isinstance(item, Future):
+                    item.set_result(True)
+    
+    def close(self, timeout=10):
+        """Flush pending events (called at interpreter exit)"""
+        if self._worker is None or not self._worker.is_alive():
+            return
+        try:
+            self.flush(timeout)
+        except FutureTimeoutError:
+            print(f"Event writer did not finish flushing within {timeout}s")
+    
+    def stats(self):
+        return {
+            'queued': self._queue.qsize(),
+            'flushes': self.flushes,
+            'events': self.events,
+            'failed': self.failed,
+            'avg_batch': round(self.events / self.flushes, 1) if self.flushes else 0.0,
+            'max_batch': self.max_batch,
+            'max_wait_ms': self.max_wait * 1000,
+            'max_rows': self.max_rows
+        }
+
+event_writer = EventWriter()
+atexit.register(event_writer.close)
+
+# In-memory cache for frequently accessed data
+CACHE_TTL = 300  # 5 minutes default TTL
+
+# Per-user fields read on most requests (see get_user_context); invalidated explicitly when they change
+USER_CONTEXT_TTL = int(os.getenv('USER_CONTEXT_TTL', '60'))
+
+# Cache namespaces, selected by key prefix:
+# (ttl seconds, max entries, max approximate bytes, seconds expired entries may still be served stale)
+CACHE_NAMESPACES = {
+    'books_': (CACHE_TTL, 4096, 64 * 1024 * 1024, 0),  # every listing page, keyed by its full filter set
+    'user_context_': (USER_CONTEXT_TTL, 10000, 8 * 1024 * 1024, 0),
+    'dashboard_': (60, 2048, 32 * 1024 * 1024, 60),  # user activity changes frequently
+    'hybrid_rec_': (600, 2048, 32 * 1024 * 1024, 600),
+    'collab_rec_': (600, 2048, 16 * 1024 * 1024, 600),  # collaborative filtering is more stable
+    'query_embedding_': (3600, 10000, 32 * 1024 * 1024, 0),
+}
+CACHE_DEFAULT_NAMESPACE = (CACHE_TTL, 1024, 16 * 1024 * 1024, 0)
+
+def approximate_size(value, _depth=0):
+    """Rough memory footprint of a cached value in bytes"""
+    if isinstance(value, np.ndarray):
+        return value.nbytes + 112
+    size = sys.getsizeof(value)
+    if _depth >= 6:
+        return size
+    if isinstance(value, dict):
+        size += sum(approximate_size(k, _depth + 1) + approximate_size(v, _depth + 1)
+                    for k, v in value.items())
+    elif isinstance(value, (list, tuple, set)):
+        size += sum(approximate_size(v, _depth + 1) for v in value)
+    return size
+
+class CacheNamespace:
+    """
+    Thread-safe LRU cache with a TTL, bounded by entry count and approximate bytes
+    
+    Entries may carry tags (e.g. 'books', 'user:42'); invalidating a tag only
+    touches the entries registered under it. Expired entries are kept for
+    stale_ttl more seconds so get_or_compute can serve them while refreshing.
+    """
+    
+    def __init__(self, name, ttl, max_entries, max_bytes, stale_ttl=0):
+        self.name = name
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # key -> (value, expires_at, size, tags), oldest first
+        self._tag_index = {}  # tag -> set of keys
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.stale_hits = 0
+    
+    def _drop(self, key):
+        _, _, size, tags = self._entries.pop(key)
+        self._bytes -= size
+        for tag in tags:
+            keys = self._tag_index.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tag_index[tag]
+    
+    def lookup(self, key, allow_stale=False):
+        """
+        Get (value, is_fresh) for a key
+        
+        Expired entries still inside the stale window are returned with
+        is_fresh=False when allow_stale is set; otherwise (None, False) is a miss.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None, False
+            now = time.time()
+            if entry[1] <= now:
+                if now >= entry[1] + self.stale_ttl:
+                    self._drop(key)
+                    self.expirations += 1
+                elif allow_stale:
+                    self.stale_hits += 1
+                    return entry[0], False
+                self.misses += 1
+                return None, False
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0], True
+    
+    def get(self, key):
+        return self.lookup(key)[0]
+    
+    def set(self, key, value, ttl=None, tags=()):
+        tags = tuple(tags)
+        size = approximate_size(value)
+        expires_at = time.time() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            if size > self.max_bytes:
+                # Larger than the whole namespace; caching it would evict everything
+                return
+            self._entries[key] = (value, expires_at, size, tags)
+            self._bytes += size
+            for tag in tags:
+                self._tag_index.setdefault(tag, set()).add(key)
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                self._drop(next(iter(self._entries)))
+                self.evictions += 1
+    
+    def clear(self, pattern=None):
+        """Remove every entry, or those whose key contains pattern; returns the count removed"""
+        with self._lock:
+            if pattern is None:
+                removed = len(self._entries)
+                self._entries.clear()
+                self._tag_index.clear()
+                self._bytes = 0
+                return removed
+            keys = [key for key in self._entries if pattern in key]
+            for key in keys:
+                self._drop(key)
+            return len(keys)
+    
+    def invalidate(self, tag):
+        """Remove every entry registered under a tag; returns the count removed"""
+        with self._lock:
+            keys = self._tag_index.pop(tag, ())
+            for key in list(keys):
+                if key in self._entries:
+                    self._drop(key)
+            return len(keys)
+    
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'tags': len(self._tag_index),
+                'approx_bytes': self._bytes,
+                'max_entries': self.max_entries,
+                'max_bytes': self.max_bytes,
+                'ttl_seconds': self.ttl,
+                'stale_ttl_seconds': self.stale_ttl,
+                'hits': self.hits,
+                'stale_hits': self.stale_hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+                'evictions': self.evictions,
+                'expirations': self.expirations
+            }
+
+_cache_namespaces = {prefix: CacheNamespace(prefix, *config) for prefix, config in CACHE_NAMESPACES.items()}
+_default_cache = CacheNamespace('default', *CACHE_DEFAULT_NAMESPACE)
+
+def _cache_for(key):
+    for prefix, namespace in _cache_namespaces.items():
+        if key.startswith(prefix):
+            return namespace
+    return _default_cache
 
 def get_cached(key):
     """Get value from cache if not expired"""
-    if key in _cache:
-        if time.time() - _cache_timestamps[key] < CACHE_TTL:
-            return _cache[key]
-        else:
-            # Expired, remove it
-            del _cache[key]
-            del _cache_timestamps[key]
-    return None
+    return _cache_for(key).get(key)
+
+def set_cached(key, value, ttl=None, tags=()):
+    """Set value in cache (ttl overrides the namespace TTL; tags register it for invalidate_tags)"""
+    _cache_for(key).set(key, value, ttl, tags)
+
+# Invalidation counters let in-flight computations detect that their inputs changed
+_invalidation_lock = threading.Lock()
+_tag_generations = {}  # tag -> number of times it was invalidated
+_clear_generation = 0  # number of clear_cache calls
 
-def set_cached(key, value):
-    """Set value in cache"""
-    _cache[key] = value
-    _cache_timestamps[key] = time.time()
+def _cache_generation(tags):
+    with _invalidation_lock:
+        return _clear_generation, tuple(_tag_generations.get(tag, 0) for tag in tags)
+
+def invalidate_tags(*tags):
+    """Remove every cache entry registered under any of the given tags"""
+    with _invalidation_lock:
+        for tag in tags:
+            _tag_generations[tag] = _tag_generations.get(tag, 0) + 1
+    with _inflight_lock:
+        # Later callers must not join computations that started before the invalidation
+        for key in [key for key, (_, key_tags) in _inflight.items() if set(key_tags) & set(tags)]:
+            del _inflight[key]
+    for namespace in [_default_cache] + list(_cache_namespaces.values()):
+        for tag in tags:
+            namespace.invalidate(tag)
+
+def user_cache_tag(user_id):
+    return f"user:{user_id}"
+
+def user_context_tag(user_id):
+    # Separate from user_cache_tag, which reading activity invalidates
+    return f"user_context:{user_id}"
+
+def get_user_context(user_id):
+    """Subscription level, role and academic level of a user, cached for USER_CONTEXT_TTL"""
+    def compute():
+        conn = get_db()
+        try:
+            c = conn.cursor()
+            c.execute('SELECT subscription_level, role, academic_level FROM users WHERE id=?', (user_id,))
+            row = c.fetchone()
+        finally:
+            conn.close()
+        return {
+            'subscription_level': (row['subscription_level'] if row else None) or 'free',
+            'role': row['role'] if row else None,
+            'academic_level': row['academic_level'] if row else None
+        }
+    return get_or_compute(f"user_context_{user_id}", compute, tags=(user_context_tag(user_id),))
+
+def invalidate_user_context(user_id):
+    # The dashboard and recommendations (user_cache_tag) embed the subscription level too
+    invalidate_tags(user_context_tag(user_id), user_cache_tag(user_id))
 
 def clear_cache(pattern=None):
-    """Clear cache entries matching pattern or all if None"""
-    if pattern is None:
-        _cache.clear()
-        _cache_timestamps.clear()
+    """Clear cache entries whose key contains pattern, or all if None (prefer invalidate_tags)"""
+    global _clear_generation
+    with _invalidation_lock:
+        _clear_generation += 1
+    namespace = _cache_namespaces.get(pattern)
+    if namespace is not None:
+        # Pattern is a namespace prefix: every key in that namespace matches without scanning
+        namespace.clear()
+        for other in [_default_cache] + [ns for ns in _cache_namespaces.values() if ns is not namespace]:
+            other.clear(pattern)
+        return
+    for namespace in [_default_cache] + list(_cache_namespaces.values()):
+        namespace.clear(pattern)
+
+def cache_stats():
+    """Per-namespace cache statistics"""
+    stats = {prefix.rstrip('_'): namespace.stats() for prefix, namespace in _cache_namespaces.items()}
+    stats['default'] = _default_cache.stats()
+    return stats
+
+# Single-flight cache fills: one computation per key, concurrent callers wait for its result
+_inflight = {}  # cache key -> (Future of the running computation, its tags)
+_inflight_lock = threading.Lock()
+
+def _fill_cache(key, compute, ttl, tags, cacheable, future):
+    """Run a cache fill as the leader for key, publishing the result to waiting callers"""
+    generation = _cache_generation(tags)
+    try:
+        value = compute()
+        # Results computed across an invalidation of their tags may already be outdated
+        if (cacheable is None or cacheable(value)) and _cache_generation(tags) == generation:
+            set_cached(key, value, ttl, tags)
+    except Exception as e:
+        future.set_exception(e)
+        raise
     else:
-        keys_to_remove = [k for k in _cache.keys() if pattern in k]
-        for k in keys_to_remove:
-            del _cache[k]
-            del _cache_timestamps[k]
+        future.set_result(value)
+        return value
+    finally:
+        with _inflight_lock:
+            if _inflight.get(key, (None,))[0] is future:
+                del _inflight[key]
+
+def _refresh_in_background(key, compute, ttl, tags, cacheable):
+    with _inflight_lock:
+        if key in _inflight:
+            return
+        future = Future()
+        _inflight[key] = (future, tuple(tags))
+    
+    def run():
+        try:
+            with app.app_context():
+                _fill_cache(key, compute, ttl, tags, cacheable, future)
+        except Exception as e:
+            print(f"Error refreshing cache entry {key}: {e}")
+    
+    threading.Thread(target=run, name=f'cache-refresh-{key}', daemon=True).start()
+
+def get_or_compute(key, compute, ttl=None, tags=(), stale_while_revalidate=False, force=False, cacheable=None):
+    """
+    Get a cached value, computing it at most once per key across concurrent requests
+    
+    Args:
+        key: Cache key
+        compute: Zero-argument function producing the value; it must not depend on
+                 the request context when stale_while_revalidate is used
+        ttl: Optional TTL override
+        tags: Tags for invalidate_tags
+        stale_while_revalidate: Serve an expired entry within the namespace's stale
+                                window and refresh it in a background thread
+        force: Skip the cache read (the fill is still shared and cached)
+        cacheable: Optional predicate deciding whether a computed value is stored
+    """
+    if not force:
+        value, fresh = _cache_for(key).lookup(key, allow_stale=stale_while_revalidate)
+        if fresh:
+            return value
+        if value is not None:
+            _refresh_in_background(key, compute, ttl, tags, cacheable)
+            return value
+    
+    with _inflight_lock:
+        future, _ = _inflight.get(key, (None, None))
+        leader = future is None
+        if leader:
+            future = Future()
+            _inflight[key] = (future, tuple(tags))
+    
+    if not leader:
+        return future.result()
+    return _fill_cache(key, compute, ttl, tags, cacheable, future)
 
 # JWT Helper Functions
 def generate_token(user_id, email, role):
@@ -183,6 +906,8 @@ def require_auth(f):
                 return response, 401
             
             request.current_user = payload
+            # Current subscription level etc. from the database, cached per user (see get_user_context)
+            request.user_context = get_user_context(payload['user_id'])
             return f(*args, **kwargs)
         except Exception as e:
             # Ensure CORS headers are present even on errors
@@ -331,6 +1056,32 @@ def init_db():
     except sqlite3.OperationalError as e:
         print(f"Note: Some recommendation indexes may already exist: {e}")
     
+    # Book embeddings table (persistent embedding store, keyed by content hash)
+    c.execute('''CREATE TABLE IF NOT EXISTS book_embeddings
+                 (book_id INTEGER PRIMARY KEY,
+                  content_hash TEXT NOT NULL,
+                  embedding BLOB NOT NULL,
+                  updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)''')
+    
+    # User taste profiles (decayed sum of book embeddings; see UserProfileStore)
+    c.execute('''CREATE TABLE IF NOT EXISTS user_profiles
+                 (user_id INTEGER PRIMARY KEY,
+                  embedding BLOB NOT NULL,
+                  weight REAL NOT NULL,
+                  updated_at REAL NOT NULL)''')
+    
+    # Precomputed similar books (top-K per book, ordered by rank; see BookNeighborTable)
+    c.execute('''CREATE TABLE IF NOT EXISTS book_neighbors
+                 (book_id INTEGER NOT NULL,
+                  rank INTEGER NOT NULL,
+                  neighbor_id INTEGER NOT NULL,
+                  score REAL NOT NULL,
+                  PRIMARY KEY (book_id, rank)) WITHOUT ROWID''')
+    try:
+        c.execute('CREATE INDEX IF NOT EXISTS idx_book_neighbors_neighbor ON book_neighbors(neighbor_id)')
+    except sqlite3.OperationalError as e:
+        print(f"Note: Book neighbour index may already exist: {e}")
+    
     # Reading history table
     c.execute('''CREATE TABLE IF NOT EXISTS reading_history
                  (id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -386,6 +1137,28 @@ def init_db():
     except sqlite3.OperationalError:
         pass
     
+    # Per-row feedback counters rolled up by metrics_rollup (migration); rows that
+    # already had feedback are backfilled as a single feedback event
+    try:
+        c.execute('ALTER TABLE recommendation_feedback ADD COLUMN feedback_count INTEGER DEFAULT 0')
+        c.execute('ALTER TABLE recommendation_feedback ADD COLUMN click_count INTEGER DEFAULT 0')
+        c.execute('ALTER TABLE recommendation_feedback ADD COLUMN rated_count INTEGER DEFAULT 0')
+        c.execute('ALTER TABLE recommendation_feedback ADD COLUMN rating_sum REAL DEFAULT 0')
+        c.execute('ALTER TABLE recommendation_feedback ADD COLUMN feedback_at TIMESTAMP')
+        c.execute('''UPDATE recommendation_feedback
+                     SET feedback_count=1,
+                         click_count=CASE WHEN clicked THEN 1 ELSE 0 END,
+                         rated_count=CASE WHEN rating THEN 1 ELSE 0 END,
+                         rating_sum=CASE WHEN rating THEN rating ELSE 0 END,
+                         feedback_at=created_at
+                     WHERE feedback_type IS NOT NULL''')
+    except sqlite3.OperationalError:
+        pass
+    try:
+        c.execute('CREATE INDEX IF NOT EXISTS idx_rec_feedback_feedback_at ON recommendation_feedback(feedback_at)')
+    except sqlite3.OperationalError:
+        pass
+    
     # Subscription requests table
     c.execute('''CREATE TABLE IF NOT EXISTS subscription_requests
                  (id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -463,6 +1236,11 @@ def init_db():
         c.execute('CREATE INDEX IF NOT EXISTS idx_books_uploaded_by ON books(uploaded_by)')
         # Composite index for common filter combinations
         c.execute('CREATE INDEX IF NOT EXISTS idx_books_genre_level ON books(genre, academic_level)')
+        # Listing order (created_at DESC, id DESC) for keyset pagination, alone and behind each filter
+        c.execute('CREATE INDEX IF NOT EXISTS idx_books_created_id ON books(created_at DESC, id DESC)')
+        c.execute('CREATE INDEX IF NOT EXISTS idx_books_subscription_created ON books(subscription_level, created_at DESC, id DESC)')
+        c.execute('CREATE INDEX IF NOT EXISTS idx_books_genre_created ON books(genre, created_at DESC, id DESC)')
+        c.execute('CREATE INDEX IF NOT EXISTS idx_books_level_created ON books(academic_level, created_at DESC, id DESC)')
     except sqlite3.OperationalError as e:
         print(f"Note: Some book indexes may already exist: {e}")
     
@@ -487,6 +1265,7 @@ def init_db():
     try:
         c.execute('CREATE INDEX IF NOT EXISTS idx_feedback_user ON feedback(user_id)')
         c.execute('CREATE INDEX IF NOT EXISTS idx_feedback_book ON feedback(book_id)')
+        c.execute('CREATE INDEX IF NOT EXISTS idx_feedback_user_book ON feedback(user_id, book_id)')
         
         # Book reviews and likes indexes
         c.execute('CREATE INDEX IF NOT EXISTS idx_reviews_book ON book_reviews(book_id)')
@@ -630,16 +1409,337 @@ def load_sample_data():
     conn.close()
 
 # Collaborative Filtering Engine
+# Seconds between full rebuilds of the collaborative model from the database (corrects drift)
+COLLAB_REBUILD_INTERVAL = int(os.getenv('COLLAB_REBUILD_INTERVAL', '3600'))
+# Pending interaction deltas are merged into a new matrix at most this often (sooner for the acting user)
+COLLAB_MERGE_INTERVAL = float(os.getenv('COLLAB_MERGE_INTERVAL', '5'))
+# A merge copies the whole matrix, so merges forced by the acting user's request are limited to one per this many seconds
+COLLAB_FORCED_MERGE_INTERVAL = float(os.getenv('COLLAB_FORCED_MERGE_INTERVAL', '1'))
+# Upper bound on rows x users per block in precompute_similarities (caps the block product's size)
+COLLAB_SIMILARITY_BLOCK_ENTRIES = int(os.getenv('COLLAB_SIMILARITY_BLOCK_ENTRIES', str(2 ** 24)))
+
+def reading_weight(count, total_duration):
+    """Weight based on reading count and duration"""
+    count_weight = min(count * 0.3, 1.0)  # Max 1.0 for multiple reads
+    duration_weight = min((total_duration or 0) / 60.0, 1.0)  # 1 hour = 1.0
+    return (count_weight + duration_weight) / 2
+
+def feedback_weight(avg_rating):
+    """Rating normalized to 0-1 scale (assuming 1-5 rating)"""
+    return (avg_rating / 5.0) * 0.8  # Max 0.8
+
+def interaction_weight(interaction_type, avg_value, count):
+    """Different weights for different interaction types"""
+    avg_value = avg_value or 1.0
+    if interaction_type == 'view':
+        return 0.1 * min(count, 5)  # Max 0.5 for multiple views
+    elif interaction_type == 'download':
+        return 0.6
+    elif interaction_type == 'bookmark':
+        return 0.5
+    elif interaction_type == 'share':
+        return 0.4
+    return avg_value * 0.3
+
+
+# Popularity rankings (cold-start fallback)
+# Interactions lose half their weight every POPULARITY_HALF_LIFE_DAYS
+POPULARITY_HALF_LIFE_DAYS = float(os.getenv('POPULARITY_HALF_LIFE_DAYS', '14'))
+# Seconds between full rebuilds from the database; incremental updates are re-sorted at most every RESORT seconds
+POPULARITY_REBUILD_INTERVAL = int(os.getenv('POPULARITY_REBUILD_INTERVAL', '3600'))
+POPULARITY_RESORT_INTERVAL = float(os.getenv('POPULARITY_RESORT_INTERVAL', '5'))
+
+class PopularityIndex:
+    """
+    Time-decayed book popularity, kept sorted globally and per genre / academic level
+    
+    Scores are stored relative to a reference time: an event of weight w at time t
+    adds w * 2^((t - reference) / half_life). Decay then scales every score by the
+    same factor, so events are added in O(1) without touching other books and the
+    ranking order stays valid. Rankings are sorted arrays; a request takes a slice.
+    """
+    
+    def __init__(self, half_life_days=POPULARITY_HALF_LIFE_DAYS):
+        self.half_life = half_life_days * 86400
+        self._lock = threading.RLock()
+        self._reference = time.time()
+        self._scores = {}  # book id -> decayed score relative to the reference time
+        self._attributes = {}  # book id -> {'genre': ..., 'academic_level': ...}
+        self._rankings = {}  # None, ('genre', value) or ('academic_level', value) -> (book ids, scores), best first
+        self._dirty = False
+        self._sorted_at = 0.0
+        self._building = False
+        self.built_at = None
+    
+    def _decay(self, timestamp):
+        return 2.0 ** ((timestamp - self._reference) / self.half_life)
+    
+    def rebuild(self, conn=None):
+        """Recompute all scores from the interaction tables (aggregated per book and day)"""
+        own_conn = conn is None
+        if own_conn:
+            conn = get_db()
+        try:
+            c = conn.cursor()
+            reference = time.time()
+            scores = {}
+            
+            def add(book_id, age_days, weight):
+                if book_id is not None and weight > 0:
+                    scores[book_id] = scores.get(book_id, 0.0) + weight * 2.0 ** (-age_days * 86400 / self.half_life)
+            
+            age = "CAST(julianday('now') - julianday(created_at) AS INTEGER)"
+            c.execute(f'''SELECT book_id, {age} as age_days, COUNT(*) as count,
+                                 SUM(MIN(COALESCE(duration_minutes, 0), 60)) as capped_duration
+                          FROM reading_history GROUP BY book_id, age_days''')
+            for row in c.fetchall():
+                add(row['book_id'], row['age_days'],
+                    row['count'] * reading_weight(1, row['capped_duration'] / row['count']))
+            
+            c.execute(f'''SELECT book_id, {age} as age_days, COUNT(*) as count, AVG(rating) as avg_rating
+                          FROM feedback WHERE is_helpful = 1 AND rating > 0 GROUP BY book_id, age_days''')
+            for row in c.fetchall():
+                add(row['book_id'], row['age_days'], row['count'] * feedback_weight(row['avg_rating']))
+            
+            c.execute(f'''SELECT book_id, interaction_type, {age} as age_days, COUNT(*) as count,
+                                 AVG(interaction_value) as avg_value
+                          FROM user_book_interactions GROUP BY book_id, interaction_type, age_days''')
+            for row in c.fetchall():
+                add(row['book_id'], row['age_days'],
+                    row['count'] * interaction_weight(row['interaction_type'], row['avg_value'], 1))
+            
+            c.execute('SELECT id, genre, academic_level FROM books')
+            attributes = {row['id']: {'genre': row['genre'], 'academic_level': row['academic_level']}
+                          for row in c.fetchall()}
+        finally:
+            if own_conn:
+                conn.close()
+        
+        with self._lock:
+            # Deleted books drop out
+            self._scores = {book_id: score for book_id, score in scores.items() if book_id in attributes}
+            self._attributes = attributes
+            self._reference = reference
+            self._sort()
+            self.built_at = reference
+    
+    def build_in_background(self):
+        """Start a first build off the request path (no-op while one is running)"""
+        with self._lock:
+            if self._building:
+                return
+            self._building = True
+        
+        def run():
+            try:
+                self.rebuild()
+            except Exception as e:
+                print(f"Error building popularity index: {e}")
+            finally:
+                self._building = False
+        
+        threading.Thread(target=run, name='popularity-build', daemon=True).start()
+    
+    def record(self, conn, book_id, weight, timestamp=None):
+        """Add one interaction event of the given weight that happened at timestamp (default now)"""
+        if book_id is None or weight <= 0:
+            return
+        with self._lock:
+            if book_id not in self._attributes:
+                c = conn.cursor()
+                c.execute('SELECT genre, academic_level FROM books WHERE id=?', (book_id,))
+                row = c.fetchone()
+                if not row:
+                    return
+                self._attributes[book_id] = {'genre': row['genre'], 'academic_level': row['academic_level']}
+            self._scores[book_id] = self._scores.get(book_id, 0.0) + weight * self._decay(timestamp or time.time())
+            self._dirty = True
+    
+    def _sort(self):
+        book_ids = np.fromiter(self._scores.keys(), dtype=np.int64, count=len(self._scores))
+        scores = np.fromiter(self._scores.values(), dtype=np.float64, count=len(self._scores))
+        order = np.argsort(-scores, kind='stable')
+        book_ids, scores = book_ids[order], scores[order]
+        
+        rankings = {None: (book_ids, scores)}
+        for attribute in ('genre', 'academic_level'):
+            values = np.array([self._attributes[book_id][attribute] or '' for book_id in book_ids.tolist()],
+                              dtype=object)
+            for value in set(values.tolist()):
+                if value:
+                    mask = values == value
+                    rankings[(attribute, value)] = (book_ids[mask], scores[mask])
+        
+        self._rankings = rankings
+        self._dirty = False
+        self._sorted_at = time.time()
+    
+    def top(self, top_k=10, exclude=(), genre=None, academic_level=None):
+        """
+        Most popular books, best first, skipping excluded book ids
+        
+        Optional genre / academic_level pick the matching ranking. Returns
+        recommendation dicts with the score decayed to the current time, or
+        an empty list until the index has been built (the first call starts
+        a background build instead of scanning on the request path).
+        """
+        if self.built_at is None:
+            self.build_in_background()
+            return []
+        
+        with self._lock:
+            if self._dirty and time.time() - self._sorted_at >= POPULARITY_RESORT_INTERVAL:
+                self._sort()
+            if genre:
+                key = ('genre', genre)
+            elif academic_level:
+                key = ('academic_level', academic_level)
+            else:
+                key = None
+            book_ids, scores = self._rankings.get(key, (np.empty(0, dtype=np.int64), np.empty(0)))
+            now_factor = self._decay(time.time())
+        
+        # At most len(exclude) of the first top_k + len(exclude) entries can be excluded
+        exclude = np.asarray(list(exclude), dtype=np.int64)
+        end = top_k + len(exclude)
+        book_ids, scores = book_ids[:end], scores[:end]
+        if len(exclude):
+            keep = ~np.isin(book_ids, exclude)
+            book_ids, scores = book_ids[keep], scores[keep]
+        
+        return [{'book_id': int(book_id), 'score': float(score / now_factor), 'method': 'popularity'}
+                for book_id, score in zip(book_ids[:top_k], scores[:top_k])]
+    
+    def stats(self):
+        return {
+            'books': len(self._scores),
+            'rankings': len(self._rankings),
+            'half_life_days': self.half_life / 86400,
+            'built_at': datetime.datetime.fromtimestamp(self.built_at).isoformat() if self.built_at else None
+        }
+
+popularity_index = PopularityIndex()
+
+# Sparse user-item interaction matrix: CSR rows are users, columns are books
+class UserItemMatrix:
+    def __init__(self, user_ids, book_ids, rows, cols, values):
+        self.user_ids = np.asarray(user_ids, dtype=np.int64)
+        self.book_ids = np.asarray(book_ids, dtype=np.int64)
+        self.user_index = {user_id: i for i, user_id in enumerate(user_ids)}
+        self.book_index = {book_id: i for i, book_id in enumerate(book_ids)}
+        
+        # Duplicate (user, book) pairs from the different signals are summed
+        self.csr = sparse.csr_matrix((np.asarray(values, dtype=np.float64),
+                                      (np.asarray(rows, dtype=np.int64), np.asarray(cols, dtype=np.int64))),
+                                     shape=(len(user_ids), len(book_ids)))
+        self.csr.sum_duplicates()
+        self.csr.eliminate_zeros()
+        
+        # Only positive scores count as signals when recommending
+        self.positive = self.csr.copy()
+        self.positive.data = np.maximum(self.positive.data, 0.0)
+        self.positive.eliminate_zeros()
+        
+        self.norms = np.sqrt(np.asarray(self.csr.multiply(self.csr).sum(axis=1)).ravel())
+        
+        # Unit-length rows: cosine similarity becomes a plain sparse dot product
+        inverse_norms = np.zeros_like(self.norms)
+        np.divide(1.0, self.norms, out=inverse_norms, where=self.norms > 0)
+        self.normalized = (sparse.diags(inverse_norms) @ self.csr).tocsr()
+        # Book -> users view of the normalized matrix, so a product only touches co-interacting users
+        self.normalized_by_book = self.normalized.T.tocsr()
+    
+    def __contains__(self, user_id):
+        return user_id in self.user_index
+    
+    def __len__(self):
+        return len(self.user_ids)
+    
+    @property
+    def nnz(self):
+        return self.csr.nnz
+    
+    def user_row(self, user_id):
+        """Get (book indices, scores) of a user's non-zero interactions"""
+        i = self.user_index[user_id]
+        start, end = self.csr.indptr[i], self.csr.indptr[i + 1]
+        return self.csr.indices[start:end], self.csr.data[start:end]
+    
+    def user_books(self, user_id):
+        """Get the column indices of books the user has a positive score for"""
+        if user_id not in self.user_index:
+            return np.empty(0, dtype=np.int32)
+        i = self.user_index[user_id]
+        start, end = self.positive.indptr[i], self.positive.indptr[i + 1]
+        return self.positive.indices[start:end]
+
+    def with_updates(self, updates):
+        """
+        Copy of the matrix with (user_id, book_id) -> weight entries replaced
+        
+        Users and books missing from the matrix are appended. The update is a few
+        vectorized passes over the non-zeros; this matrix is left untouched so
+        readers holding it keep a consistent view.
+        """
+        user_ids = list(self.user_ids)
+        book_ids = list(self.book_ids)
+        user_index = dict(self.user_index)
+        book_index = dict(self.book_index)
+        for user_id, book_id in updates:
+            if user_id not in user_index:
+                user_index[user_id] = len(user_ids)
+                user_ids.append(user_id)
+            if book_id not in book_index:
+                book_index[book_id] = len(book_ids)
+                book_ids.append(book_id)
+        
+        coo = self.csr.tocoo()
+        rows, cols, values = coo.row.astype(np.int64), coo.col.astype(np.int64), coo.data
+        new_rows = np.array([user_index[user_id] for user_id, _ in updates], dtype=np.int64)
+        new_cols = np.array([book_index[book_id] for _, book_id in updates], dtype=np.int64)
+        new_values = np.array(list(updates.values()), dtype=np.float64)
+        
+        # Drop the old value of every updated pair, then append the new ones
+        keep = ~np.isin(rows * len(book_ids) + cols, new_rows * len(book_ids) + new_cols)
+        return UserItemMatrix(user_ids, book_ids,
+                              np.concatenate([rows[keep], new_rows]),
+                              np.concatenate([cols[keep], new_cols]),
+                              np.concatenate([values[keep], new_values]))
+
 class CollaborativeFiltering:
+    """
+    Long-lived collaborative model
+    
+    The matrix is built once from the database, then kept current by applying
+    per-pair deltas from reading/interaction/feedback events (apply_interaction).
+    Every merge or rebuild swaps in a new UserItemMatrix (copy-on-write) and bumps
+    the version; a periodic full rebuild (scheduler job) corrects drift.
+    """
+    
     def __init__(self):
         self.user_item_matrix = None
-        self.user_similarities = {}
-        
+        self.user_similarities = {}  # user id -> precomputed similar users (see precompute_similarities)
+        self._similarities_k = 0
+        self.version = 0
+        self.built_at = None  # time of the last full rebuild
+        self._pending = {}  # (user_id, book_id) -> pair weight not yet merged into the matrix
+        self._rebuild_log = None  # pair weights merged while a rebuild is scanning (None when not rebuilding)
+        self._last_merge = 0.0
+        self._building = False
+        self._lock = threading.RLock()
+
     def build_user_item_matrix(self, conn):
-        """Build user-item interaction matrix from database"""
+        """Build the sparse user-item interaction matrix from grouped database aggregates and publish it"""
+        matrix = self._scan(conn)
+        self._swap(matrix)
+        self.built_at = time.time()
+        return matrix
+    
+    def _scan(self, conn):
+        """Read the interaction tables into a new UserItemMatrix (None without users or books)"""
         c = conn.cursor()
         
-        # Get all users and books
+        # Get all users and books (ids only; the matrix stores interactions, not users x books)
         c.execute('SELECT id FROM users')
         users = [row['id'] for row in c.fetchall()]
         
@@ -649,178 +1749,529 @@ class CollaborativeFiltering:
         if not users or not books:
             return None
         
-        # Initialize matrix: users x books
-        matrix = {}
-        for user_id in users:
-            matrix[user_id] = {}
-            for book_id in books:
-                matrix[user_id][book_id] = 0.0
+        user_index = {user_id: i for i, user_id in enumerate(users)}
+        book_index = {book_id: i for i, book_id in enumerate(books)}
+        rows, cols, values = [], [], []
+        
+        def add(user_id, book_id, weight):
+            if user_id in user_index and book_id in book_index:
+                rows.append(user_index[user_id])
+                cols.append(book_index[book_id])
+                values.append(weight)
         
         # Weight 1: Reading history (implicit positive signal)
         c.execute('SELECT user_id, book_id, COUNT(*) as count, SUM(duration_minutes) as total_duration FROM reading_history GROUP BY user_id, book_id')
         for row in c.fetchall():
-            user_id = row['user_id']
-            book_id = row['book_id']
-            if user_id in matrix and book_id in matrix[user_id]:
-                # Weight based on reading count and duration
-                count_weight = min(row['count'] * 0.3, 1.0)  # Max 1.0 for multiple reads
-                duration_weight = min(row['total_duration'] / 60.0, 1.0)  # 1 hour = 1.0
-                matrix[user_id][book_id] += (count_weight + duration_weight) / 2
+            add(row['user_id'], row['book_id'], reading_weight(row['count'], row['total_duration']))
         
         # Weight 2: Positive feedback (explicit positive signal)
         c.execute('SELECT user_id, book_id, AVG(rating) as avg_rating, COUNT(*) as count FROM feedback WHERE is_helpful = 1 AND rating > 0 GROUP BY user_id, book_id')
         for row in c.fetchall():
-            user_id = row['user_id']
-            book_id = row['book_id']
-            if user_id in matrix and book_id in matrix[user_id]:
-                # Rating normalized to 0-1 scale (assuming 1-5 rating)
-                rating_weight = (row['avg_rating'] / 5.0) * 0.8  # Max 0.8
-                matrix[user_id][book_id] += rating_weight
+            add(row['user_id'], row['book_id'], feedback_weight(row['avg_rating']))
         
         # Weight 3: User-book interactions (explicit interactions)
         c.execute('''SELECT user_id, book_id, interaction_type, AVG(interaction_value) as avg_value, COUNT(*) as count
                      FROM user_book_interactions
                      GROUP BY user_id, book_id, interaction_type''')
         for row in c.fetchall():
-            user_id = row['user_id']
-            book_id = row['book_id']
-            interaction_type = row['interaction_type']
-            avg_value = row['avg_value'] or 1.0
-            count = row['count']
-            
-            if user_id in matrix and book_id in matrix[user_id]:
-                # Different weights for different interaction types
-                if interaction_type == 'view':
-                    weight = 0.1 * min(count, 5)  # Max 0.5 for multiple views
-                elif interaction_type == 'download':
-                    weight = 0.6
-                elif interaction_type == 'bookmark':
-                    weight = 0.5
-                elif interaction_type == 'share':
-                    weight = 0.4
-                else:
-                    weight = avg_value * 0.3
-                
-                matrix[user_id][book_id] += weight
+            add(row['user_id'], row['book_id'],
+                interaction_weight(row['interaction_type'], row['avg_value'], row['count']))
+        
+        return UserItemMatrix(users, books, rows, cols, values)
+    
+    def _swap(self, matrix, changed_users=None):
+        """Publish a new matrix version"""
+        with self._lock:
+            self.user_item_matrix = matrix
+            if changed_users is None:
+                # Precomputed neighbours belong to the previous matrix
+                self.user_similarities = {}
+                self._similarities_k = 0
+            else:
+                # Keep the offline neighbours of everyone whose row did not change
+                similarities = dict(self.user_similarities)
+                for user_id in changed_users:
+                    similarities.pop(user_id, None)
+                self.user_similarities = similarities
+            self.version += 1
+    
+    def _pair_weight(self, conn, user_id, book_id):
+        """Current total weight of one (user, book) pair, from indexed point lookups"""
+        c = conn.cursor()
+        weight = 0.0
+        
+        c.execute('''SELECT COUNT(*) as count, SUM(duration_minutes) as total_duration
+                     FROM reading_history WHERE user_id=? AND book_id=?''', (user_id, book_id))
+        row = c.fetchone()
+        if row['count']:
+            weight += reading_weight(row['count'], row['total_duration'])
+        
+        c.execute('''SELECT AVG(rating) as avg_rating FROM feedback
+                     WHERE user_id=? AND book_id=? AND is_helpful = 1 AND rating > 0''', (user_id, book_id))
+        row = c.fetchone()
+        if row['avg_rating'] is not None:
+            weight += feedback_weight(row['avg_rating'])
+        
+        c.execute('''SELECT interaction_type, AVG(interaction_value) as avg_value, COUNT(*) as count
+                     FROM user_book_interactions WHERE user_id=? AND book_id=?
+                     GROUP BY interaction_type''', (user_id, book_id))
+        for row in c.fetchall():
+            weight += interaction_weight(row['interaction_type'], row['avg_value'], row['count'])
+        
+        return weight
+    
+    def apply_interaction(self, conn, user_id, book_id):
+        """Apply the delta of a reading/interaction/feedback event (call after it is committed)"""
+        if user_id is None or book_id is None:
+            return
+        # A non-int id (e.g. the string "2") would add a duplicate column to the matrix
+        if not isinstance(user_id, (int, np.integer)) or not isinstance(book_id, (int, np.integer)) \
+                or isinstance(book_id, bool):
+            raise TypeError(f"user_id and book_id must be integers, got {user_id!r}, {book_id!r}")
+        user_id, book_id = int(user_id), int(book_id)
+        weight = self._pair_weight(conn, user_id, book_id)
+        with self._lock:
+            self._pending[(user_id, book_id)] = weight
+    
+    def _merge_pending(self):
+        with self._lock:
+            if not self._pending or self.user_item_matrix is None:
+                return
+            pending, self._pending = self._pending, {}
+            self._swap(self.user_item_matrix.with_updates(pending),
+                       changed_users={user_id for user_id, _ in pending})
+            self._last_merge = time.time()
+            if self._rebuild_log is not None:
+                self._rebuild_log.update(pending)
+    
+    def rebuild(self, conn=None):
+        """
+        Full rebuild from the database
+        
+        Deltas merged into the old matrix while the tables are being scanned may
+        be missing from the scan, so they are logged and applied again on top of
+        the new matrix before it is published. Pair weights are absolute totals,
+        so applying one twice is safe.
+        """
+        own_conn = conn is None
+        if own_conn:
+            conn = get_db()
+        with self._lock:
+            self._rebuild_log = {}
+        try:
+            matrix = self._scan(conn)
+        except Exception:
+            with self._lock:
+                self._rebuild_log = None
+            raise
+        finally:
+            if own_conn:
+                conn.close()
         
-        self.user_item_matrix = matrix
+        # Closing the log and publishing happen under one lock, so no merge falls in between
+        with self._lock:
+            merged_during_scan, self._rebuild_log = self._rebuild_log, None
+            if matrix is not None and merged_during_scan:
+                matrix = matrix.with_updates(merged_during_scan)
+            self._swap(matrix)
+            self.built_at = time.time()
+        
+        # Deltas still pending are merged on top as usual
+        self._merge_pending()
+        invalidate_tags('collab')
+        print(f"Collaborative model rebuilt (version {self.version}, "
+              f"{len(matrix) if matrix else 0} users, {matrix.nnz if matrix else 0} interactions)")
         return matrix
     
+    def build_in_background(self):
+        """Start a full rebuild on a background thread (no-op while one is running)"""
+        with self._lock:
+            if self._building:
+                return
+            self._building = True
+        
+        def run():
+            try:
+                self.rebuild()
+            except Exception as e:
+                print(f"Error building collaborative model: {e}")
+            finally:
+                self._building = False
+        
+        threading.Thread(target=run, name='collaborative-build', daemon=True).start()
+    
+    def refresh(self, conn, user_id=None):
+        """
+        Get the current matrix for serving a request
+        
+        Until the first build has finished this returns None (callers serve their
+        popularity / empty fallback) and starts the build in the background;
+        afterwards it only merges pending deltas (right away when they involve
+        user_id). Requests never scan the interaction tables: full rebuilds run
+        on background threads and in the scheduler.
+        """
+        if self.user_item_matrix is None:
+            # Also retried when events arrive for a catalog that had no interactions yet
+            if self.built_at is None or self._pending:
+                self.build_in_background()
+            return None
+        
+        if self._pending:
+            since_merge = time.time() - self._last_merge
+            forced = (since_merge >= COLLAB_FORCED_MERGE_INTERVAL
+                      and any(pending_user == user_id for pending_user, _ in list(self._pending)))
+            if forced or since_merge >= COLLAB_MERGE_INTERVAL:
+                self._merge_pending()
+        
+        return self.user_item_matrix
+    
+    def stats(self):
+        matrix = self.user_item_matrix
+        return {
+            'version': self.version,
+            'built_at': datetime.datetime.fromtimestamp(self.built_at).isoformat() if self.built_at else None,
+            'users': len(matrix) if matrix else 0,
+            'books': len(matrix.book_ids) if matrix else 0,
+            'interactions': matrix.nnz if matrix else 0,
+            'pending_updates': len(self._pending)
+        }
+    
     def calculate_user_similarity(self, user1_id, user2_id):
         """Calculate cosine similarity between two users"""
-        if not self.user_item_matrix:
+        matrix = self.user_item_matrix
+        if not matrix:
             return 0.0
         
-        if user1_id not in self.user_item_matrix or user2_id not in self.user_item_matrix:
+        if user1_id not in matrix or user2_id not in matrix:
             return 0.0
         
-        user1_vector = list(self.user_item_matrix[user1_id].values())
-        user2_vector = list(self.user_item_matrix[user2_id].values())
-        
-        # Calculate cosine similarity
-        dot_product = sum(a * b for a, b in zip(user1_vector, user2_vector))
-        magnitude1 = sum(a * a for a in user1_vector) ** 0.5
-        magnitude2 = sum(b * b for b in user2_vector) ** 0.5
+        i, j = matrix.user_index[user1_id], matrix.user_index[user2_id]
+        magnitude1 = matrix.norms[i]
+        magnitude2 = matrix.norms[j]
         
         if magnitude1 == 0 or magnitude2 == 0:
             return 0.0
         
-        similarity = dot_product / (magnitude1 * magnitude2)
-        return similarity
+        # Dot product over the books both users interacted with
+        dot_product = matrix.csr[i].multiply(matrix.csr[j]).sum()
+        return float(dot_product / (magnitude1 * magnitude2))
+    
+    @staticmethod
+    def _top_similar(matrix, row, similarities, top_k):
+        """Pick the top K positive similarities of one user (excluding the user), best first"""
+        similarities[row] = 0.0
+        candidates = np.flatnonzero(similarities > 0)
+        best = candidates[top_k_indices(similarities[candidates], top_k)]
+        return [{
+            'user_id': int(matrix.user_ids[i]),
+            'similarity': float(similarities[i])
+        } for i in best]
     
     def find_similar_users(self, user_id, top_k=10):
         """Find top K most similar users"""
         if not self.user_item_matrix or user_id not in self.user_item_matrix:
             return []
         
-        similarities = []
-        for other_user_id in self.user_item_matrix.keys():
-            if other_user_id != user_id:
-                similarity = self.calculate_user_similarity(user_id, other_user_id)
-                if similarity > 0:  # Only include positive similarities
-                    similarities.append({
-                        'user_id': other_user_id,
-                        'similarity': similarity
-                    })
+        if user_id in self.user_similarities and top_k <= self._similarities_k:
+            return self.user_similarities[user_id][:top_k]
         
-        # Sort by similarity and return top K
-        similarities.sort(key=lambda x: x['similarity'], reverse=True)
-        return similarities[:top_k]
+        # Cosine similarity to every user: one sparse matrix-vector product on unit rows,
+        # restricted to the columns (books) this user interacted with
+        matrix = self.user_item_matrix
+        i = matrix.user_index[user_id]
+        start, end = matrix.normalized.indptr[i], matrix.normalized.indptr[i + 1]
+        books = matrix.normalized.indices[start:end]
+        similarities = matrix.normalized_by_book[books].T @ matrix.normalized.data[start:end]
+        return self._top_similar(matrix, i, similarities, top_k)
     
-    def get_collaborative_recommendations(self, user_id, top_k=10, min_similarity=0.1):
-        """Get recommendations based on similar users' preferences"""
-        if not self.user_item_matrix or user_id not in self.user_item_matrix:
+    def precompute_similarities(self, top_k=20, batch_size=1024):
+        """
+        Compute the top K similar users of every user in batches (offline all-pairs mode)
+        
+        Each batch multiplies a block of normalized rows by the transposed matrix
+        and stays sparse: only users sharing a book with a row are stored, and
+        the top K are picked from each CSR row's data. batch_size shrinks with
+        the user count so a block never exceeds COLLAB_SIMILARITY_BLOCK_ENTRIES.
+        Results are served by find_similar_users until the matrix is rebuilt.
+        """
+        matrix = self.user_item_matrix
+        if not matrix:
+            return {}
+        
+        batch_size = max(1, min(batch_size, COLLAB_SIMILARITY_BLOCK_ENTRIES // len(matrix)))
+        similarities_by_user = {}
+        for start in range(0, len(matrix), batch_size):
+            block = (matrix.normalized[start:start + batch_size] @ matrix.normalized_by_book).tocsr()
+            block.sort_indices()
+            for offset in range(block.shape[0]):
+                row = start + offset
+                users = block.indices[block.indptr[offset]:block.indptr[offset + 1]]
+                similarities = block.data[block.indptr[offset]:block.indptr[offset + 1]]
+                keep = (similarities > 0) & (users != row)
+                users, similarities = users[keep], similarities[keep]
+                best = top_k_indices(similarities, top_k)
+                similarities_by_user[int(matrix.user_ids[row])] = [{
+                    'user_id': int(matrix.user_ids[users[i]]),
+                    'similarity': float(similarities[i])
+                } for i in best]
+        
+        self.user_similarities = similarities_by_user
+        self._similarities_k = top_k
+        return similarities_by_user
+    
+    def _popular_books(self, exclude, top_k, genre=None, academic_level=None):
+        """Most popular books the user has not interacted with yet (see PopularityIndex)"""
+        return popularity_index.top(top_k, exclude=self.user_item_matrix.book_ids[exclude],
+                                    genre=genre, academic_level=academic_level)
+    
+    def get_collaborative_recommendations(self, user_id, top_k=10, min_similarity=0.1, genre=None, academic_level=None):
+        """
+        Get recommendations based on similar users' preferences
+        
+        genre / academic_level narrow the popularity fallback used for cold-start users.
+        """
+        matrix = self.user_item_matrix
+        if matrix is None and self.built_at is None:
+            # Still building: popular books meanwhile
+            return popularity_index.top(top_k, genre=genre, academic_level=academic_level)
+        if not matrix:
             return []
         
         # Check if user has any interactions (cold start problem)
-        user_interactions = set()
-        user_total_score = 0.0
-        for book_id, score in self.user_item_matrix[user_id].items():
-            if score > 0:
-                user_interactions.add(book_id)
-                user_total_score += score
+        user_interactions = matrix.user_books(user_id)
         
         # If user has very few interactions, use popularity-based fallback
         if len(user_interactions) < 3:
-            # Return most popular books (by total interaction score across all users)
-            book_popularity = {}
-            for other_user_id, interactions in self.user_item_matrix.items():
-                if other_user_id != user_id:
-                    for book_id, score in interactions.items():
-                        if book_id not in user_interactions and score > 0:
-                            if book_id not in book_popularity:
-                                book_popularity[book_id] = 0.0
-                            book_popularity[book_id] += score
-            
-            recommendations = sorted(book_popularity.items(), key=lambda x: x[1], reverse=True)[:top_k]
-            return [{'book_id': book_id, 'score': score, 'method': 'popularity'} 
-                   for book_id, score in recommendations]
+            return self._popular_books(user_interactions, top_k, genre, academic_level)
         
         # Find similar users
         similar_users = self.find_similar_users(user_id, top_k=20)
         
         if not similar_users:
             # Fallback to popularity if no similar users
-            book_popularity = {}
-            for other_user_id, interactions in self.user_item_matrix.items():
-                if other_user_id != user_id:
-                    for book_id, score in interactions.items():
-                        if book_id not in user_interactions and score > 0:
-                            if book_id not in book_popularity:
-                                book_popularity[book_id] = 0.0
-                            book_popularity[book_id] += score
-            
-            recommendations = sorted(book_popularity.items(), key=lambda x: x[1], reverse=True)[:top_k]
-            return [{'book_id': book_id, 'score': score, 'method': 'popularity'} 
-                   for book_id, score in recommendations]
+            return self._popular_books(user_interactions, top_k, genre, academic_level)
         
         # Calculate recommendation scores using collaborative filtering
-        book_scores = {}
         total_similarity = sum(su['similarity'] for su in similar_users)
-        
+        weights = np.zeros(len(matrix))
         for similar_user in similar_users:
             similarity = similar_user['similarity']
             if similarity < min_similarity:
                 continue
-            
-            other_user_id = similar_user['user_id']
             # Normalize similarity to sum to 1 (weighted average)
-            weight = similarity / total_similarity if total_similarity > 0 else 0
-            
-            for book_id, score in self.user_item_matrix[other_user_id].items():
-                if book_id not in user_interactions and score > 0:
-                    if book_id not in book_scores:
-                        book_scores[book_id] = 0.0
-                    # Weighted score: normalized_similarity * interaction_score
-                    book_scores[book_id] += weight * score
+            weights[matrix.user_index[similar_user['user_id']]] = similarity / total_similarity if total_similarity > 0 else 0
+        
+        # Weighted score: normalized_similarity * interaction_score, summed over similar users
+        book_scores = matrix.positive.T @ weights
+        book_scores[user_interactions] = 0.0
         
         # Sort by score and return top K
-        recommendations = sorted(book_scores.items(), key=lambda x: x[1], reverse=True)[:top_k]
-        return [{'book_id': book_id, 'score': score, 'method': 'collaborative'} 
-               for book_id, score in recommendations]
+        candidates = np.flatnonzero(book_scores > 0)
+        best = candidates[top_k_indices(book_scores[candidates], top_k)]
+        return [{'book_id': int(matrix.book_ids[j]), 'score': float(book_scores[j]), 'method': 'collaborative'}
+                for j in best]
 
 collaborative_engine = CollaborativeFiltering()
 
+# Implicit-feedback matrix factorization (ALS) over the collaborative user-item matrix
+ALS_FACTORS = int(os.getenv('ALS_FACTORS', '32'))
+ALS_ITERATIONS = int(os.getenv('ALS_ITERATIONS', '15'))
+ALS_REGULARIZATION = float(os.getenv('ALS_REGULARIZATION', '0.1'))
+# Confidence of an observed interaction is 1 + alpha * weight
+ALS_ALPHA = float(os.getenv('ALS_ALPHA', '40'))
+# Worker threads for the per-user/per-book solves (NumPy releases the GIL inside BLAS/LAPACK)
+ALS_THREADS = int(os.getenv('ALS_THREADS', str(os.cpu_count() or 4)))
+ALS_MODEL_PATH = os.getenv('ALS_MODEL_PATH', 'bookgenie_als.npz')
+ALS_TRAIN_INTERVAL = int(os.getenv('ALS_TRAIN_INTERVAL', '3600'))
+
+class ImplicitALS:
+    """
+    Implicit ALS (Hu, Koren & Volinsky) trained on the weighted UserItemMatrix
+    
+    Alternates closed-form solves for user and book factors. Scoring a user is
+    one dot product of their factor vector against the book factor matrix.
+    Users who joined after training are folded in with a single solve against
+    the current book factors.
+    """
+    
+    def __init__(self, factors=ALS_FACTORS, iterations=ALS_ITERATIONS, regularization=ALS_REGULARIZATION,
+                 alpha=ALS_ALPHA, threads=ALS_THREADS, path=ALS_MODEL_PATH):
+        self.factors = factors
+        self.iterations = iterations
+        self.regularization = regularization
+        self.alpha = alpha
+        self.threads = max(1, threads)
+        self.path = path
+        self.trained_at = None
+        self.matrix_version = None
+        self.training_seconds = None
+        # Published together as one tuple: (user_index, book_ids, book_index, user_factors, item_factors, item_gram)
+        self._model = None
+    
+    @property
+    def is_trained(self):
+        return self._model is not None
+    
+    def _solve_rows(self, confidence, fixed, pool, block_size=256):
+        """
+        Solve the factors of every row of confidence (CSR of alpha * weight) against fixed factors
+        
+        x = (F^T F + F^T (C - I) F + reg*I)^-1 F^T C p, where only the row's
+        non-zero columns contribute to the correction term.
+        """
+        gram = fixed.T @ fixed + self.regularization * np.eye(fixed.shape[1])
+        solved = np.zeros((confidence.shape[0], fixed.shape[1]))
+        indptr, indices, data = confidence.indptr, confidence.indices, confidence.data
+        
+        def solve_block(start):
+            for row in range(start, min(start + block_size, confidence.shape[0])):
+                lo, hi = indptr[row], indptr[row + 1]
+                if lo == hi:
+                    continue
+                rows = fixed[indices[lo:hi]]
+                weights = data[lo:hi]
+                solved[row] = np.linalg.solve(gram + (rows.T * weights) @ rows, rows.T @ (1.0 + weights))
+        
+        list(pool.map(solve_block, range(0, confidence.shape[0], block_size)))
+        return solved
+    
+    def train(self, matrix, version=None):
+        """Fit user and book factors to a UserItemMatrix and publish them"""
+        if matrix is None or matrix.positive.nnz == 0:
+            return False
+        
+        start_time = time.time()
+        confidence = (matrix.positive * self.alpha).tocsr()
+        confidence_by_book = confidence.T.tocsr()
+        
+        rng = np.random.default_rng(42)
+        user_factors = rng.normal(scale=0.01, size=(confidence.shape[0], self.factors))
+        item_factors = rng.normal(scale=0.01, size=(confidence.shape[1], self.factors))
+        with ThreadPoolExecutor(max_workers=self.threads, thread_name_prefix='als') as pool:
+            for _ in range(self.iterations):
+                user_factors = self._solve_rows(confidence, item_factors, pool)
+                item_factors = self._solve_rows(confidence_by_book, user_factors, pool)
+        
+        self._publish(matrix.user_ids, matrix.book_ids, user_factors, item_factors)
+        self.trained_at = time.time()
+        self.matrix_version = version
+        self.training_seconds = round(self.trained_at - start_time, 2)
+        print(f"ALS model trained: {len(matrix)} users, {len(matrix.book_ids)} books, "
+              f"{self.factors} factors, {self.iterations} iterations ({self.training_seconds}s)")
+        return True
+    
+    def _publish(self, user_ids, book_ids, user_factors, item_factors):
+        item_factors = np.asarray(item_factors, dtype=np.float32)
+        item_gram = item_factors.T.astype(np.float64) @ item_factors + self.regularization * np.eye(item_factors.shape[1])
+        self._model = (
+            {int(user_id): i for i, user_id in enumerate(user_ids)},
+            np.asarray(book_ids, dtype=np.int64),
+            {int(book_id): j for j, book_id in enumerate(book_ids)},
+            np.asarray(user_factors, dtype=np.float32),
+            item_factors,
+            item_gram
+        )
+    
+    def _fold_in(self, model, matrix, user_id):
+        """Factor vector of a user who is not in the model, from their current interactions"""
+        _, _, book_index, _, item_factors, item_gram = model
+        if matrix is None or user_id not in matrix:
+            return None
+        i = matrix.user_index[user_id]
+        start, end = matrix.positive.indptr[i], matrix.positive.indptr[i + 1]
+        columns = [book_index.get(int(book_id), -1) for book_id in matrix.book_ids[matrix.positive.indices[start:end]]]
+        known = np.asarray(columns, dtype=np.int64) >= 0
+        if not known.any():
+            return None
+        
+        rows = item_factors[np.asarray(columns, dtype=np.int64)[known]].astype(np.float64)
+        weights = self.alpha * matrix.positive.data[start:end][known]
+        return np.linalg.solve(item_gram + (rows.T * weights) @ rows, rows.T @ (1.0 + weights)).astype(np.float32)
+    
+    def recommend(self, user_id, top_k=10, matrix=None):
+        """
+        Top K books for a user, excluding books they already interacted with
+        
+        Returns None when the model cannot score this user (not trained, or no
+        known interactions), so callers can fall back to user-kNN.
+        """
+        model = self._model
+        if model is None:
+            return None
+        user_index, book_ids, book_index, user_factors, item_factors, _ = model
+        
+        if user_id in user_index:
+            vector = user_factors[user_index[user_id]]
+        else:
+            vector = self._fold_in(model, matrix, user_id)
+        if vector is None:
+            return None
+        
+        scores = item_factors @ vector
+        if matrix is not None and user_id in matrix:
+            seen = [book_index[int(book_id)] for book_id in matrix.book_ids[matrix.user_books(user_id)]
+                    if int(book_id) in book_index]
+            scores[seen] = 0.0
+        
+        candidates = np.flatnonzero(scores > 0)
+        best = candidates[top_k_indices(scores[candidates], top_k)]
+        return [{'book_id': int(book_ids[j]), 'score': float(scores[j]), 'method': 'als'} for j in best]
+    
+    def save(self):
+        """Persist the factors to disk (written to a temporary file, then renamed)"""
+        model = self._model
+        if model is None:
+            return
+        user_index, book_ids, _, user_factors, item_factors, _ = model
+        user_ids = np.empty(len(user_index), dtype=np.int64)
+        for user_id, i in user_index.items():
+            user_ids[i] = user_id
+        
+        try:
+            tmp_path = f"{self.path}.tmp.npz"
+            np.savez(tmp_path,
+                     user_ids=user_ids,
+                     book_ids=book_ids,
+                     user_factors=user_factors,
+                     item_factors=item_factors,
+                     params=np.array([self.factors, self.iterations, self.regularization, self.alpha]))
+            os.replace(tmp_path, self.path)
+        except Exception as e:
+            print(f"Error saving ALS model: {e}")
+    
+    def load(self):
+        """Restore factors saved by a previous run; returns False if there are none (or they do not match the config)"""
+        if not os.path.exists(self.path):
+            return False
+        try:
+            data = np.load(self.path)
+            if data['item_factors'].shape[1] != self.factors:
+                print(f"Ignoring ALS model at {self.path}: trained with {data['item_factors'].shape[1]} factors")
+                return False
+            self._publish(data['user_ids'], data['book_ids'], data['user_factors'], data['item_factors'])
+            self.trained_at = os.path.getmtime(self.path)
+            print(f"Loaded ALS model from {self.path} ({len(data['user_ids'])} users, {len(data['book_ids'])} books)")
+            return True
+        except Exception as e:
+            print(f"Error loading ALS model: {e}")
+            return False
+    
+    def stats(self):
+        model = self._model
+        return {
+            'trained': model is not None,
+            'trained_at': datetime.datetime.fromtimestamp(self.trained_at).isoformat() if self.trained_at else None,
+            'matrix_version': self.matrix_version,
+            'training_seconds': self.training_seconds,
+            'users': len(model[0]) if model else 0,
+            'books': len(model[1]) if model else 0,
+            'factors': self.factors,
+            'iterations': self.iterations,
+            'threads': self.threads
+        }
+
+als_engine = ImplicitALS()
+
 # AI Learning Loop Engine
 class AILearningLoop:
     def __init__(self):
@@ -828,110 +2279,88 @@ class AILearningLoop:
         self.retrain_interval_hours = 24  # Retrain every 24 hours
         
     def record_recommendation_shown(self, conn, user_id, recommendation_type, book_id, position, query_context=None, recommendation_id=None):
-        """Record that a recommendation was shown to a user"""
-        c = conn.cursor()
-        
+        """Record that a recommendation was shown to a user (queued on the event writer; conn is not used)"""
         if recommendation_id is None:
             recommendation_id = f"{user_id}_{recommendation_type}_{book_id}_{int(time.time())}"
         
         try:
-            c.execute('''INSERT INTO recommendation_feedback
-                         (user_id, recommendation_id, recommendation_type, book_id, position, query_context)
-                         VALUES (?, ?, ?, ?, ?, ?)''',
-                     (user_id, recommendation_id, recommendation_type, book_id, position, query_context))
-            conn.commit()
+            event_writer.write('recommendation_feedback', user_id=user_id, recommendation_id=recommendation_id,
+                               recommendation_type=recommendation_type, book_id=book_id, position=position,
+                               query_context=query_context)
             return recommendation_id
         except Exception as e:
             print(f"Error recording recommendation shown: {e}")
-            conn.rollback()
             return None
     
     def record_recommendation_feedback(self, conn, recommendation_id, clicked=False, rating=None, feedback_type='click'):
         """Record user feedback on a recommendation"""
+        # The row it updates may still be queued on the event writer
+        event_writer.flush()
         c = conn.cursor()
         
         try:
+            # Each call counts as one feedback event towards the metrics, as before
             c.execute('''UPDATE recommendation_feedback
-                         SET clicked=?, rating=?, feedback_type=?
+                         SET clicked=?, rating=?, feedback_type=?,
+                             feedback_count=feedback_count + 1,
+                             click_count=click_count + ?,
+                             rated_count=rated_count + ?,
+                             rating_sum=rating_sum + ?,
+                             feedback_at=CURRENT_TIMESTAMP
                          WHERE recommendation_id=?''',
-                     (1 if clicked else 0, rating, feedback_type, recommendation_id))
+                     (1 if clicked else 0, rating, feedback_type,
+                      1 if clicked else 0, 1 if rating else 0, rating if rating else 0,
+                      recommendation_id))
             conn.commit()
             
-            # Update metrics
-            self._update_metrics(conn, recommendation_id)
+            # Metrics are recomputed by the metrics_rollup background job
             return True
         except Exception as e:
             print(f"Error recording recommendation feedback: {e}")
             conn.rollback()
             return False
     
-    def _update_metrics(self, conn, recommendation_id):
-        """Update recommendation performance metrics"""
-        c = conn.cursor()
-        
-        # Get recommendation details
-        c.execute('''SELECT recommendation_type, DATE(created_at) as date, clicked, rating
-                     FROM recommendation_feedback
-                     WHERE recommendation_id=?''', (recommendation_id,))
-        rec = c.fetchone()
+    def rollup_metrics(self, conn, days=2):
+        """Recompute daily recommendation metrics from recommendation_feedback.
         
-        if not rec:
-            return
+        Only dates holding rows that received feedback in the last `days` days
+        are rebuilt. total_shown keeps its original meaning: the number of
+        feedback events recorded for that type and date (not impressions).
+        """
+        c = conn.cursor()
+        touched = '''SELECT DISTINCT DATE(created_at) FROM recommendation_feedback
+                     WHERE feedback_at >= DATETIME('now', '-' || ? || ' days')'''
         
-        rec_type = rec['recommendation_type']
-        date = rec['date']
+        try:
+            c.execute(f'DELETE FROM recommendation_metrics WHERE date IN ({touched})', (days,))
+            c.execute(f'''INSERT INTO recommendation_metrics
+                          (recommendation_type, date, total_shown, total_clicked, total_rated, avg_rating, click_through_rate)
+                          SELECT recommendation_type,
+                                 DATE(created_at) as date,
+                                 SUM(feedback_count),
+                                 SUM(click_count),
+                                 SUM(rated_count),
+                                 SUM(rating_sum) / NULLIF(SUM(rated_count), 0),
+                                 SUM(click_count) * 100.0 / SUM(feedback_count)
+                          FROM recommendation_feedback
+                          WHERE feedback_count > 0 AND DATE(created_at) IN ({touched})
+                          GROUP BY recommendation_type, DATE(created_at)''', (days,))
+            conn.commit()
+            return c.rowcount
+        except Exception as e:
+            print(f"Error rolling up recommendation metrics: {e}")
+            conn.rollback()
+            return 0
+    
+    def get_recommendation_performance(self, conn, recommendation_type=None, days=30):
+        """Get recommendation performance metrics"""
+        c = conn.cursor()
         
-        # Get or create metrics record
-        c.execute('''SELECT * FROM recommendation_metrics
-                     WHERE recommendation_type=? AND date=?''', (rec_type, date))
-        metrics = c.fetchone()
-        
-        if metrics:
-            # Update existing metrics
-            new_total_shown = metrics['total_shown'] + 1
-            new_total_clicked = metrics['total_clicked'] + (1 if rec['clicked'] else 0)
-            new_total_rated = metrics['total_rated'] + (1 if rec['rating'] else 0)
-            
-            # Calculate new average rating
-            if rec['rating']:
-                if metrics['avg_rating']:
-                    new_avg_rating = ((metrics['avg_rating'] * metrics['total_rated']) + rec['rating']) / new_total_rated
-                else:
-                    new_avg_rating = rec['rating']
-            else:
-                new_avg_rating = metrics['avg_rating']
-            
-            new_ctr = (new_total_clicked / new_total_shown) * 100 if new_total_shown > 0 else 0
-            
-            c.execute('''UPDATE recommendation_metrics
-                         SET total_shown=?, total_clicked=?, total_rated=?, avg_rating=?, 
-                             click_through_rate=?, updated_at=CURRENT_TIMESTAMP
-                         WHERE recommendation_type=? AND date=?''',
-                     (new_total_shown, new_total_clicked, new_total_rated, new_avg_rating, new_ctr, rec_type, date))
-        else:
-            # Create new metrics record
-            total_shown = 1
-            total_clicked = 1 if rec['clicked'] else 0
-            total_rated = 1 if rec['rating'] else 0
-            avg_rating = rec['rating'] if rec['rating'] else None
-            ctr = (total_clicked / total_shown) * 100 if total_shown > 0 else 0
-            
-            c.execute('''INSERT INTO recommendation_metrics
-                         (recommendation_type, date, total_shown, total_clicked, total_rated, avg_rating, click_through_rate)
-                         VALUES (?, ?, ?, ?, ?, ?, ?)''',
-                     (rec_type, date, total_shown, total_clicked, total_rated, avg_rating, ctr))
-        
-        conn.commit()
-    
-    def get_recommendation_performance(self, conn, recommendation_type=None, days=30):
-        """Get recommendation performance metrics"""
-        c = conn.cursor()
-        
-        query = '''SELECT recommendation_type, date, total_shown, total_clicked, total_rated, 
-                          avg_rating, click_through_rate
-                   FROM recommendation_metrics
-                   WHERE date >= DATE('now', '-' || ? || ' days')'''
-        params = [days]
+        query = '''SELECT recommendation_type, date, total_shown, total_clicked, total_rated, 
+                          avg_rating, click_through_rate
+                   FROM recommendation_metrics
+                   WHERE date >= DATE('now', '-' || ? || ' days')'''
+        params = [days]
         
         if recommendation_type:
             query += ' AND recommendation_type = ?'
@@ -1152,10 +2581,9 @@ class ElasticsearchService:
             return False
         
         try:
-            # Generate embedding if not provided
+            # Reuse the stored embedding (or generate it) if not provided
             if embedding is None:
-                text = f"{book.get('title', '')} {book.get('abstract', '')} {book.get('tags', '')}"
-                embedding = ai_model.encode([text])[0].tolist()
+                embedding = ai_engine.get_book_embedding(book['id'], book_embedding_text(book)).tolist()
             
             doc = {
                 "id": book['id'],
@@ -1197,7 +2625,7 @@ class ElasticsearchService:
         
         try:
             # Generate query embedding
-            query_embedding = ai_model.encode([query])[0].tolist()
+            query_embedding = query_encoder.encode(query).tolist()
             
             # Build query
             must_clauses = []
@@ -1287,10 +2715,12 @@ class ElasticsearchService:
             return False
         
         try:
+            # Encode every new or changed book in batches up front
+            ai_engine.generate_embeddings(books)
+            
             actions = []
             for book in books:
-                text = f"{book.get('title', '')} {book.get('abstract', '')} {book.get('tags', '')}"
-                embedding = ai_model.encode([text])[0].tolist()
+                embedding = ai_engine.book_embeddings[book['id']].tolist()
                 
                 doc = {
                     "id": book['id'],
@@ -1356,199 +2786,226 @@ class ElasticsearchService:
 es_service = ElasticsearchService()
 
 # Hybrid Recommendation Engine
-class HybridRecommendationEngine:
-    def __init__(self, ai_engine, collaborative_engine):
-        self.ai_engine = ai_engine
-        self.collaborative_engine = collaborative_engine
-    
-    def get_content_based_recommendations(self, user_id, conn, top_k=10):
-        """Get content-based recommendations based on user's reading history"""
-        c = conn.cursor()
-        
-        # Get user's recently read books
-        c.execute('''SELECT DISTINCT book_id FROM reading_history 
-                     WHERE user_id=? ORDER BY created_at DESC LIMIT 5''', (user_id,))
-        recent_books = c.fetchall()
-        
-        if not recent_books:
-            return []
-        
-        # Get details of recently read books
-        book_ids = [row['book_id'] for row in recent_books]
-        placeholders = ','.join(['?'] * len(book_ids))
-        c.execute(f'SELECT * FROM books WHERE id IN ({placeholders})', book_ids)
-        
-        user_books = []
-        for row in c.fetchall():
-            user_books.append({
-                'id': row['id'],
-                'title': row['title'],
-                'author': row['author'],
-                'abstract': row['abstract'] if row['abstract'] else '',
-                'genre': row['genre'] if row['genre'] else '',
-                'academic_level': row['academic_level'] if row['academic_level'] else '',
-                'tags': row['tags'].split(',') if row['tags'] else [],
-                'cover_image': row_get(row, 'cover_image', 'book')
-            })
-        
-        # Get all other books (excluding user's read books)
-        c.execute(f'SELECT * FROM books WHERE id NOT IN ({placeholders})', book_ids)
-        candidate_books = []
-        for row in c.fetchall():
-            candidate_books.append({
-                'id': row['id'],
-                'title': row['title'],
-                'author': row['author'],
-                'abstract': row['abstract'] if row['abstract'] else '',
-                'genre': row['genre'] if row['genre'] else '',
-                'academic_level': row['academic_level'] if row['academic_level'] else '',
-                'tags': row['tags'].split(',') if row['tags'] else [],
-                'cover_image': row_get(row, 'cover_image', 'book')
-            })
-        
-        if not candidate_books:
-            return []
-        
-        # Generate embeddings for user's books and candidates
-        all_books = user_books + candidate_books
-        self.ai_engine.generate_embeddings(all_books, use_cache=True)
+# Recommendation pipeline: candidate generators run concurrently, then one vectorized re-rank
+HYBRID_BRANCH_WORKERS = int(os.getenv('HYBRID_BRANCH_WORKERS', '8'))
+# Seconds a generator may take before the response is built without it
+HYBRID_BRANCH_TIMEOUT = float(os.getenv('HYBRID_BRANCH_TIMEOUT', '2.0'))
+# Candidates each generator may contribute
+RECOMMENDATION_CANDIDATE_LIMIT = int(os.getenv('RECOMMENDATION_CANDIDATE_LIMIT', '200'))
+
+class RecommendationPipeline:
+    """
+    Staged recommendations: cheap candidate generators, then one vectorized re-rank
+    
+    A generator is a function (user_id, conn, limit) -> (book_ids, scores)
+    registered under a name with a default fusion weight and a family
+    ('content' or 'collaborative'); a request's content / collaborative
+    weights are each shared among their family. Generators run
+    concurrently on a bounded pool, each with its own connection and a shared
+    deadline; one that raises or misses the deadline is left out and its
+    weight is shared among the others. The re-ranker puts the candidates in a
+    (books x generators) score matrix, normalizes each column, fuses them with
+    one matrix-vector product and drops books the user has already read.
+    """
+    
+    def __init__(self, max_workers=HYBRID_BRANCH_WORKERS, timeout=HYBRID_BRANCH_TIMEOUT,
+                 limit=RECOMMENDATION_CANDIDATE_LIMIT):
+        self.timeout = timeout
+        self.limit = limit
+        self._generators = {}  # name -> (func, default weight, normalization, family)
+        # Bounded pool shared by all requests; each running generator holds a background
+        # pool connection, so at most half of that pool goes to generators
+        self._pool = ThreadPoolExecutor(max_workers=max(1, min(max_workers, DB_BACKGROUND_POOL_SIZE // 2)),
+                                        thread_name_prefix='candidates')
+    
+    def register(self, name, func, weight=0.1, normalize='max', family='content'):
+        """
+        Register a candidate generator
         
-        # Create a query from user's reading preferences
-        # Combine titles, abstracts, and genres from user's books
-        query_parts = []
-        for book in user_books:
-            query_parts.append(book['title'])
-            if book['abstract']:
-                query_parts.append(book['abstract'][:200])  # Limit abstract length
-            if book['genre']:
-                query_parts.append(book['genre'])
+        normalize: 'max' scales scores by the generator's best score;
+                   'clip' keeps scores that are already on a 0-1 scale (capped at 1)
+        family: 'content' or 'collaborative', the request weight it draws from
+        """
+        self._generators[name] = (func, weight, normalize, family)
+    
+    @property
+    def names(self):
+        return list(self._generators)
+    
+    def _run_generator(self, func, user_id, limit, deadline):
+        # A generator that only got a worker (or a connection) after the deadline has no reader left
+        if time.monotonic() >= deadline:
+            raise FutureTimeoutError()
+        conn = get_db()
+        try:
+            if time.monotonic() >= deadline:
+                raise FutureTimeoutError()
+            book_ids, scores = func(user_id, conn, limit)
+        finally:
+            conn.close()
+        return np.asarray(book_ids, dtype=np.int64), np.asarray(scores, dtype=np.float64)
+    
+    def generate(self, user_id, weights, status=None):
+        """
+        Run every generator with a positive weight
         
-        query = ' '.join(query_parts[:500])  # Limit total query length
+        Returns {name: (book_ids, scores)} for the generators that finished in
+        time. status, if given, is filled with 'ok', 'timeout' or 'error' per name.
+        """
+        if status is None:
+            status = {}
+        deadline = time.monotonic() + self.timeout
+        futures = [(name, self._pool.submit(self._run_generator, self._generators[name][0], user_id, self.limit,
+                                            deadline))
+                   for name, weight in weights.items() if weight > 0]
+        
+        candidates = {}
+        for name, future in futures:
+            try:
+                candidates[name] = future.result(timeout=max(0.0, deadline - time.monotonic()))
+                status[name] = 'ok'
+            except FutureTimeoutError:
+                future.cancel()
+                print(f"Candidate generator {name} timed out after {self.timeout}s")
+                status[name] = 'timeout'
+            except Exception as e:
+                print(f"Candidate generator {name} failed: {e}")
+                status[name] = 'error'
+        return candidates
+    
+    def rerank(self, candidates, weights, exclude=(), top_k=10):
+        """
+        Fuse candidate scores and pick the top K
         
-        # Perform semantic search
-        results = self.ai_engine.semantic_search(query, candidate_books, top_k=top_k * 2)
+        Returns (book_ids, fused scores, raw score matrix, generator names), best
+        first; column j of the raw matrix holds generator names[j]'s scores.
+        """
+        names = [name for name in candidates if len(candidates[name][0])]
+        if not names:
+            return np.empty(0, dtype=np.int64), np.empty(0), np.empty((0, 0)), []
+        
+        book_ids = np.unique(np.concatenate([candidates[name][0] for name in names]))
+        book_ids = book_ids[~np.isin(book_ids, np.asarray(list(exclude), dtype=np.int64))]
+        
+        raw = np.zeros((len(book_ids), len(names)))
+        for j, name in enumerate(names):
+            ids, scores = candidates[name]
+            positions = np.searchsorted(book_ids, ids)
+            found = positions < len(book_ids)
+            found[found] = book_ids[positions[found]] == ids[found]
+            raw[positions[found], j] = scores[found]
+        
+        normalized = np.clip(raw, 0.0, None)
+        for j, name in enumerate(names):
+            if self._generators[name][2] == 'clip':
+                normalized[:, j] = np.minimum(normalized[:, j], 1.0)
+            elif normalized[:, j].max() > 0:
+                normalized[:, j] /= normalized[:, j].max()
+        
+        # Weights of generators without candidates are shared among the rest
+        weight_vector = np.array([weights[name] for name in names], dtype=np.float64)
+        if weight_vector.sum() > 0:
+            weight_vector /= weight_vector.sum()
+        fused = normalized @ weight_vector
+        
+        best = top_k_indices(fused, top_k)
+        best = best[fused[best] > 0]
+        return book_ids[best], fused[best], raw[best], names
+    
+    def weights(self, family_weights=None):
+        """
+        Generator weights for a request
         
-        return results
+        family_weights maps 'content' / 'collaborative' to the share of the fused
+        score that family gets (default: equal shares); it is split among the
+        family's generators in proportion to their registered weights.
+        """
+        family_weights = family_weights or {'content': 0.5, 'collaborative': 0.5}
+        family_totals = {}
+        for _, weight, _, family in self._generators.values():
+            family_totals[family] = family_totals.get(family, 0.0) + weight
+        return {name: family_weights.get(family, 0.0) * weight / family_totals[family]
+                if family_totals[family] > 0 else 0.0
+                for name, (_, weight, _, family) in self._generators.items()}
+
+recommendation_pipeline = RecommendationPipeline()
+
+class HybridRecommendationEngine:
+    def __init__(self, ai_engine, collaborative_engine, pipeline=recommendation_pipeline):
+        self.ai_engine = ai_engine
+        self.collaborative_engine = collaborative_engine
+        self.pipeline = pipeline
     
-    def get_hybrid_recommendations(self, user_id, conn, top_k=10, 
-                                   content_weight=0.5, collaborative_weight=0.5):
+    def generator_weights(self, content_weight=0.5, collaborative_weight=0.5):
+        """Per-generator fusion weights for a content / collaborative blend (normalized to sum to 1)"""
+        total_weight = content_weight + collaborative_weight
+        if total_weight > 0:
+            content_weight = content_weight / total_weight
+            collaborative_weight = collaborative_weight / total_weight
+        return self.pipeline.weights({'content': content_weight, 'collaborative': collaborative_weight})
+    
+    def get_hybrid_recommendations(self, user_id, conn, top_k=10,
+                                   content_weight=0.5, collaborative_weight=0.5, branch_status=None):
         """
         Get hybrid recommendations combining content-based and collaborative filtering
         
+        Candidates come from every generator registered on the pipeline. The
+        content weight is shared by the content-based generators (profile
+        neighbours, similar books, same genre) and the collaborative weight by
+        the collaborative ones (user kNN, co-readers, popularity), so
+        content_weight=1, collaborative_weight=0 uses content-based generators
+        only. hybrid_score is the weighted sum of every generator's normalized
+        score (0-1), not only of content_score and collaborative_score. Only the
+        final top K books are loaded from the database.
+        
         Args:
             user_id: User ID
-            conn: Database connection
+            conn: Caller's database connection (optional; generators open their own)
             top_k: Number of recommendations to return
             content_weight: Weight for content-based recommendations (0-1)
             collaborative_weight: Weight for collaborative recommendations (0-1)
+            branch_status: Optional dict filled with each generator's outcome (see RecommendationPipeline.generate)
         """
-        # Normalize weights
-        total_weight = content_weight + collaborative_weight
-        if total_weight > 0:
-            content_weight = content_weight / total_weight
-            collaborative_weight = collaborative_weight / total_weight
+        weights = self.generator_weights(content_weight, collaborative_weight)
         
-        # Get content-based recommendations
-        content_recs = self.get_content_based_recommendations(user_id, conn, top_k=top_k * 2)
+        candidates = self.pipeline.generate(user_id, weights, branch_status)
         
-        # Get collaborative recommendations
-        matrix = self.collaborative_engine.build_user_item_matrix(conn)
-        collaborative_recs = []
-        if matrix:
-            collaborative_recs_raw = self.collaborative_engine.get_collaborative_recommendations(
-                user_id, top_k=top_k * 2
-            )
-            
-            # Convert to same format as content-based
-            book_ids = [rec['book_id'] for rec in collaborative_recs_raw]
-            if book_ids:
-                placeholders = ','.join(['?'] * len(book_ids))
-                c = conn.cursor()
-                c.execute(f'SELECT * FROM books WHERE id IN ({placeholders})', book_ids)
-                
-                books_dict = {}
-                for row in c.fetchall():
-                    books_dict[row['id']] = {
-                        'id': row['id'],
-                        'title': row['title'],
-                        'author': row['author'],
-                        'abstract': row['abstract'] if row['abstract'] else '',
-                        'genre': row['genre'] if row['genre'] else '',
-                        'academic_level': row['academic_level'] if row['academic_level'] else '',
-                        'tags': row['tags'].split(',') if row['tags'] else [],
-                        'cover_image': row_get(row, 'cover_image', 'book')
-                    }
-                
-                for rec in collaborative_recs_raw:
-                    book_id = rec['book_id']
-                    if book_id in books_dict:
-                        collaborative_recs.append({
-                            'book': books_dict[book_id],
-                            'similarity_score': rec['score'],
-                            'relevance_percentage': min(rec['score'] * 100, 100)
-                        })
-        
-        # Combine recommendations
-        book_scores = {}
-        
-        # Add content-based scores
-        for rec in content_recs:
-            book_id = rec['book']['id']
-            if book_id not in book_scores:
-                book_scores[book_id] = {
-                    'book': rec['book'],
-                    'content_score': 0.0,
-                    'collaborative_score': 0.0,
-                    'hybrid_score': 0.0,
-                    'content_percentage': 0.0,
-                    'collaborative_percentage': 0.0
-                }
-            book_scores[book_id]['content_score'] = rec['similarity_score']
-            book_scores[book_id]['content_percentage'] = rec['relevance_percentage']
-        
-        # Add collaborative scores
-        for rec in collaborative_recs:
-            book_id = rec['book']['id']
-            if book_id not in book_scores:
-                book_scores[book_id] = {
-                    'book': rec['book'],
-                    'content_score': 0.0,
-                    'collaborative_score': 0.0,
-                    'hybrid_score': 0.0,
-                    'content_percentage': 0.0,
-                    'collaborative_percentage': 0.0
-                }
-            book_scores[book_id]['collaborative_score'] = rec['similarity_score']
-            book_scores[book_id]['collaborative_percentage'] = rec['relevance_percentage']
-        
-        # Calculate hybrid scores
-        for book_id, scores in book_scores.items():
-            # Normalize scores to 0-1 range if needed
-            content_norm = min(scores['content_score'], 1.0) if scores['content_score'] > 0 else 0.0
-            collab_norm = min(scores['collaborative_score'], 1.0) if scores['collaborative_score'] > 0 else 0.0
+        own_conn = conn is None
+        if own_conn:
+            conn = get_db()
+        try:
+            # Books the user already read are never recommended
+            c = conn.cursor()
+            c.execute('SELECT DISTINCT book_id FROM reading_history WHERE user_id=?', (user_id,))
+            read_book_ids = [row['book_id'] for row in c.fetchall()]
             
-            # Calculate weighted hybrid score
-            hybrid_score = (content_norm * content_weight) + (collab_norm * collaborative_weight)
-            scores['hybrid_score'] = hybrid_score
+            book_ids, fused, raw, names = self.pipeline.rerank(candidates, weights, read_book_ids, top_k)
+            books_by_id = fetch_books_by_ids(conn, book_ids.tolist())
+        finally:
+            if own_conn:
+                conn.close()
         
-        # Sort by hybrid score and return top K
-        sorted_recs = sorted(book_scores.values(), 
-                           key=lambda x: x['hybrid_score'], 
-                           reverse=True)[:top_k]
+        content = raw[:, names.index('content')] if 'content' in names else np.zeros(len(book_ids))
+        collaborative = raw[:, names.index('collaborative')] if 'collaborative' in names else np.zeros(len(book_ids))
         
         # Format results
         recommendations = []
-        for rec in sorted_recs:
+        for i, book_id in enumerate(book_ids.tolist()):
+            if book_id not in books_by_id:
+                continue
+            content_score = max(float(content[i]), 0.0)
+            collaborative_score = max(float(collaborative[i]), 0.0)
             recommendations.append({
-                'book': rec['book'],
-                'hybrid_score': round(rec['hybrid_score'], 4),
-                'confidence_percentage': round(rec['hybrid_score'] * 100, 1),
-                'content_score': round(rec['content_score'], 4),
-                'content_percentage': round(rec['content_percentage'], 1),
-                'collaborative_score': round(rec['collaborative_score'], 4),
-                'collaborative_percentage': round(rec['collaborative_percentage'], 1),
-                'has_content': rec['content_score'] > 0,
-                'has_collaborative': rec['collaborative_score'] > 0
+                'book': books_by_id[book_id],
+                'hybrid_score': round(float(fused[i]), 4),
+                'confidence_percentage': round(float(fused[i]) * 100, 1),
+                'content_score': round(content_score, 4),
+                'content_percentage': round(content_score * 100, 1),
+                'collaborative_score': round(collaborative_score, 4),
+                'collaborative_percentage': round(min(collaborative_score * 100, 100), 1),
+                'has_content': content_score > 0,
+                'has_collaborative': collaborative_score > 0,
+                'sources': [name for j, name in enumerate(names) if raw[i, j] > 0]
             })
         
         return recommendations
@@ -1556,97 +3013,1293 @@ class HybridRecommendationEngine:
 # Initialize hybrid engine (will be initialized after ai_engine)
 hybrid_engine = None
 
+def top_k_indices(scores, top_k):
+    """Return indices of the top_k largest scores, best first, without a full sort"""
+    if top_k <= 0 or len(scores) == 0:
+        return np.empty(0, dtype=np.int64)
+    if top_k < len(scores):
+        candidates = np.argpartition(-scores, top_k - 1)[:top_k]
+    else:
+        candidates = np.arange(len(scores))
+    return candidates[np.argsort(-scores[candidates], kind='stable')]
+
+def normalize_vector(vector):
+    """Return a float32 copy of a vector scaled to unit length"""
+    vector = np.asarray(vector, dtype=np.float32).reshape(-1)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm > 0 else vector
+
+# Subscription tiers: a book is visible to users whose tier is >= the book's tier.
+# Books with an unknown or missing level are only visible to premium users,
+# matching the SQL filters (subscription_level = 'free' / IN ('free', 'basic')).
+SUBSCRIPTION_TIERS = {'free': 0, 'basic': 1, 'premium': 2}
+
+def book_subscription_tier(level):
+    return SUBSCRIPTION_TIERS.get(level, 2)
+
+def user_subscription_tier(level):
+    """Highest book tier a user may see (anything other than free/basic sees everything)"""
+    return SUBSCRIPTION_TIERS.get(level or 'free', 2)
+
+# Per-book attributes kept next to each embedding row for pre-filtered search
+EMBEDDING_FILTER_ATTRIBUTES = ('genre', 'academic_level')
+
+# In-memory embedding store: one contiguous L2-normalized float32 matrix plus an id<->row map
+class EmbeddingStore:
+    def __init__(self, initial_capacity=1024):
+        self._lock = threading.RLock()
+        self._initial_capacity = initial_capacity
+        self.dim = None
+        self._matrix = None  # (capacity, dim) float32, every used row has unit length
+        self._row_ids = None  # book id stored in each row, -1 for free rows
+        self._id_to_row = {}
+        self._free_rows = []  # rows released by deletes, reused before growing
+        self._size = 0  # high-water mark of used rows
+        self._hashes = {}  # book id -> content hash of the text that was encoded
+        # Attribute columns aligned with rows: subscription tier plus coded genre/level
+        self._tiers = None  # uint8, see book_subscription_tier
+        self._attributes = {}  # attribute name -> int32 codes, 0 = empty
+        self._vocab = {name: {} for name in EMBEDDING_FILTER_ATTRIBUTES}  # value -> code
+    
+    def _allocate(self, dim):
+        """Allocate the backing arrays once the embedding dimension is known"""
+        self.dim = dim
+        self._matrix = np.zeros((self._initial_capacity, dim), dtype=np.float32)
+        self._row_ids = np.full(self._initial_capacity, -1, dtype=np.int64)
+        self._tiers = np.full(self._initial_capacity, 2, dtype=np.uint8)
+        self._attributes = {name: np.zeros(self._initial_capacity, dtype=np.int32)
+                            for name in EMBEDDING_FILTER_ATTRIBUTES}
+    
+    def _grow(self):
+        """Double the capacity of the backing arrays"""
+        capacity = len(self._row_ids) * 2
+        matrix = np.zeros((capacity, self.dim), dtype=np.float32)
+        matrix[:self._size] = self._matrix[:self._size]
+        row_ids = np.full(capacity, -1, dtype=np.int64)
+        row_ids[:self._size] = self._row_ids[:self._size]
+        tiers = np.full(capacity, 2, dtype=np.uint8)
+        tiers[:self._size] = self._tiers[:self._size]
+        for name, codes in self._attributes.items():
+            grown = np.zeros(capacity, dtype=np.int32)
+            grown[:self._size] = codes[:self._size]
+            self._attributes[name] = grown
+        self._matrix = matrix
+        self._row_ids = row_ids
+        self._tiers = tiers
+    
+    def _code(self, name, value):
+        """Get (or assign) the integer code for an attribute value"""
+        if not value:
+            return 0
+        vocab = self._vocab[name]
+        if value not in vocab:
+            vocab[value] = len(vocab) + 1
+        return vocab[value]
+    
+    def _set_row_attributes(self, row, book):
+        # Only attributes present in the dict are updated, so partial book dicts never
+        # widen visibility (rows start at the most restrictive tier)
+        if 'subscription_level' in book:
+            self._tiers[row] = book_subscription_tier(book['subscription_level'])
+        for name in EMBEDDING_FILTER_ATTRIBUTES:
+            if name in book:
+                self._attributes[name][row] = self._code(name, book[name])
+    
+    def set_attributes(self, book_id, book):
+        """Update the filterable attributes (subscription level, genre, academic level) of a stored book"""
+        with self._lock:
+            row = self._id_to_row.get(book_id)
+            if row is not None:
+                self._set_row_attributes(row, book)
+    
+    def _filter_mask(self, rows, filters):
+        """
+        Boolean mask of rows that hold a book and match the filters
+        
+        Supported filters: max_tier (user_subscription_tier), genre, academic_level
+        """
+        mask = self._row_ids[rows] >= 0
+        if not filters:
+            return mask
+        if filters.get('max_tier') is not None:
+            mask &= self._tiers[rows] <= filters['max_tier']
+        for name in EMBEDDING_FILTER_ATTRIBUTES:
+            value = filters.get(name)
+            if value:
+                mask &= self._attributes[name][rows] == self._vocab[name].get(value, -1)
+        return mask
+    
+    def __contains__(self, book_id):
+        return book_id in self._id_to_row
+    
+    def __getitem__(self, book_id):
+        """Return a read-only view of a book's normalized embedding"""
+        with self._lock:
+            view = self._matrix[self._id_to_row[book_id]]
+        view.flags.writeable = False
+        return view
+    
+    def __len__(self):
+        return len(self._id_to_row)
+    
+    def ids(self):
+        """Get the ids of every stored book"""
+        with self._lock:
+            return list(self._id_to_row)
+    
+    def get(self, book_id, default=None):
+        try:
+            return self[book_id]
+        except KeyError:
+            return default
+    
+    def content_hash(self, book_id):
+        """Get the content hash the stored embedding was generated from"""
+        return self._hashes.get(book_id)
+    
+    def load(self, book_ids, content_hashes, matrix, books=None):
+        """Bulk-load embeddings (and optional attribute dicts) into an empty store (used when restoring from disk)"""
+        matrix = np.asarray(matrix, dtype=np.float32)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        
+        with self._lock:
+            count = len(book_ids)
+            self._initial_capacity = max(self._initial_capacity, count)
+            self._allocate(matrix.shape[1])
+            self._matrix[:count] = matrix / norms
+            self._row_ids[:count] = book_ids
+            self._id_to_row = {book_id: row for row, book_id in enumerate(book_ids)}
+            self._hashes = dict(zip(book_ids, content_hashes))
+            self._free_rows = []
+            self._size = count
+            for row, book in enumerate(books or []):
+                self._set_row_attributes(row, book)
+    
+    def upsert(self, book_id, embedding, content_hash=None, book=None):
+        """Insert or replace a book's embedding (and attributes from the book dict), normalizing it to unit length"""
+        vector = normalize_vector(embedding)
+        
+        with self._lock:
+            if self._matrix is None:
+                self._allocate(len(vector))
+            elif len(vector) != self.dim:
+                raise ValueError(f"Embedding dimension {len(vector)} does not match store dimension {self.dim}")
+            
+            row = self._id_to_row.get(book_id)
+            if row is None:
+                if self._free_rows:
+                    row = self._free_rows.pop()
+                else:
+                    if self._size == len(self._row_ids):
+                        self._grow()
+                    row = self._size
+                    self._size += 1
+                self._id_to_row[book_id] = row
+                self._row_ids[row] = book_id
+                self._tiers[row] = 2
+                for codes in self._attributes.values():
+                    codes[row] = 0
+            
+            self._matrix[row] = vector
+            self._hashes[book_id] = content_hash
+            if book:
+                self._set_row_attributes(row, book)
+            return row
+    
+    def remove(self, book_id):
+        """Remove a book's embedding, releasing its row for reuse"""
+        with self._lock:
+            row = self._id_to_row.pop(book_id, None)
+            if row is None:
+                return False
+            self._matrix[row] = 0.0
+            self._row_ids[row] = -1
+            self._hashes.pop(book_id, None)
+            self._free_rows.append(row)
+            return True
+    
+    def row_of(self, book_id):
+        """Get the matrix row holding a book's embedding, or None"""
+        return self._id_to_row.get(book_id)
+    
+    def rows_for(self, book_ids, keep_missing=False):
+        """Map book ids to matrix rows, dropping ids that are not stored (or marking them -1)"""
+        with self._lock:
+            rows = np.fromiter((self._id_to_row.get(book_id, -1) for book_id in book_ids), dtype=np.int64)
+        return rows if keep_missing else rows[rows >= 0]
+    
+    def ids_for_rows(self, rows):
+        """Map matrix rows back to book ids"""
+        with self._lock:
+            return self._row_ids[rows].copy()
+    
+    def live_rows(self):
+        """Get every row that currently holds an embedding"""
+        with self._lock:
+            if self._row_ids is None:
+                return np.empty(0, dtype=np.int64)
+            return np.flatnonzero(self._row_ids[:self._size] >= 0)
+    
+    def vectors(self, rows):
+        """Copy the embeddings stored in the given rows"""
+        with self._lock:
+            return self._matrix[rows].copy()
+    
+    def _top_hits(self, rows, scores, top_k, min_score, filters=None):
+        """Pick the best (book_id, score) pairs among scored rows that pass the filters"""
+        keep = (scores > min_score) & self._filter_mask(rows, filters)
+        rows = rows[keep]
+        scores = scores[keep]
+        best = top_k_indices(scores, top_k)
+        return [(int(self._row_ids[rows[i]]), float(scores[i])) for i in best]
+    
+    def search(self, query_vector, top_k=10, book_ids=None, min_score=0.0, filters=None):
+        """
+        Score every stored book against a query with one matrix-vector product
+        
+        Args:
+            query_vector: Query embedding (normalized here, so raw model output is fine)
+            top_k: Number of results to return
+            book_ids: Optional iterable restricting the candidates
+            min_score: Only scores strictly above this value are returned
+            filters: Optional attribute filters (max_tier, genre, academic_level),
+                     applied as masks during scoring
+        
+        Returns:
+            List of (book_id, score) tuples, best first
+        """
+        query = normalize_vector(query_vector)
+        
+        with self._lock:
+            if self._matrix is None or not self._id_to_row:
+                return []
+            
+            scores = self._matrix[:self._size] @ query
+            
+            if book_ids is not None:
+                rows = np.fromiter((self._id_to_row.get(book_id, -1) for book_id in book_ids), dtype=np.int64)
+                rows = rows[rows >= 0]
+            else:
+                rows = np.arange(self._size)
+            
+            return self._top_hits(rows, scores[rows], top_k, min_score, filters)
+    
+    def search_rows(self, query_vector, rows, top_k=10, min_score=0.0, filters=None):
+        """Score only the given rows against a query (used by the ANN index)"""
+        query = normalize_vector(query_vector)
+        
+        with self._lock:
+            if self._matrix is None or len(rows) == 0:
+                return []
+            rows = rows[self._filter_mask(rows, filters)]
+            return self._top_hits(rows, self._matrix[rows] @ query, top_k, min_score)
+    
+    def similarities(self, book_ids):
+        """
+        Cosine similarity of the given books to every row
+        
+        Returns:
+            (stored book ids among book_ids, book id of every row (-1 for free rows),
+             scores matrix of shape (found, rows))
+        """
+        with self._lock:
+            found = [book_id for book_id in book_ids if book_id in self._id_to_row]
+            if self._matrix is None or not found:
+                return [], np.empty(0, dtype=np.int64), np.empty((0, 0), dtype=np.float32)
+            rows = np.array([self._id_to_row[book_id] for book_id in found], dtype=np.int64)
+            return found, self._row_ids[:self._size].copy(), self._matrix[rows] @ self._matrix[:self._size].T
+
+# Approximate nearest-neighbour index configuration
+ANN_BACKEND = os.getenv('ANN_BACKEND', 'ivf')  # 'ivf' or 'flat' (exact)
+ANN_INDEX_PATH = os.getenv('ANN_INDEX_PATH', 'bookgenie_ann.npz')
+ANN_MIN_ITEMS = int(os.getenv('ANN_MIN_ITEMS', '1000'))  # Below this, exact search is fast enough
+ANN_DEFAULT_NPROBE = int(os.getenv('ANN_DEFAULT_NPROBE', '8'))
+ANN_KMEANS_ITERATIONS = 10
+
+# Exact search over the embedding store (also the fallback for untrained ANN indexes)
+class FlatIndex:
+    name = 'flat'
+    
+    def __init__(self, store):
+        self.store = store
+        self.trained_at = None  # time the index was last trained (IVF centroids)
+    
+    @property
+    def is_trained(self):
+        return False
+    
+    def load_or_build(self):
+        pass
+    
+    def build(self):
+        pass
+    
+    def save(self):
+        pass
+    
+    def save_if_dirty(self):
+        pass
+    
+    def add(self, book_id):
+        pass
+    
+    def remove(self, book_id):
+        pass
+    
+    def needs_rebuild(self):
+        return False
+    
+    def search(self, query_vector, top_k=10, book_ids=None, nprobe=None, filters=None):
+        return self.store.search(query_vector, top_k, book_ids=book_ids, filters=filters)
+    
+    def stats(self):
+        return {'backend': self.name, 'trained': False, 'items': len(self.store)}
+
+# Inverted-file (IVF) index: k-means coarse quantizer over the store's rows.
+# Lists hold store rows, so vectors are never duplicated; only book ids and
+# centroids are persisted, and rows are re-resolved against the store on load.
+class IVFIndex(FlatIndex):
+    name = 'ivf'
+    
+    def __init__(self, store, path=ANN_INDEX_PATH, default_nprobe=ANN_DEFAULT_NPROBE):
+        super().__init__(store)
+        self.path = path
+        self.default_nprobe = default_nprobe
+        self._lock = threading.RLock()
+        self._centroids = None  # (nlist, dim) float32, unit length
+        self._lists = []  # one int64 array of store rows per centroid
+        self._row_list = {}  # store row -> list number
+        self._trained_size = 0
+        self._dirty = False  # lists changed since the last save
+    
+    @property
+    def is_trained(self):
+        return self._centroids is not None
+    
+    def _assign(self, vectors, chunk_size=8192):
+        """Assign vectors to their nearest centroid"""
+        assignments = np.empty(len(vectors), dtype=np.int64)
+        for start in range(0, len(vectors), chunk_size):
+            chunk = vectors[start:start + chunk_size]
+            assignments[start:start + chunk_size] = np.argmax(chunk @ self._centroids.T, axis=1)
+        return assignments
+    
+    def _set_lists(self, rows, assignments):
+        order = np.argsort(assignments, kind='stable')
+        rows = rows[order]
+        bounds = np.searchsorted(assignments[order], np.arange(len(self._centroids) + 1))
+        self._lists = [rows[bounds[i]:bounds[i + 1]].copy() for i in range(len(self._centroids))]
+        self._row_list = dict(zip(rows.tolist(), assignments[order].tolist()))
+    
+    def build(self):
+        """Train the coarse quantizer with spherical k-means and assign every stored book"""
+        rows = self.store.live_rows()
+        if len(rows) < ANN_MIN_ITEMS:
+            with self._lock:
+                self._centroids = None
+                self._lists = []
+                self._row_list = {}
+            return False
+        
+        start_time = time.time()
+        vectors = self.store.vectors(rows)
+        nlist = max(1, min(len(rows), int(4 * np.sqrt(len(rows)))))
+        
+        # Train on a sample, starting from randomly chosen vectors
+        rng = np.random.default_rng(0)
+        sample = vectors[rng.choice(len(vectors), size=min(len(vectors), nlist * 64), replace=False)]
+        centroids = sample[rng.choice(len(sample), size=nlist, replace=False)].copy()
+        for _ in range(ANN_KMEANS_ITERATIONS):
+            assignments = np.argmax(sample @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignments, sample)
+            norms = np.linalg.norm(sums, axis=1, keepdims=True)
+            # Empty clusters keep their previous centroid
+            centroids = np.where(norms > 0, sums / np.maximum(norms, 1e-12), centroids).astype(np.float32)
+        
+        with self._lock:
+            self._centroids = centroids
+            self._set_lists(rows, self._assign(vectors))
+            self._trained_size = len(rows)
+            self.trained_at = time.time()
+            # Books stored while the centroids were being trained
+            for book_id in self.store.ids_for_rows(np.setdiff1d(self.store.live_rows(), rows)):
+                self.add(int(book_id))
+        
+        print(f"IVF index built: {len(rows)} books in {nlist} lists ({time.time() - start_time:.2f}s)")
+        return True
+    
+    def save(self):
+        """Persist centroids and list membership (as book ids) to disk"""
+        with self._lock:
+            if self._centroids is None:
+                return
+            list_sizes = np.array([len(rows) for rows in self._lists], dtype=np.int64)
+            list_rows = np.concatenate(self._lists) if self._lists else np.empty(0, dtype=np.int64)
+            centroids = self._centroids
+            trained_size = self._trained_size
+            self._dirty = False
+        
+        try:
+            tmp_path = f"{self.path}.tmp.npz"
+            np.savez(tmp_path,
+                     centroids=centroids,
+                     list_sizes=list_sizes,
+                     list_book_ids=self.store.ids_for_rows(list_rows),
+                     trained_size=np.array([trained_size]))
+            os.replace(tmp_path, self.path)
+        except Exception as e:
+            print(f"Error saving ANN index: {e}")
+            self._dirty = True
+    
+    def save_if_dirty(self):
+        """
+        Persist only if books were added or removed since the last save
+        
+        Single-book changes are not written through: load_or_build() re-adds
+        books stored after the file was saved, so saving periodically (and at
+        exit) loses nothing.
+        """
+        if self._dirty:
+            self.save()
+    
+    def load_or_build(self):
+        """Restore the index from disk, falling back to a fresh build"""
+        if os.path.exists(self.path) and len(self.store) > 0:
+            try:
+                data = np.load(self.path)
+                centroids = data['centroids']
+                if centroids.shape[1] == self.store.dim:
+                    list_sizes = data['list_sizes']
+                    book_ids = data['list_book_ids']
+                    assignments = np.repeat(np.arange(len(centroids)), list_sizes)
+                    
+                    # Resolve book ids to current rows; deleted books drop out
+                    rows = self.store.rows_for(book_ids.tolist(), keep_missing=True)
+                    known = rows >= 0
+                    
+                    with self._lock:
+                        self._centroids = centroids.astype(np.float32)
+                        self._set_lists(rows[known], assignments[known])
+                        self._trained_size = int(data['trained_size'][0])
+                        self.trained_at = os.path.getmtime(self.path)
+                    
+                    # Books stored since the index was saved
+                    missing = np.setdiff1d(self.store.live_rows(), rows[known])
+                    for book_id in self.store.ids_for_rows(missing):
+                        self.add(int(book_id))
+                    print(f"Loaded IVF index from {self.path} ({len(centroids)} lists)")
+                    return
+            except Exception as e:
+                print(f"Could not load ANN index ({e}), rebuilding")
+        
+        if self.build():
+            self.save()
+    
+    def add(self, book_id):
+        """Insert (or re-assign) a book after its embedding was stored"""
+        with self._lock:
+            if self._centroids is None:
+                return
+            row = self.store.row_of(book_id)
+            if row is None:
+                return
+            self._discard_row(row)
+            list_no = int(np.argmax(self._centroids @ self.store[book_id]))
+            self._lists[list_no] = np.append(self._lists[list_no], row)
+            self._row_list[row] = list_no
+            self._dirty = True
+    
+    def _discard_row(self, row):
+        list_no = self._row_list.pop(row, None)
+        if list_no is not None:
+            self._lists[list_no] = self._lists[list_no][self._lists[list_no] != row]
+    
+    def remove(self, book_id):
+        """Remove a book before it is dropped from the store"""
+        with self._lock:
+            row = self.store.row_of(book_id)
+            if row is not None:
+                self._discard_row(row)
+                self._dirty = True
+    
+    def needs_rebuild(self):
+        """Centroids drift once the catalog has doubled since training (or first crosses the threshold)"""
+        size = len(self.store)
+        if self._centroids is None:
+            return size >= ANN_MIN_ITEMS
+        return size > 2 * self._trained_size
+    
+    def search(self, query_vector, top_k=10, book_ids=None, nprobe=None, filters=None):
+        """
+        Search the nprobe closest lists
+        
+        Higher nprobe raises recall at the cost of latency; nprobe >= nlist is exact.
+        When filters leave fewer than top_k matches in the probed lists, more
+        lists are probed until top_k are found or every list was searched.
+        """
+        with self._lock:
+            if self._centroids is None:
+                return self.store.search(query_vector, top_k, book_ids=book_ids, filters=filters)
+            
+            query = normalize_vector(query_vector)
+            nlist = len(self._centroids)
+            nprobe = max(1, min(nprobe or self.default_nprobe, nlist))
+            centroid_order = top_k_indices(self._centroids @ query, nlist)
+            lists = list(self._lists)
+        
+        allowed = self.store.rows_for(book_ids) if book_ids is not None else None
+        
+        while True:
+            rows = np.concatenate([lists[i] for i in centroid_order[:nprobe]])
+            if allowed is not None:
+                if len(allowed) <= len(rows):
+                    # Small candidate sets are cheaper to score exactly
+                    return self.store.search_rows(query, allowed, top_k, filters=filters)
+                rows = rows[np.isin(rows, allowed)]
+            
+            hits = self.store.search_rows(query, rows, top_k, filters=filters)
+            if len(hits) >= top_k or nprobe >= nlist:
+                return hits
+            nprobe = min(nprobe * 4, nlist)
+    
+    def stats(self):
+        with self._lock:
+            sizes = [len(rows) for rows in self._lists]
+        return {
+            'backend': self.name,
+            'trained': self.is_trained,
+            'items': len(self.store),
+            'lists': len(sizes),
+            'largest_list': max(sizes) if sizes else 0,
+            'default_nprobe': self.default_nprobe
+        }
+
+def create_ann_index(store):
+    """Create the configured ANN index for an embedding store"""
+    if ANN_BACKEND == 'flat':
+        return FlatIndex(store)
+    return IVFIndex(store)
+
+def book_embedding_text(book):
+    """Build the text a book's embedding is generated from"""
+    tags = book.get('tags', '')
+    if isinstance(tags, list):
+        tags = ','.join(tags)
+    return f"{book['title']} {book.get('abstract') or ''} {tags or ''}"
+
+def embedding_content_hash(text):
+    """Hash of the model and text an embedding was generated from"""
+    return hashlib.md5(f"{EMBEDDING_MODEL_NAME}\n{text}".encode()).hexdigest()
+
+# Precomputed item-item neighbours ("similar books"), served from the book_neighbors table
+BOOK_NEIGHBORS_K = int(os.getenv('BOOK_NEIGHBORS_K', '20'))
+# Seconds between full rebuilds of the neighbour table (incremental updates keep it current in between)
+BOOK_NEIGHBORS_INTERVAL = int(os.getenv('BOOK_NEIGHBORS_INTERVAL', '86400'))
+
+class BookNeighborTable:
+    """
+    Top-K most similar books of every book, persisted in SQLite
+    
+    Lists are computed from the embedding store with batched matrix products.
+    When embeddings change, only the affected lists are recomputed: the changed
+    books' own lists, lists that contain a changed book, and lists whose
+    weakest entry a changed book now beats. Reads are a primary-key range scan;
+    a book without a stored list is computed by a background thread, never on
+    the request.
+    """
+    
+    def __init__(self, store, k=BOOK_NEIGHBORS_K):
+        self.store = store
+        self.k = k
+        self._lock = threading.RLock()
+        # book id -> weakest listed score (0.0 while a list has fewer than k entries); books whose
+        # list is known to be empty are kept here too, so they are not recomputed on every read
+        self._floors = None
+        self._missing = set()  # books waiting for the background computation
+        self._missing_lock = threading.Lock()
+        self._computing = False
+        self.built_at = None
+    
+    def _compute(self, book_ids, batch_size=1024):
+        """Neighbour lists of the given books as {book_id: [(neighbor_id, score), ...]}, best first"""
+        book_ids = list(book_ids)
+        lists = {}
+        for start in range(0, len(book_ids), batch_size):
+            found, column_ids, scores = self.store.similarities(book_ids[start:start + batch_size])
+            if not found:
+                continue
+            scores[np.asarray(found)[:, None] == column_ids[None, :]] = 0.0
+            
+            # Top K of every row at once: partition, then sort only the K survivors
+            k = min(self.k, scores.shape[1])
+            best = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+            best_scores = np.take_along_axis(scores, best, axis=1)
+            order = np.argsort(-best_scores, axis=1, kind='stable')
+            best = np.take_along_axis(best, order, axis=1)
+            best_scores = np.take_along_axis(best_scores, order, axis=1)
+            for book_id, columns, row_scores in zip(found, best, best_scores):
+                keep = row_scores > 0
+                lists[book_id] = list(zip(column_ids[columns[keep]].tolist(), row_scores[keep].tolist()))
+        return lists
+    
+    def _write(self, conn, lists, full=False):
+        """Replace the stored lists of the given books (or the whole table when full=True)"""
+        c = conn.cursor()
+        if full:
+            c.execute('DELETE FROM book_neighbors')
+        else:
+            c.executemany('DELETE FROM book_neighbors WHERE book_id=?', [(book_id,) for book_id in lists])
+        c.executemany('INSERT INTO book_neighbors (book_id, rank, neighbor_id, score) VALUES (?, ?, ?, ?)',
+                      [(book_id, rank, neighbor_id, score)
+                       for book_id, neighbors in lists.items()
+                       for rank, (neighbor_id, score) in enumerate(neighbors)])
+        
+        floors = {} if full or self._floors is None else self._floors
+        for book_id, neighbors in lists.items():
+            if book_id not in self.store:
+                floors.pop(book_id, None)
+            else:
+                floors[book_id] = neighbors[-1][1] if len(neighbors) >= self.k else 0.0
+        if full or self._floors is not None:
+            self._floors = floors
+    
+    def _load_floors(self, conn):
+        c = conn.cursor()
+        c.execute('SELECT book_id, MIN(score) as floor, COUNT(*) as count FROM book_neighbors GROUP BY book_id')
+        self._floors = {row['book_id']: row['floor'] if row['count'] >= self.k else 0.0 for row in c.fetchall()}
+    
+    def rebuild(self, conn=None):
+        """Recompute every book's list"""
+        own_conn = conn is None
+        if own_conn:
+            conn = get_db()
+        try:
+            with self._lock:
+                start_time = time.time()
+                lists = self._compute(self.store.ids())
+                self._write(conn, lists, full=True)
+                conn.commit()
+                self.built_at = time.time()
+        finally:
+            if own_conn:
+                conn.close()
+        print(f"Book neighbours rebuilt: {len(lists)} books ({time.time() - start_time:.2f}s)")
+    
+    def update(self, book_ids, conn=None):
+        """
+        Refresh the lists affected by new, changed or removed embeddings
+        
+        With a caller-supplied connection the changes are left for the caller to commit.
+        """
+        book_ids = list(book_ids)
+        if not book_ids:
+            return
+        own_conn = conn is None
+        if own_conn:
+            conn = get_db()
+        try:
+            with self._lock:
+                if self._floors is None:
+                    self._load_floors(conn)
+                
+                # Lists that contain a changed book
+                c = conn.cursor()
+                c.execute(f'''SELECT DISTINCT book_id FROM book_neighbors
+                              WHERE neighbor_id IN ({','.join('?' * len(book_ids))})''', book_ids)
+                affected = set(book_ids) | {row['book_id'] for row in c.fetchall()}
+                
+                # Lists a changed book now belongs in
+                changed = [book_id for book_id in book_ids if book_id in self.store]
+                if changed:
+                    _, column_ids, scores = self.store.similarities(changed)
+                    floors = np.array([self._floors.get(int(book_id), np.inf) for book_id in column_ids])
+                    affected.update(int(book_id) for book_id in column_ids[scores.max(axis=0) > floors])
+                
+                lists = {book_id: [] for book_id in affected}
+                lists.update(self._compute(affected))
+                self._write(conn, lists)
+                if own_conn:
+                    conn.commit()
+        finally:
+            if own_conn:
+                conn.close()
+    
+    def get(self, conn, book_id, top_k=6):
+        """
+        Get (neighbor_id, score) pairs for a book
+        
+        A book without a stored list gets [] until the background thread has
+        computed and stored it; books with no positive neighbours are
+        remembered so they are not recomputed.
+        """
+        c = conn.cursor()
+        c.execute('SELECT neighbor_id, score FROM book_neighbors WHERE book_id=? ORDER BY rank LIMIT ?',
+                  (book_id, top_k))
+        rows = c.fetchall()
+        if rows:
+            return [(row['neighbor_id'], row['score']) for row in rows]
+        
+        floors = self._floors
+        if book_id in self.store and (floors is None or book_id not in floors):
+            self._compute_in_background(book_id)
+        return []
+    
+    def _compute_in_background(self, book_id):
+        with self._missing_lock:
+            self._missing.add(book_id)
+            if self._computing:
+                return
+            self._computing = True
+        threading.Thread(target=self._compute_missing, name='book-neighbors', daemon=True).start()
+    
+    def _compute_missing(self):
+        """Compute and store the lists of requested books, batching requests that arrive meanwhile"""
+        while True:
+            with self._missing_lock:
+                if not self._missing:
+                    self._computing = False
+                    return
+                book_ids, self._missing = list(self._missing), set()
+            try:
+                conn = get_db()
+                try:
+                    with self._lock:
+                        if self._floors is None:
+                            self._load_floors(conn)
+                        # Books with no positive neighbours are written as empty lists (kept in _floors)
+                        lists = {book_id: [] for book_id in book_ids
+                                 if book_id in self.store and book_id not in self._floors}
+                        lists.update(self._compute(lists))
+                        self._write(conn, lists)
+                        conn.commit()
+                finally:
+                    conn.close()
+            except Exception as e:
+                print(f"Error computing book neighbours: {e}")
+    
+    def stats(self):
+        return {
+            'k': self.k,
+            'books': len(self._floors) if self._floors is not None else None,
+            'built_at': datetime.datetime.fromtimestamp(self.built_at).isoformat() if self.built_at else None
+        }
+
 # AI Recommendation Engine with caching
 class BookGenieAI:
     def __init__(self):
         self.model = ai_model
-        self.book_embeddings = {}
-        self.embedding_cache = {}  # Persistent cache for book embeddings
-        
+        self.embedding_store = EmbeddingStore()
+        # Book embeddings are read-only views into the store's contiguous matrix
+        self.book_embeddings = self.embedding_store
+        self.ann_index = create_ann_index(self.embedding_store)
+        self.neighbors = BookNeighborTable(self.embedding_store)
+        self._store_loaded = False
+        self._catalog_synced = False  # set once a full sync_books() has run
+        self._syncing = False
+        self._load_lock = threading.Lock()
+        self._sync_lock = threading.Lock()
+    
+    def load_embeddings(self, conn=None):
+        """Load persisted embeddings (with each book's filter attributes) into the store"""
+        with self._load_lock:
+            if self._store_loaded:
+                return
+            
+            own_conn = conn is None
+            if own_conn:
+                conn = get_db()
+            try:
+                c = conn.cursor()
+                # Embeddings of deleted books are dropped by the join
+                c.execute('''SELECT e.book_id, e.content_hash, e.embedding,
+                                    b.genre, b.academic_level, b.subscription_level
+                             FROM book_embeddings e
+                             JOIN books b ON b.id = e.book_id''')
+                rows = c.fetchall()
+            except sqlite3.OperationalError as e:
+                # Table not created yet (init_db has not run)
+                print(f"Could not load persisted embeddings: {e}")
+                rows = []
+            finally:
+                if own_conn:
+                    conn.close()
+            
+            if rows:
+                dim_bytes = len(rows[0]['embedding'])
+                rows = [row for row in rows if len(row['embedding']) == dim_bytes]
+                matrix = np.frombuffer(b''.join(row['embedding'] for row in rows), dtype=np.float32)
+                matrix = matrix.reshape(len(rows), dim_bytes // 4)
+                self.embedding_store.load([row['book_id'] for row in rows],
+                                          [row['content_hash'] for row in rows],
+                                          matrix,
+                                          [dict(row) for row in rows])
+            
+            self._store_loaded = True
+            print(f"Loaded {len(rows)} persisted book embeddings")
+            
+            self.ann_index.load_or_build()
+    
+    def _index_books(self, conn, book_ids):
+        """Insert new or changed embeddings into the ANN index and neighbour table (saving and retraining are scheduler jobs; the caller commits)"""
+        if not book_ids:
+            return
+        for book_id in book_ids:
+            self.ann_index.add(book_id)
+        self.neighbors.update(book_ids, conn)
+    
+    def _persist_embeddings(self, conn, entries):
+        """Write (book_id, content_hash) entries from the store to the book_embeddings table (the caller commits)"""
+        if not entries:
+            return
+        c = conn.cursor()
+        c.executemany('''INSERT OR REPLACE INTO book_embeddings (book_id, content_hash, embedding, updated_at)
+                         VALUES (?, ?, ?, CURRENT_TIMESTAMP)''',
+                      [(book_id, content_hash, self.embedding_store[book_id].tobytes())
+                       for book_id, content_hash in entries])
+    
+    def _save_new_embeddings(self, conn, entries):
+        """Persist and index freshly embedded books in one transaction on conn (own connection if None)"""
+        if not entries:
+            return
+        own_conn = conn is None
+        if own_conn:
+            conn = get_db()
+        try:
+            self._persist_embeddings(conn, entries)
+            self._index_books(conn, [book_id for book_id, _ in entries])
+            conn.commit()
+        except Exception as e:
+            print(f"Error persisting embeddings: {e}")
+            conn.rollback()
+        finally:
+            if own_conn:
+                conn.close()
+    
     def get_book_embedding(self, book_id, book_text):
-        """Get book embedding from cache or generate new one"""
-        cache_key = f"embedding_{book_id}_{hashlib.md5(book_text.encode()).hexdigest()}"
+        """Get book embedding from the store or generate new one"""
+        self.load_embeddings()
+        content_hash = embedding_content_hash(book_text)
         
-        # Check cache first
-        cached = get_cached(cache_key)
-        if cached is not None:
-            return cached
+        # Check store first
+        if self.embedding_store.content_hash(book_id) == content_hash:
+            return self.embedding_store[book_id]
         
-        # Generate new embedding
+        # Generate new embedding and persist it
         embedding = self.model.encode([book_text])[0]
+        self.embedding_store.upsert(book_id, embedding, content_hash)
+        self._save_new_embeddings(None, [(book_id, content_hash)])
+        return self.embedding_store[book_id]
+    
+    def remove_book(self, book_id, conn=None):
+        """Drop a deleted book from the embedding store (and its persisted row if conn is given)"""
+        if conn is not None:
+            conn.execute('DELETE FROM book_embeddings WHERE book_id=?', (book_id,))
+        self.ann_index.remove(book_id)
+        removed = self.embedding_store.remove(book_id)
+        if removed:
+            self.neighbors.update([book_id], conn)
+        return removed
+    
+    def generate_embeddings(self, books, use_cache=True, conn=None):
+        """
+        Generate embeddings for new or changed books, reusing the persisted store
         
-        # Cache it
-        set_cached(cache_key, embedding)
-        return embedding
-    
-    def generate_embeddings(self, books, use_cache=True):
-        """Generate embeddings for all books with caching"""
+        New embeddings are written and committed on conn when given (callers
+        commit their own changes first), otherwise on a connection of its own.
+        """
         if not books:
             return
         
-        print(f"Generating embeddings for {len(books)} books (caching: {use_cache})...")
-        new_count = 0
-        cached_count = 0
+        self.load_embeddings()
         
+        # Gather every new or changed book
+        misses = {}
+        books_by_id = {}
+        cached_count = 0
         for book in books:
-            book_id = book['id']
-            text = f"{book['title']} {book['abstract']} {book.get('tags', '')}"
+            text = book_embedding_text(book)
+            content_hash = embedding_content_hash(text)
             
-            if use_cache:
-                cache_key = f"embedding_{book_id}_{hashlib.md5(text.encode()).hexdigest()}"
-                embedding = get_cached(cache_key)
-                
-                if embedding is None:
-                    # Generate new embedding
-                    embedding = self.model.encode([text])[0]
-                    set_cached(cache_key, embedding)
-                    new_count += 1
-                else:
-                    cached_count += 1
+            if use_cache and self.embedding_store.content_hash(book['id']) == content_hash:
+                self.embedding_store.set_attributes(book['id'], book)
+                cached_count += 1
             else:
-                embedding = self.model.encode([text])[0]
-                new_count += 1
-            
-            self.book_embeddings[book_id] = embedding
+                misses[book['id']] = (text, content_hash)
+                books_by_id[book['id']] = book
+        
+        # Encode the misses in batches and scatter them back into the store
+        new_entries = []
+        if misses:
+            book_ids = list(misses.keys())
+            embeddings = encode_texts([misses[book_id][0] for book_id in book_ids])
+            for book_id, embedding in zip(book_ids, embeddings):
+                content_hash = misses[book_id][1]
+                self.embedding_store.upsert(book_id, embedding, content_hash, books_by_id[book_id])
+                new_entries.append((book_id, content_hash))
         
-        if use_cache:
-            print(f"Embeddings: {new_count} new, {cached_count} from cache")
+        self._save_new_embeddings(conn, new_entries)
+        
+        if new_entries:
+            print(f"Embeddings: {len(new_entries)} new, {cached_count} from store")
+    
+    def sync_books(self, conn, book_ids=None):
+        """
+        Bring the store in line with the books table
+        
+        Embeds new or changed books and refreshes their filter attributes. A full
+        sync (book_ids=None) also drops books that no longer exist. New
+        embeddings are committed on conn, so commit pending changes first.
+        """
+        c = conn.cursor()
+        query = '''SELECT id, title, abstract, tags, genre, academic_level, subscription_level
+                   FROM books'''
+        if book_ids is None:
+            c.execute(query)
         else:
-            print("Embeddings generated!")
+            book_ids = list(book_ids)
+            if not book_ids:
+                return
+            c.execute(f"{query} WHERE id IN ({','.join('?' * len(book_ids))})", book_ids)
+        
+        books = []
+        for row in c.fetchall():
+            book = dict(row)
+            book['tags'] = book['tags'].split(',') if book['tags'] else []
+            books.append(book)
+        
+        self.generate_embeddings(books, conn=conn)
+        
+        if book_ids is None:
+            existing = {book['id'] for book in books}
+            for book_id in [book_id for book_id in self.embedding_store.ids() if book_id not in existing]:
+                self.remove_book(book_id)
+            self._catalog_synced = True
     
-    def semantic_search(self, query, books, top_k=10):
-        """Perform semantic search on books"""
-        if not books:
-            return []
+    def ensure_catalog_synced(self):
+        """
+        True once the first full sync has run. Otherwise start it on a background
+        thread (no-op while one is running) and return False, so requests never
+        embed the whole catalog inline.
+        """
+        if self._catalog_synced:
+            return True
         
-        # Check cache for query embedding
+        with self._sync_lock:
+            if self._syncing:
+                return False
+            self._syncing = True
+        
+        def run():
+            try:
+                conn = get_db()
+                try:
+                    self.load_embeddings(conn)
+                    self.sync_books(conn)
+                finally:
+                    conn.close()
+            except Exception as e:
+                print(f"Error syncing catalog embeddings: {e}")
+            finally:
+                self._syncing = False
+        
+        threading.Thread(target=run, name='catalog-sync', daemon=True).start()
+        return False
+    
+    def encode_query(self, query):
+        """Get the normalized embedding for a search query, cached by query text"""
         query_cache_key = f"query_embedding_{hashlib.md5(query.encode()).hexdigest()}"
         query_embedding = get_cached(query_cache_key)
         
         if query_embedding is None:
-            query_embedding = self.model.encode([query])
+            query_embedding = normalize_vector(query_encoder.encode(query))
             set_cached(query_cache_key, query_embedding)
         
-        # Calculate similarities
-        similarities = []
-        for book in books:
-            book_id = book['id']
-            if book_id in self.book_embeddings:
-                book_embedding = self.book_embeddings[book_id]
-                similarity = cosine_similarity([query_embedding[0]], [book_embedding])[0][0]
-                # Only include positive similarity scores (related content)
-                if float(similarity) > 0:
-                    similarities.append({
-                        'book': book,
-                        'similarity_score': float(similarity),
-                        'relevance_percentage': round(float(similarity) * 100, 1)
-                    })
+        return query_embedding
+    
+    def search_catalog(self, query, top_k=10, filters=None, nprobe=None):
+        """
+        Semantic search over the whole catalog with attribute filters applied during scoring
         
-        # Sort by similarity and return top results
-        results = sorted(similarities, key=lambda x: x['similarity_score'], reverse=True)[:top_k]
-        return results
+        Args:
+            query: Search text
+            top_k: Number of results to return
+            filters: Optional dict with max_tier (see user_subscription_tier), genre, academic_level
+            nprobe: ANN lists to probe; None uses the default
+        
+        Returns:
+            List of (book_id, similarity_score) tuples, best first
+        """
+        return self.search_vector(self.encode_query(query), top_k, filters, nprobe)
+    
+    def search_vector(self, query_embedding, top_k=10, filters=None, nprobe=None):
+        """Catalog search for an embedding that is already computed (e.g. a user profile); empty until the first sync finishes"""
+        if not self.ensure_catalog_synced():
+            return []
+        return self.ann_index.search(query_embedding, top_k, nprobe=nprobe, filters=filters)
 
 ai_engine = BookGenieAI()
+atexit.register(ai_engine.ann_index.save_if_dirty)
+
+def fetch_books_by_ids(conn, book_ids):
+    """Load search-result book dicts for the given ids with a single query, keyed by id"""
+    if not book_ids:
+        return {}
+    c = conn.cursor()
+    c.execute(f"SELECT * FROM books WHERE id IN ({','.join('?' * len(book_ids))})", list(book_ids))
+    return {row['id']: {
+        'id': row['id'],
+        'title': row['title'],
+        'author': row['author'],
+        'abstract': row['abstract'] if row['abstract'] else '',
+        'genre': row['genre'] if row['genre'] else '',
+        'academic_level': row['academic_level'] if row['academic_level'] else '',
+        'tags': row['tags'].split(',') if row['tags'] else [],
+        'cover_image': row_get(row, 'cover_image', 'book')
+    } for row in c.fetchall()}
+
+def keyword_search_books(conn, query, top_k=10, max_tier=2):
+    """
+    SQL LIKE search over title, author, abstract and tags, used while the
+    embedding catalog is still syncing. Books are ranked by the share of query
+    terms they contain and returned in the semantic search result format.
+    """
+    terms = [term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+             for term in query.lower().split()[:10]]
+    if not terms:
+        return []
+    
+    text = "(COALESCE(title, '') || ' ' || COALESCE(author, '') || ' ' || COALESCE(abstract, '') || ' ' || COALESCE(tags, ''))"
+    matched = ' + '.join(f"({text} LIKE ? ESCAPE '\\')" for _ in terms)
+    params = [f'%{term}%' for term in terms]
+    where = ''
+    if max_tier < SUBSCRIPTION_TIERS['premium']:
+        levels = [level for level, tier in SUBSCRIPTION_TIERS.items() if tier <= max_tier]
+        where = f"WHERE subscription_level IN ({','.join('?' * len(levels))})"
+        params.extend(levels)
+    
+    c = conn.cursor()
+    c.execute(f'''SELECT id, matched FROM (SELECT id, created_at, {matched} AS matched FROM books {where})
+                  WHERE matched > 0
+                  ORDER BY matched DESC, created_at DESC, id DESC
+                  LIMIT ?''', params + [top_k])
+    hits = [(row['id'], row['matched'] / len(terms)) for row in c.fetchall()]
+    
+    books_by_id = fetch_books_by_ids(conn, [book_id for book_id, _ in hits])
+    return [{
+        'book': books_by_id[book_id],
+        'similarity_score': score,
+        'relevance_percentage': round(score * 100, 1)
+    } for book_id, score in hits if book_id in books_by_id]
+
+def similar_books(conn, book_id, top_k=6):
+    """Similar-book results for a book from the precomputed neighbour table"""
+    ai_engine.load_embeddings(conn)
+    if book_id not in ai_engine.embedding_store:
+        ai_engine.sync_books(conn, [book_id])
+    
+    neighbors = ai_engine.neighbors.get(conn, book_id, top_k)
+    books_by_id = fetch_books_by_ids(conn, [neighbor_id for neighbor_id, _ in neighbors])
+    return [{
+        'book': books_by_id[neighbor_id],
+        'similarity_score': score,
+        'relevance_percentage': round(score * 100, 1)
+    } for neighbor_id, score in neighbors if neighbor_id in books_by_id]
+
+# User taste profiles: recency-weighted mean of the embeddings of books a user read or liked
+PROFILE_HALF_LIFE_DAYS = float(os.getenv('PROFILE_HALF_LIFE_DAYS', '30'))
+PROFILE_READ_WEIGHT = float(os.getenv('PROFILE_READ_WEIGHT', '1.0'))
+PROFILE_LIKE_WEIGHT = float(os.getenv('PROFILE_LIKE_WEIGHT', '2.0'))
+
+class UserProfileStore:
+    """
+    Per-user profile embeddings kept in the user_profiles table
+    
+    A profile is stored as a decayed sum of book embeddings plus the decayed
+    total weight, both as of updated_at. An event decays the stored sum to
+    now and adds its weight * embedding, so updates are O(dim) and use only
+    embeddings already in the store. Unliking subtracts the like's own
+    decayed contribution. Users without a row are bootstrapped from their
+    reading history and likes; users with no usable history are remembered
+    (until their next event or a catalog size change) so they are not
+    bootstrapped again on every lookup.
+    """
+    
+    def __init__(self, ai_engine, half_life_days=PROFILE_HALF_LIFE_DAYS):
+        self.ai_engine = ai_engine
+        self.half_life = half_life_days * 86400
+        self._lock = threading.Lock()
+        self._no_profile = {}  # user_id -> store size when bootstrap found nothing
+    
+    def _decay(self, elapsed_seconds):
+        return 2.0 ** (-elapsed_seconds / self.half_life)
+    
+    def _load(self, conn, user_id):
+        c = conn.cursor()
+        c.execute('SELECT embedding, weight, updated_at FROM user_profiles WHERE user_id=?', (user_id,))
+        row = c.fetchone()
+        if not row or len(row['embedding']) != (self.ai_engine.embedding_store.dim or 0) * 4:
+            return None
+        return np.frombuffer(row['embedding'], dtype=np.float32).astype(np.float64), row['weight'], row['updated_at']
+    
+    def _save(self, conn, user_id, vector, weight, updated_at, commit=True):
+        conn.execute('''INSERT OR REPLACE INTO user_profiles (user_id, embedding, weight, updated_at)
+                        VALUES (?, ?, ?, ?)''',
+                     (user_id, np.asarray(vector, dtype=np.float32).tobytes(), weight, updated_at))
+        if commit:
+            conn.commit()
+    
+    def bootstrap(self, conn, user_id, commit=True):
+        """Build a profile from the user's reading history and likes"""
+        store = self.ai_engine.embedding_store
+        c = conn.cursor()
+        c.execute('''SELECT book_id, CAST(strftime('%s', created_at) AS REAL) as ts, ? as weight
+                     FROM reading_history WHERE user_id=?
+                     UNION ALL
+                     SELECT book_id, CAST(strftime('%s', created_at) AS REAL) as ts, ? as weight
+                     FROM book_likes WHERE user_id=?''',
+                  (PROFILE_READ_WEIGHT, user_id, PROFILE_LIKE_WEIGHT, user_id))
+        events = [row for row in c.fetchall() if row['book_id'] in store]
+        if not events:
+            return None
+        
+        now = time.time()
+        weights = np.array([row['weight'] * self._decay(now - (row['ts'] or now)) for row in events])
+        vectors = store.vectors(store.rows_for([row['book_id'] for row in events]))
+        profile = (weights @ vectors.astype(np.float64), float(weights.sum()), now)
+        self._save(conn, user_id, *profile, commit=commit)
+        return profile
+    
+    def _apply(self, conn, user_id, book_id, weight, timestamp, commit=True):
+        """Add weight * the book's embedding (decayed from timestamp) to a stored profile"""
+        if book_id not in self.ai_engine.embedding_store:
+            return
+        profile = self._load(conn, user_id)
+        if profile is None:
+            # Bootstrapping reads the event that was just committed
+            self.bootstrap(conn, user_id, commit)
+            return
+        vector, total, updated_at = profile
+        now = time.time()
+        decay = self._decay(now - updated_at)
+        contribution = weight * self._decay(now - timestamp)
+        vector = vector * decay + contribution * self.ai_engine.embedding_store[book_id]
+        total = max(total * decay + contribution, 0.0)
+        self._save(conn, user_id, vector, total, now, commit)
+    
+    def record_read(self, conn, user_id, book_id, timestamp=None, commit=True):
+        """Update a profile after a committed reading session that happened at timestamp (default now)"""
+        self.ai_engine.load_embeddings(conn)
+        with self._lock:
+            self._no_profile.pop(user_id, None)
+            self._apply(conn, user_id, book_id, PROFILE_READ_WEIGHT, timestamp or time.time(), commit)
+    
+    def record_like(self, conn, user_id, book_id, liked=True, liked_at=None):
+        """Update a profile after a committed like (or unlike of a like made at liked_at)"""
+        self.ai_engine.load_embeddings(conn)
+        with self._lock:
+            self._no_profile.pop(user_id, None)
+            if liked:
+                self._apply(conn, user_id, book_id, PROFILE_LIKE_WEIGHT, time.time())
+            elif self._load(conn, user_id) is None:
+                self.bootstrap(conn, user_id)
+            else:
+                self._apply(conn, user_id, book_id, -PROFILE_LIKE_WEIGHT, liked_at or time.time())
+    
+    def vector(self, conn, user_id):
+        """The user's normalized profile embedding, or None without usable history"""
+        self.ai_engine.load_embeddings(conn)
+        store_size = len(self.ai_engine.embedding_store)
+        if self._no_profile.get(user_id) == store_size:
+            return None
+        with self._lock:
+            profile = self._load(conn, user_id) or self.bootstrap(conn, user_id)
+            if profile is None:
+                self._no_profile[user_id] = store_size
+        if profile is None or profile[1] <= 0:
+            return None
+        vector = normalize_vector(profile[0])
+        return vector if np.any(vector) else None
+
+user_profiles = UserProfileStore(ai_engine)
+
+# Candidate generators for the recommendation pipeline; each returns (book_ids, scores)
+def content_candidates(user_id, conn, limit):
+    """ANN neighbours of the user's profile embedding"""
+    query_embedding = user_profiles.vector(conn, user_id)
+    if query_embedding is None:
+        return [], []
+    hits = ai_engine.search_vector(query_embedding, limit)
+    return [book_id for book_id, _ in hits], [score for _, score in hits]
+
+def collaborative_candidates(user_id, conn, limit):
+    """User-kNN recommendations (popularity for users with little history)"""
+    if not collaborative_engine.refresh(conn, user_id):
+        return [], []
+    recs = collaborative_engine.get_collaborative_recommendations(user_id, top_k=limit)
+    return [rec['book_id'] for rec in recs], [rec['score'] for rec in recs]
+
+def similar_book_candidates(user_id, conn, limit):
+    """Precomputed neighbours of the user's recently read books"""
+    ai_engine.load_embeddings(conn)
+    c = conn.cursor()
+    c.execute('''SELECT DISTINCT book_id FROM reading_history
+                 WHERE user_id=? ORDER BY created_at DESC LIMIT 5''', (user_id,))
+    scores = {}
+    for row in c.fetchall():
+        for neighbor_id, score in ai_engine.neighbors.get(conn, row['book_id'], BOOK_NEIGHBORS_K):
+            scores[neighbor_id] = max(scores.get(neighbor_id, 0.0), score)
+    best = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:limit]
+    return [book_id for book_id, _ in best], [score for _, score in best]
+
+def co_read_candidates(user_id, conn, limit, max_co_readers=500):
+    """Books read by the users who share the most books with this user"""
+    matrix = collaborative_engine.refresh(conn, user_id)
+    if not matrix or user_id not in matrix:
+        return [], []
+    books = matrix.user_books(user_id)
+    if len(books) == 0:
+        return [], []
+    
+    # Shared-book count per user, from the book -> users view of the matrix
+    overlap = np.asarray((matrix.normalized_by_book[books] > 0).sum(axis=0), dtype=np.float64).ravel()
+    overlap[matrix.user_index[user_id]] = 0.0
+    co_readers = np.flatnonzero(overlap)
+    co_readers = co_readers[top_k_indices(overlap[co_readers], max_co_readers)]
+    if len(co_readers) == 0:
+        return [], []
+    
+    scores = matrix.positive[co_readers].T @ overlap[co_readers]
+    candidates = np.flatnonzero(scores > 0)
+    best = candidates[top_k_indices(scores[candidates], limit)]
+    return matrix.book_ids[best], scores[best]
+
+def same_genre_candidates(user_id, conn, limit):
+    """Most popular books in the genre the user reads most"""
+    c = conn.cursor()
+    c.execute('''SELECT b.genre, COUNT(*) as count FROM reading_history rh
+                 JOIN books b ON b.id = rh.book_id
+                 WHERE rh.user_id=? AND b.genre IS NOT NULL AND b.genre != ''
+                 GROUP BY b.genre ORDER BY count DESC LIMIT 1''', (user_id,))
+    row = c.fetchone()
+    if not row:
+        return [], []
+    recs = popularity_index.top(limit, genre=row['genre'])
+    return [rec['book_id'] for rec in recs], [rec['score'] for rec in recs]
+
+def popularity_candidates(user_id, conn, limit):
+    """Most popular books overall"""
+    recs = popularity_index.top(limit)
+    return [rec['book_id'] for rec in recs], [rec['score'] for rec in recs]
+
+recommendation_pipeline.register('content', content_candidates, weight=0.5, normalize='clip')
+recommendation_pipeline.register('collaborative', collaborative_candidates, weight=0.5, normalize='clip',
+                                 family='collaborative')
+recommendation_pipeline.register('similar_books', similar_book_candidates, weight=0.1, normalize='clip')
+recommendation_pipeline.register('co_read', co_read_candidates, weight=0.1, family='collaborative')
+recommendation_pipeline.register('same_genre', same_genre_candidates, weight=0.05)
+recommendation_pipeline.register('popularity', popularity_candidates, weight=0.05, family='collaborative')
 
 # Initialize hybrid engine after ai_engine is created
 hybrid_engine = HybridRecommendationEngine(ai_engine, collaborative_engine)
@@ -1654,6 +4307,218 @@ hybrid_engine = HybridRecommendationEngine(ai_engine, collaborative_engine)
 # Initialize hybrid engine after ai_engine is created
 hybrid_engine = HybridRecommendationEngine(ai_engine, collaborative_engine)
 
+# ============================================
+# BACKGROUND JOBS
+# ============================================
+
+# Seconds between metric rollups and ANN index checks
+METRICS_ROLLUP_INTERVAL = int(os.getenv('METRICS_ROLLUP_INTERVAL', '300'))
+ANN_REFRESH_INTERVAL = int(os.getenv('ANN_REFRESH_INTERVAL', '600'))
+BACKGROUND_JOBS_ENABLED = os.getenv('BACKGROUND_JOBS_ENABLED', 'true').lower() == 'true'
+
+class BackgroundScheduler:
+    """
+    In-process job scheduler
+    
+    Jobs are registered with an interval and run one at a time on a single
+    daemon thread, so rebuilds never overlap each other or run on a request
+    thread. Each job builds its artifact off to the side and swaps it in as
+    one reference assignment.
+    """
+    
+    def __init__(self):
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+    
+    def register(self, name, func, interval_seconds, description='', run_at_start=True):
+        """Register a zero-argument job that runs every interval_seconds"""
+        with self._lock:
+            self._jobs[name] = {
+                'name': name,
+                'func': func,
+                'interval_seconds': interval_seconds,
+                'description': description,
+                'next_run': time.time() if run_at_start else time.time() + interval_seconds,
+                'running': False,
+                'runs': 0,
+                'failures': 0,
+                'last_started': None,
+                'last_duration_ms': None,
+                'avg_duration_ms': None,
+                'last_status': None,
+                'last_error': None
+            }
+        self._wakeup.set()
+    
+    def start(self):
+        """Start the scheduler thread (safe to call more than once)"""
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._run, name='background-scheduler', daemon=True)
+            self._thread.start()
+        print(f"Background scheduler started with {len(self._jobs)} jobs")
+    
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+    
+    def trigger(self, name):
+        """Schedule a job to run as soon as the current one finishes"""
+        with self._lock:
+            if name not in self._jobs:
+                return False
+            self._jobs[name]['next_run'] = time.time()
+        self._wakeup.set()
+        return True
+    
+    def run_job(self, name):
+        """Run a job on the calling thread (used when the scheduler is not running)"""
+        job = self._jobs[name]
+        with self._lock:
+            if job['running']:
+                return False
+            job['running'] = True
+            job['last_started'] = time.time()
+        start_time = time.perf_counter()
+        try:
+            job['func']()
+            status, error = 'success', None
+        except Exception as e:
+            print(f"Background job {name} failed: {e}")
+            status, error = 'failed', str(e)
+        duration_ms = (time.perf_counter() - start_time) * 1000
+        
+        with self._lock:
+            job['running'] = False
+            job['runs'] += 1
+            job['failures'] += 1 if error else 0
+            job['last_duration_ms'] = round(duration_ms, 1)
+            job['avg_duration_ms'] = round(duration_ms if job['avg_duration_ms'] is None
+                                           else 0.8 * job['avg_duration_ms'] + 0.2 * duration_ms, 1)
+            job['last_status'] = status
+            job['last_error'] = error
+            job['next_run'] = time.time() + job['interval_seconds']
+        return status == 'success'
+    
+    def _run(self):
+        while True:
+            with self._lock:
+                due = [job for job in self._jobs.values() if job['next_run'] <= time.time()]
+                next_run = min((job['next_run'] for job in self._jobs.values()), default=time.time() + 60)
+            
+            for job in sorted(due, key=lambda job: job['next_run']):
+                self.run_job(job['name'])
+            
+            if not due:
+                self._wakeup.wait(max(0.0, next_run - time.time()))
+                self._wakeup.clear()
+    
+    def stats(self):
+        """Job timings and status"""
+        def timestamp(value):
+            return datetime.datetime.fromtimestamp(value).isoformat() if value else None
+        
+        with self._lock:
+            return [{
+                'name': job['name'],
+                'description': job['description'],
+                'interval_seconds': job['interval_seconds'],
+                'running': job['running'],
+                'runs': job['runs'],
+                'failures': job['failures'],
+                'last_started': timestamp(job['last_started']),
+                'last_duration_ms': job['last_duration_ms'],
+                'avg_duration_ms': job['avg_duration_ms'],
+                'last_status': job['last_status'],
+                'last_error': job['last_error'],
+                'next_run': timestamp(job['next_run'])
+            } for job in self._jobs.values()]
+
+scheduler = BackgroundScheduler()
+
+def rebuild_collaborative_model():
+    """Rebuild the user-item matrix from the database, then precompute similar users"""
+    collaborative_engine.rebuild()
+    collaborative_engine.precompute_similarities()
+
+def train_als_model():
+    """Retrain the ALS factors on the current collaborative matrix and persist them"""
+    matrix = collaborative_engine.user_item_matrix
+    if matrix is None:
+        matrix = collaborative_engine.rebuild()
+    
+    # Factors loaded from disk (or trained on this same matrix version) are still fresh
+    if als_engine.matrix_version == collaborative_engine.version:
+        return
+    if als_engine.trained_at is not None and als_engine.matrix_version is None \
+            and time.time() - als_engine.trained_at < ALS_TRAIN_INTERVAL:
+        return
+    
+    if als_engine.train(matrix, version=collaborative_engine.version):
+        als_engine.save()
+        invalidate_tags('collab')
+
+def rebuild_book_neighbors():
+    """Recompute every book's similar-book list (incremental updates cover changes in between)"""
+    ai_engine.load_embeddings()
+    ai_engine.neighbors.rebuild()
+
+def rebuild_popularity_index():
+    popularity_index.rebuild()
+
+def refresh_ann_index():
+    """Retrain the ANN centroids when the catalog outgrew them or the retrain interval passed with new feedback, and persist incremental changes"""
+    index = ai_engine.ann_index
+    ai_engine.load_embeddings()
+    
+    retrain = index.needs_rebuild()
+    if not retrain and index.trained_at is not None:
+        if time.time() - index.trained_at >= ai_learning_loop.retrain_interval_hours * 3600:
+            conn = get_db()
+            try:
+                retrain = ai_learning_loop.should_retrain(conn, 'content')
+            finally:
+                conn.close()
+    
+    if retrain and index.build():
+        index.save()
+    index.save_if_dirty()
+
+def rollup_recommendation_metrics():
+    conn = get_db()
+    try:
+        ai_learning_loop.rollup_metrics(conn)
+    finally:
+        conn.close()
+
+# The collaborative model is built at startup (or on first use), so its first rebuild waits an interval
+scheduler.register('collaborative_model', rebuild_collaborative_model, COLLAB_REBUILD_INTERVAL,
+                   'Full rebuild of the collaborative user-item matrix and similar-user lists',
+                   run_at_start=False)
+scheduler.register('als_model', train_als_model, ALS_TRAIN_INTERVAL,
+                   'Retrain the implicit ALS factors used by engine=als')
+scheduler.register('book_neighbors', rebuild_book_neighbors, BOOK_NEIGHBORS_INTERVAL,
+                   'Full rebuild of the precomputed similar-books table', run_at_start=False)
+scheduler.register('popularity', rebuild_popularity_index, POPULARITY_REBUILD_INTERVAL,
+                   'Recompute time-decayed popularity rankings from the interaction tables')
+scheduler.register('ann_index', refresh_ann_index, ANN_REFRESH_INTERVAL,
+                   'Retrain the ANN index centroids when needed and save incremental additions')
+scheduler.register('metrics_rollup', rollup_recommendation_metrics, METRICS_ROLLUP_INTERVAL,
+                   'Recompute recent daily recommendation metrics from feedback')
+
+@app.before_request
+def start_background_jobs():
+    # Started from the first request so only the serving process (not the reloader parent) runs jobs
+    if BACKGROUND_JOBS_ENABLED and not scheduler.running:
+        scheduler.start()
+    # The first catalog embedding sync and collaborative build also run off the request path
+    ai_engine.ensure_catalog_synced()
+    if collaborative_engine.built_at is None:
+        collaborative_engine.build_in_background()
+
 # ============================================
 # JWT AUTHENTICATION ENDPOINTS
 # ============================================
@@ -1745,6 +4610,7 @@ def auth_login():
             if user_row['role'] == 'admin' and (user_row['subscription_level'] or 'free') != 'premium':
                 c.execute('UPDATE users SET subscription_level = ? WHERE id=?', ('premium', user_row['id']))
                 conn.commit()
+                invalidate_user_context(user_row['id'])
                 subscription_level = 'premium'
             else:
                 subscription_level = user_row['subscription_level'] or 'free'
@@ -1815,6 +4681,7 @@ def auth_verify():
     if user_row['role'] == 'admin' and (user_row['subscription_level'] or 'free') != 'premium':
         c.execute('UPDATE users SET subscription_level = ? WHERE id=?', ('premium', user_row['id']))
         conn.commit()
+        invalidate_user_context(user_row['id'])
         subscription_level = 'premium'
     else:
         subscription_level = user_row['subscription_level'] or 'free'
@@ -1869,106 +4736,159 @@ def get_user():
 # BOOK ROUTES
 # ============================================
 
+# Book listings: keyset pagination over (created_at, id), newest first
+BOOKS_MAX_PER_PAGE = int(os.getenv('BOOKS_MAX_PER_PAGE', '100'))
+
+def encode_book_cursor(created_at, book_id):
+    """Opaque cursor for the position after a (created_at, id) row"""
+    return base64.urlsafe_b64encode(json.dumps([created_at, book_id]).encode()).decode().rstrip('=')
+
+def decode_book_cursor(cursor):
+    """(created_at, id) from a cursor; raises ValueError if it is malformed"""
+    try:
+        created_at, book_id = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except Exception:
+        raise ValueError('Invalid cursor')
+    if not isinstance(created_at, str) or not isinstance(book_id, int):
+        raise ValueError('Invalid cursor')
+    return created_at, book_id
+
+def paginate_books(conn, where, params, args):
+    """
+    Run a book listing query (WHERE clause + params) with the pagination in args
+    
+    args may hold per_page, page (offset pagination, kept for existing clients)
+    or cursor (keyset pagination: the next_cursor of the previous page, which
+    costs O(per_page) at any depth), and include_total: 'true' (exact COUNT),
+    'approx' (count cached for the books TTL) or 'false'. The total defaults
+    to 'false' for cursor requests and 'true' otherwise.
+    
+    Returns (rows, pagination dict); raises ValueError for bad arguments.
+    """
+    try:
+        per_page = min(max(int(args.get('per_page', 12)), 1), BOOKS_MAX_PER_PAGE)
+        page = max(int(args.get('page', 1)), 1)
+    except (TypeError, ValueError):
+        raise ValueError('page and per_page must be integers')
+    cursor = args.get('cursor')
+    include_total = args.get('include_total', 'false' if cursor else 'true').lower()
+    if include_total not in ('true', 'false', 'approx'):
+        raise ValueError("include_total must be 'true', 'false' or 'approx'")
+    
+    c = conn.cursor()
+    query = f"SELECT * FROM books WHERE {where}"
+    query_params = list(params)
+    if cursor:
+        # Row-value comparison walks the (created_at DESC, id DESC) index from the cursor
+        query += " AND (created_at, id) < (?, ?)"
+        query_params.extend(decode_book_cursor(cursor))
+        offset = 0
+        page = None
+    else:
+        offset = (page - 1) * per_page
+    
+    # One extra row tells whether there is a next page
+    c.execute(f"{query} ORDER BY created_at DESC, id DESC LIMIT ? OFFSET ?",
+              query_params + [per_page + 1, offset])
+    rows = c.fetchall()
+    has_more = len(rows) > per_page
+    rows = rows[:per_page]
+    
+    total = None
+    if include_total != 'false':
+        count_key = f"books_count_{where}_{params}"
+        total = get_cached(count_key) if include_total == 'approx' else None
+        if total is None:
+            c.execute(f"SELECT COUNT(*) FROM books WHERE {where}", list(params))
+            total = c.fetchone()[0]
+            set_cached(count_key, total, tags=('books',))
+    
+    return rows, {
+        'page': page,
+        'per_page': per_page,
+        'total': total,
+        'total_pages': (total + per_page - 1) // per_page if total is not None else None,
+        'total_approximate': include_total == 'approx',
+        'has_more': has_more,
+        'next_cursor': encode_book_cursor(rows[-1]['created_at'], rows[-1]['id']) if has_more else None
+    }
+
 @app.route('/api/books', methods=['GET', 'POST'])
 @require_auth
 def books():
     try:
         if request.method == 'GET':
-            # Check cache first
             genre = request.args.get('genre')
             level = request.args.get('academic_level')
             user_id = request.current_user['user_id']
             
-            # Get user subscription from database (not from token)
-            conn = get_db()
-            c = conn.cursor()
-            c.execute('SELECT subscription_level FROM users WHERE id=?', (user_id,))
-            user_row = c.fetchone()
-            user_subscription = user_row['subscription_level'] or 'free' if user_row else 'free'
-            
-            # Build cache key
-            cache_key = f"books_{user_subscription}_{genre or 'all'}_{level or 'all'}"
-            cached_books = get_cached(cache_key)
+            # Subscription from the database (not from the token), via the user context cache
+            user_subscription = request.user_context['subscription_level']
             
-            if cached_books is not None:
-                conn.close()
-                return jsonify(cached_books)
+            # Every page is cached under the full filter set (tier, filters, page or cursor, page size, count mode)
+            cursor = request.args.get('cursor')
+            cache_key = (f"books_{user_subscription}_{genre or 'all'}_{level or 'all'}"
+                         f"_{'c' + cursor if cursor else 'p' + request.args.get('page', '1')}"
+                         f"_{request.args.get('per_page', '12')}_{request.args.get('include_total', '')}")
             
-            # Optimized query using indexes
-            if user_subscription == 'free':
-                base_query = "SELECT * FROM books WHERE subscription_level = 'free'"
-                params = []
-            elif user_subscription == 'basic':
-                base_query = "SELECT * FROM books WHERE subscription_level IN ('free', 'basic')"
-                params = []
-            else:
-                base_query = "SELECT * FROM books WHERE 1=1"
+            def compute():
+                # Optimized query using indexes
+                if user_subscription == 'free':
+                    where = "subscription_level = 'free'"
+                elif user_subscription == 'basic':
+                    where = "subscription_level IN ('free', 'basic')"
+                else:
+                    where = "1=1"
                 params = []
-            
-            # Add filters (these use indexes)
-            if genre:
-                base_query += " AND genre = ?"
-                params.append(genre)
-            if level:
-                base_query += " AND academic_level = ?"
-                params.append(level)
-            
-            # Get pagination parameters
-            page = int(request.args.get('page', 1))
-            per_page = int(request.args.get('per_page', 12))
-            offset = (page - 1) * per_page
-            
-            # Get total count for pagination
-            count_query = base_query.replace("SELECT *", "SELECT COUNT(*)")
-            c.execute(count_query, params)
-            total_count = c.fetchone()[0]
-            
-            # Use index on created_at DESC with pagination
-            base_query += " ORDER BY created_at DESC LIMIT ? OFFSET ?"
-            params.extend([per_page, offset])
-            
-            c.execute(base_query, params)
-            books = []
-            for row in c.fetchall():
-                books.append({
-                    'id': row['id'],
-                    'title': row['title'],
-                    'author': row['author'],
-                    'abstract': row['abstract'] if row['abstract'] else '',
-                    'genre': row['genre'] if row['genre'] else '',
-                    'academic_level': row['academic_level'] if row['academic_level'] else '',
-                    'tags': row['tags'].split(',') if row['tags'] else [],
-                    'file_url': row['file_url'] if row['file_url'] else '',
-                    'cover_image': row_get(row, 'cover_image', 'book'),
-                    'subscription_level': row_get(row, 'subscription_level', 'free'),
-                    'pages': row_get(row, 'pages', 0)
-                })
-            
-            conn.close()
-            
-            # Calculate pagination metadata
-            total_pages = (total_count + per_page - 1) // per_page
-            
-            # Cache the results (only cache first page for performance)
-            if page == 1:
-                set_cached(cache_key, books)
-            
-            # Generate embeddings (cached) - wrap in try-except to prevent errors
-            try:
-                ai_engine.generate_embeddings(books, use_cache=True)
-            except Exception as e:
-                print(f"Warning: Failed to generate embeddings: {e}")
-                # Continue without embeddings
-            
-            return jsonify({
-                'books': books,
-                'pagination': {
-                    'page': page,
-                    'per_page': per_page,
-                    'total': total_count,
-                    'total_pages': total_pages
+                
+                # Add filters (these use indexes)
+                if genre:
+                    where += " AND genre = ?"
+                    params.append(genre)
+                if level:
+                    where += " AND academic_level = ?"
+                    params.append(level)
+                
+                # Newest first, by page or by cursor (see paginate_books)
+                conn = get_db()
+                try:
+                    rows, pagination = paginate_books(conn, where, params, request.args)
+                finally:
+                    conn.close()
+                
+                books = []
+                for row in rows:
+                    books.append({
+                        'id': row['id'],
+                        'title': row['title'],
+                        'author': row['author'],
+                        'abstract': row['abstract'] if row['abstract'] else '',
+                        'genre': row['genre'] if row['genre'] else '',
+                        'academic_level': row['academic_level'] if row['academic_level'] else '',
+                        'tags': row['tags'].split(',') if row['tags'] else [],
+                        'file_url': row['file_url'] if row['file_url'] else '',
+                        'cover_image': row_get(row, 'cover_image', 'book'),
+                        'subscription_level': row_get(row, 'subscription_level', 'free'),
+                        'pages': row_get(row, 'pages', 0)
+                    })
+                
+                # Generate embeddings (cached) - wrap in try-except to prevent errors
+                try:
+                    ai_engine.generate_embeddings(books, use_cache=True)
+                except Exception as e:
+                    print(f"Warning: Failed to generate embeddings: {e}")
+                    # Continue without embeddings
+                
+                return {
+                    'books': books,
+                    'pagination': pagination
                 }
-            })
+            
+            # Book writes invalidate the 'books' tag
+            try:
+                return jsonify(get_or_compute(cache_key, compute, tags=('books',)))
+            except ValueError as e:
+                return jsonify({'error': str(e)}), 400
     except Exception as e:
         import traceback
         print(f"Error in books endpoint: {e}")
@@ -1998,6 +4918,9 @@ def books():
             book_id = c.lastrowid
             conn.commit()
             
+            # Embed the new book so it is searchable right away
+            ai_engine.sync_books(conn, [book_id])
+            
             # Index in Elasticsearch if enabled
             if es_service.enabled:
                 book_data = {
@@ -2017,7 +4940,7 @@ def books():
             conn.close()
             
             # Clear books cache when new book is added
-            clear_cache('books_')
+            invalidate_tags('books')
             
             return jsonify({'success': True, 'id': book_id}), 201
         except Exception as e:
@@ -2034,9 +4957,7 @@ def get_book(book_id):
         
         # Get user subscription to check access
         user_id = request.current_user['user_id']
-        c.execute('SELECT subscription_level FROM users WHERE id=?', (user_id,))
-        user_row = c.fetchone()
-        user_subscription = user_row['subscription_level'] or 'free' if user_row else 'free'
+        user_subscription = request.user_context['subscription_level']
         
         # Get book
         c.execute('SELECT * FROM books WHERE id=?', (book_id,))
@@ -2129,6 +5050,9 @@ def admin_book_management(book_id):
         c.execute(query, params)
         conn.commit()
         
+        # Re-embed changed text and refresh the search filter attributes
+        ai_engine.sync_books(conn, [book_id])
+        
         # Update Elasticsearch index if enabled
         if es_service.enabled:
             c.execute('SELECT * FROM books WHERE id=?', (book_id,))
@@ -2151,7 +5075,7 @@ def admin_book_management(book_id):
         conn.close()
         
         # Clear cache
-        clear_cache('books_')
+        invalidate_tags('books')
         
         return jsonify({'success': True, 'message': 'Book updated successfully'})
     
@@ -2180,8 +5104,9 @@ def admin_book_management(book_id):
                 except:
                     pass
         
-        # Delete book
+        # Delete book and its persisted embedding
         c.execute('DELETE FROM books WHERE id=?', (book_id,))
+        ai_engine.remove_book(book_id, conn)
         conn.commit()
         conn.close()
         
@@ -2190,36 +5115,56 @@ def admin_book_management(book_id):
             es_service.delete_book(book_id)
         
         # Clear cache
-        clear_cache('books_')
+        invalidate_tags('books')
         
         return jsonify({'success': True, 'message': 'Book deleted successfully'})
 
+def apply_event(conn, user_id, book_id, kind, value, ts=None, commit=True):
+    """
+    Update the models in place after a committed event (instead of rebuilding them)
+    
+    kind is 'reading' for a reading session (value = duration in minutes) or an
+    interaction type (value = interaction_value). ts is when the event happened
+    (default now); the popularity and profile decay start from it. Profile
+    writes are committed on conn unless commit=False, for callers that apply
+    a batch and commit once.
+    """
+    collaborative_engine.apply_interaction(conn, user_id, book_id)
+    if kind == 'reading':
+        popularity_index.record(conn, book_id, reading_weight(1, value)
+                                + interaction_weight('read', min(value / 60.0, 1.0), 1), ts)
+        user_profiles.record_read(conn, user_id, book_id, ts, commit)
+    else:
+        popularity_index.record(conn, book_id, interaction_weight(kind, value, 1), ts)
+
+# Longest reading session recorded; longer durations are clamped to it
+READING_MAX_DURATION_MINUTES = int(os.getenv('READING_MAX_DURATION_MINUTES', str(24 * 60)))
+
 @app.route('/api/books/<int:book_id>/read', methods=['POST'])
 @require_auth
 def record_reading(book_id):
     data = request.json
-    duration = data.get('duration_minutes', 5)
     user_id = request.current_user['user_id']
-    
-    conn = get_db()
-    c = conn.cursor()
-    
-    # Record reading history
-    c.execute('''INSERT INTO reading_history (user_id, book_id, duration_minutes)
-                 VALUES (?, ?, ?)''',
-              (user_id, book_id, duration))
-    
-    # Also record as interaction for collaborative filtering
-    c.execute('''INSERT INTO user_book_interactions (user_id, book_id, interaction_type, interaction_value)
-                 VALUES (?, ?, ?, ?)''',
-              (user_id, book_id, 'read', min(duration / 60.0, 1.0)))  # Normalize duration
-    
-    conn.commit()
-    conn.close()
-    
-    # Clear collaborative filtering cache when user interactions change
-    clear_cache('collab_rec_')
-    clear_cache('dashboard_')
+    try:
+        duration = int(data.get('duration_minutes', 5))
+        if duration < 0:
+            raise ValueError
+    except (TypeError, ValueError, OverflowError):
+        return jsonify({'error': 'duration_minutes must be a non-negative integer'}), 400
+    duration = min(duration, READING_MAX_DURATION_MINUTES)
+    
+    def after_commit(conn):
+        apply_event(conn, user_id, book_id, 'reading', duration)
+        
+        # Only this user's dashboard and recommendations depend on their own history
+        invalidate_tags(user_cache_tag(user_id))
+    
+    # Record reading history, and also as an interaction for collaborative filtering
+    # (written by the event writer; the models and caches are updated once it is committed)
+    event_writer.write('reading_history', user_id=user_id, book_id=book_id, duration_minutes=duration)
+    event_writer.write('user_book_interactions', after=after_commit,
+                       user_id=user_id, book_id=book_id, interaction_type='read',
+                       interaction_value=min(duration / 60.0, 1.0))  # Normalize duration
     
     return jsonify({'success': True, 'message': 'Reading session recorded'})
 
@@ -2229,66 +5174,146 @@ def record_interaction(book_id):
     """Record user interaction with a book (view, download, bookmark, etc.)"""
     data = request.json
     interaction_type = data.get('type', 'view')  # view, download, bookmark, share
-    interaction_value = data.get('value', 1.0)
     user_id = request.current_user['user_id']
     
-    conn = get_db()
-    c = conn.cursor()
-    
-    # Record interaction
-    c.execute('''INSERT INTO user_book_interactions (user_id, book_id, interaction_type, interaction_value)
-                 VALUES (?, ?, ?, ?)''',
-              (user_id, book_id, interaction_type, interaction_value))
+    # Validated here: the row is written later by the event writer, in a batch with other users' events
+    if not isinstance(interaction_type, str) or not 0 < len(interaction_type) <= 32:
+        return jsonify({'error': 'type must be a non-empty string'}), 400
+    try:
+        interaction_value = float(data.get('value', 1.0))
+        if not np.isfinite(interaction_value):
+            raise ValueError
+    except (TypeError, ValueError):
+        return jsonify({'error': 'value must be a finite number'}), 400
     
-    conn.commit()
-    conn.close()
+    def after_commit(conn):
+        apply_event(conn, user_id, book_id, interaction_type, interaction_value)
+        
+        # Clear this user's cached dashboard and recommendations
+        invalidate_tags(user_cache_tag(user_id))
     
-    # Clear cache
-    clear_cache('collab_rec_')
-    clear_cache('dashboard_')
+    # Record interaction (written by the event writer)
+    event_writer.write('user_book_interactions', after=after_commit,
+                       user_id=user_id, book_id=book_id, interaction_type=interaction_type,
+                       interaction_value=interaction_value)
     
     return jsonify({'success': True, 'message': f'{interaction_type} interaction recorded'})
 
-@app.route('/api/books/<int:book_id>/recommendations')
-def get_recommendations(book_id):
-    conn = get_db()
-    c = conn.cursor()
-    c.execute("SELECT * FROM books WHERE id != ?", (book_id,))
-    other_books = []
-    for row in c.fetchall():
-        other_books.append({
-            'id': row['id'],
-            'title': row['title'],
-            'author': row['author'],
-            'abstract': row['abstract'] if row['abstract'] else '',
-            'genre': row['genre'] if row['genre'] else '',
-            'academic_level': row['academic_level'] if row['academic_level'] else '',
-            'tags': row['tags'].split(',') if row['tags'] else [],
-            'cover_image': row_get(row, 'cover_image', 'book')
-        })
-    
-    c.execute("SELECT * FROM books WHERE id = ?", (book_id,))
-    target_book_row = c.fetchone()
-    conn.close()
+# Most events accepted by one /api/interactions/batch request
+INTERACTION_BATCH_MAX_EVENTS = int(os.getenv('INTERACTION_BATCH_MAX_EVENTS', '500'))
+
+@app.route('/api/interactions/batch', methods=['POST'])
+@require_auth
+def record_interactions_batch():
+    """
+    Record a batch of interactions and reading sessions (e.g. buffered by the client)
+    
+    Body: {"events": [{"book_id": 1, "type": "view", "value": 0.5, "timestamp": 1700000000}, ...]}
+    type 'read' records a reading session of duration_minutes (default 5);
+    timestamp (unix seconds, optional) is when the event happened. The batch is
+    rejected if any event is malformed; events for books that no longer exist
+    are skipped.
+    """
+    data = request.get_json(silent=True) or {}
+    events = data.get('events')
+    if not isinstance(events, list) or not events:
+        return jsonify({'error': 'events must be a non-empty list'}), 400
+    if len(events) > INTERACTION_BATCH_MAX_EVENTS:
+        return jsonify({'error': f'At most {INTERACTION_BATCH_MAX_EVENTS} events per batch'}), 400
     
-    if not target_book_row:
-        return jsonify({'error': 'Book not found'}), 404
+    user_id = request.current_user['user_id']
+    now = time.time()
+    parsed = []
+    errors = []
+    for index, event in enumerate(events):
+        try:
+            if not isinstance(event, dict):
+                raise ValueError('event must be an object')
+            book_id = event.get('book_id')
+            if not isinstance(book_id, int) or isinstance(book_id, bool):
+                raise ValueError('book_id must be an integer')
+            interaction_type = event.get('type', 'view')
+            if not isinstance(interaction_type, str) or not 0 < len(interaction_type) <= 32:
+                raise ValueError('type must be a non-empty string')
+            value = float(event.get('value', 1.0))
+            if not np.isfinite(value):
+                raise ValueError('value must be a finite number')
+            duration = int(event.get('duration_minutes', 5))
+            if duration < 0:
+                raise ValueError('duration_minutes must not be negative')
+            duration = min(duration, READING_MAX_DURATION_MINUTES)
+            timestamp = float(event.get('timestamp', now))
+            if not np.isfinite(timestamp) or timestamp < 0:
+                raise ValueError('timestamp must be a non-negative unix time')
+            if timestamp > now + 300:
+                raise ValueError('timestamp is in the future')
+            created_at = time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(timestamp))
+        except (TypeError, ValueError, OverflowError) as e:
+            errors.append({'index': index, 'error': str(e)})
+            continue
+        parsed.append((book_id, interaction_type, value, duration, created_at, timestamp))
+    
+    if errors:
+        return jsonify({'error': 'Invalid events', 'errors': errors}), 400
     
-    target_book = {
-        'id': target_book_row['id'],
-        'title': target_book_row['title'],
-        'author': target_book_row['author'],
-        'abstract': target_book_row['abstract']
-    }
+    conn = get_db()
+    try:
+        c = conn.cursor()
+        book_ids = sorted({event[0] for event in parsed})
+        c.execute(f'SELECT id FROM books WHERE id IN ({",".join("?" * len(book_ids))})', book_ids)
+        existing = {row['id'] for row in c.fetchall()}
+        skipped = [event for event in parsed if event[0] not in existing]
+        parsed = [event for event in parsed if event[0] in existing]
+        
+        readings = [(user_id, book_id, duration, created_at)
+                    for book_id, interaction_type, _, duration, created_at, _ in parsed if interaction_type == 'read']
+        # Reading sessions are also interactions for collaborative filtering (normalized duration)
+        interactions = [(user_id, book_id, interaction_type,
+                         min(duration / 60.0, 1.0) if interaction_type == 'read' else value, created_at)
+                        for book_id, interaction_type, value, duration, created_at, _ in parsed]
+        
+        # One transaction for the whole batch
+        c.executemany('''INSERT INTO reading_history (user_id, book_id, duration_minutes, created_at)
+                         VALUES (?, ?, ?, ?)''', readings)
+        c.executemany('''INSERT INTO user_book_interactions
+                         (user_id, book_id, interaction_type, interaction_value, created_at)
+                         VALUES (?, ?, ?, ?, ?)''', interactions)
+        conn.commit()
+        
+        # Model updates decay from each event's own timestamp; profile writes commit once
+        for book_id, interaction_type, value, duration, _, timestamp in parsed:
+            if interaction_type == 'read':
+                apply_event(conn, user_id, book_id, 'reading', duration, timestamp, commit=False)
+            else:
+                apply_event(conn, user_id, book_id, interaction_type, value, timestamp, commit=False)
+        conn.commit()
+    finally:
+        conn.close()
     
-    all_books = other_books + [target_book]
-    ai_engine.generate_embeddings(all_books)
+    # One invalidation for the user's dashboard and recommendations
+    if parsed:
+        invalidate_tags(user_cache_tag(user_id))
     
-    results = ai_engine.semantic_search(
-        f"{target_book['title']} {target_book['abstract']}",
-        other_books,
-        6
-    )
+    return jsonify({
+        'success': True,
+        'recorded': len(parsed),
+        'reading_sessions': len(readings),
+        'skipped_book_ids': sorted({event[0] for event in skipped}),
+        'message': f'{len(parsed)} events recorded'
+    })
+
+@app.route('/api/books/<int:book_id>/recommendations')
+def get_recommendations(book_id):
+    conn = get_db()
+    try:
+        c = conn.cursor()
+        c.execute('SELECT id FROM books WHERE id = ?', (book_id,))
+        if not c.fetchone():
+            return jsonify({'error': 'Book not found'}), 404
+        
+        results = similar_books(conn, book_id, 6)
+    finally:
+        conn.close()
     
     return jsonify(results)
 
@@ -2299,6 +5324,16 @@ def search():
     top_k = data.get('top_k', 10)
     use_elasticsearch = data.get('use_elasticsearch', True)  # Default to True if available
     
+    # Recall-vs-latency knob for the ANN index (number of lists probed)
+    nprobe = data.get('nprobe')
+    if nprobe is not None:
+        try:
+            nprobe = int(nprobe)
+            if nprobe < 1:
+                raise ValueError
+        except (TypeError, ValueError):
+            return jsonify({'error': 'nprobe must be a positive integer'}), 400
+    
     # Get user subscription level if authenticated
     user_subscription = 'free'
     auth_header = request.headers.get('Authorization')
@@ -2307,13 +5342,7 @@ def search():
             token = auth_header.split(' ')[1]
             payload = verify_token(token)
             if payload:
-                conn = get_db()
-                c = conn.cursor()
-                c.execute('SELECT subscription_level FROM users WHERE id=?', (payload['user_id'],))
-                user_row = c.fetchone()
-                if user_row:
-                    user_subscription = user_row['subscription_level'] or 'free'
-                conn.close()
+                user_subscription = get_user_context(payload['user_id'])['subscription_level']
         except:
             pass
     
@@ -2345,13 +5374,8 @@ def search():
                     payload = verify_token(token)
                     if payload:
                         user_id = payload['user_id']
-                        conn = get_db()
-                        c = conn.cursor()
-                        c.execute('''INSERT INTO search_history (user_id, query, results_count)
-                                     VALUES (?, ?, ?)''',
-                                 (user_id, query, len(results)))
-                        conn.commit()
-                        conn.close()
+                        event_writer.write('search_history', user_id=user_id, query=query,
+                                           results_count=len(results))
                 except:
                     pass
             
@@ -2367,27 +5391,6 @@ def search():
     conn = get_db()
     c = conn.cursor()
     
-    # Filter books by subscription
-    if user_subscription == 'free':
-        c.execute("SELECT * FROM books WHERE subscription_level = 'free'")
-    elif user_subscription == 'basic':
-        c.execute("SELECT * FROM books WHERE subscription_level IN ('free', 'basic')")
-    else:
-        c.execute("SELECT * FROM books")
-    
-    books = []
-    for row in c.fetchall():
-        books.append({
-            'id': row['id'],
-            'title': row['title'],
-            'author': row['author'],
-            'abstract': row['abstract'] if row['abstract'] else '',
-            'genre': row['genre'] if row['genre'] else '',
-            'academic_level': row['academic_level'] if row['academic_level'] else '',
-            'tags': row['tags'].split(',') if row['tags'] else [],
-            'cover_image': row_get(row, 'cover_image', 'book')
-        })
-    
     # Log search history if user is authenticated
     user_id = None
     if auth_header:
@@ -2399,26 +5402,36 @@ def search():
         except:
             pass
     
-    ai_engine.generate_embeddings(books)
-    all_results = ai_engine.semantic_search(query, books, top_k * 2)  # Get more results to filter
+    max_tier = user_subscription_tier(user_subscription)
+    if ai_engine.ensure_catalog_synced():
+        # Subscription filtering happens inside the vector search (attribute masks),
+        # so only the top hits are loaded from the database
+        hits = ai_engine.search_catalog(query, top_k, filters={'max_tier': max_tier}, nprobe=nprobe)
+        books_by_id = fetch_books_by_ids(conn, [book_id for book_id, _ in hits])
+        
+        # Only positive similarity scores are returned by the index
+        results = [{
+            'book': books_by_id[book_id],
+            'similarity_score': score,
+            'relevance_percentage': round(score * 100, 1)
+        } for book_id, score in hits if book_id in books_by_id]
+        search_engine = 'sqlite'
+    else:
+        # Embeddings are still being synced in the background: keyword matches until then
+        results = keyword_search_books(conn, query, top_k, max_tier)
+        search_engine = 'keyword'
     
-    # Filter out negative matches - only return results with positive similarity
-    results = [r for r in all_results if r.get('similarity_score', 0) > 0][:top_k]
+    conn.close()
     
     if user_id:
-        c.execute('''INSERT INTO search_history (user_id, query, results_count)
-                     VALUES (?, ?, ?)''',
-                 (user_id, query, len(results)))
-        conn.commit()
-    
-    conn.close()
+        event_writer.write('search_history', user_id=user_id, query=query, results_count=len(results))
     
     return jsonify({
         'query': query,
         'results': results,
         'total_count': len(results),
         'message': f'Found {len(results)} results',
-        'search_engine': 'sqlite'
+        'search_engine': search_engine
     })
 
 @app.route('/api/search/history', methods=['GET'])
@@ -2460,12 +5473,7 @@ def get_hybrid_recommendations():
     user_id = request.current_user['user_id']
     
     # Check user subscription level - enhanced recommendations are for Basic/Premium only
-    conn = get_db()
-    c = conn.cursor()
-    c.execute('SELECT subscription_level FROM users WHERE id=?', (user_id,))
-    user_row = c.fetchone()
-    user_subscription = user_row['subscription_level'] or 'free' if user_row else 'free'
-    conn.close()
+    user_subscription = request.user_context['subscription_level']
     
     if user_subscription == 'free':
         return jsonify({
@@ -2481,55 +5489,59 @@ def get_hybrid_recommendations():
     if content_weight < 0 or collaborative_weight < 0:
         return jsonify({'error': 'Weights must be non-negative'}), 400
     
-    # Check cache
-    cache_key = f"hybrid_rec_{user_id}_{top_k}_{content_weight}_{collaborative_weight}"
-    cached_recs = get_cached(cache_key)
-    if cached_recs is not None:
-        return jsonify(cached_recs)
-    
-    conn = get_db()
-    
-    try:
-        # Get hybrid recommendations
+    def compute():
+        # Get hybrid recommendations (the branches open their own connections)
+        branch_status = {}
         recommendations = hybrid_engine.get_hybrid_recommendations(
             user_id, 
-            conn, 
+            None, 
             top_k=top_k,
             content_weight=content_weight,
-            collaborative_weight=collaborative_weight
+            collaborative_weight=collaborative_weight,
+            branch_status=branch_status
         )
+        degraded_branches = sorted(name for name, status in branch_status.items() if status != 'ok')
         
         if not recommendations:
-            conn.close()
-            return jsonify({
+            return {
                 'recommendations': [],
                 'message': 'No recommendations available. Try reading some books first!',
-                'type': 'hybrid'
-            })
+                'type': 'hybrid',
+                'degraded_branches': degraded_branches
+            }
         
-        result = {
+        return {
             'recommendations': recommendations,
             'type': 'hybrid',
             'total_count': len(recommendations),
+            'degraded_branches': degraded_branches,
             'weights': {
                 'content': content_weight,
                 'collaborative': collaborative_weight
             },
+            # Share of hybrid_score each candidate generator contributes (before renormalization)
+            'generator_weights': {name: round(weight, 4) for name, weight
+                                  in hybrid_engine.generator_weights(content_weight, collaborative_weight).items()},
             'stats': {
                 'with_content_only': sum(1 for r in recommendations if r['has_content'] and not r['has_collaborative']),
                 'with_collaborative_only': sum(1 for r in recommendations if r['has_collaborative'] and not r['has_content']),
                 'with_both': sum(1 for r in recommendations if r['has_content'] and r['has_collaborative'])
             }
         }
-        
-        # Cache for 10 minutes
-        set_cached(cache_key, result)
-        
-        conn.close()
+    
+    try:
+        # Cached for 10 minutes (hybrid_rec_ namespace); concurrent misses share one computation
+        # and expired entries are served while a background refresh runs. Responses missing a
+        # branch are not cached, so the next request tries the full computation again
+        result = get_or_compute(f"hybrid_rec_{user_id}_{top_k}_{content_weight}_{collaborative_weight}",
+                                compute,
+                                tags=(user_cache_tag(user_id), 'collab'),
+                                stale_while_revalidate=True,
+                                cacheable=lambda result: bool(result['recommendations'])
+                                and not result['degraded_branches'])
         return jsonify(result)
     
     except Exception as e:
-        conn.close()
         return jsonify({
             'error': 'Failed to generate hybrid recommendations',
             'message': str(e)
@@ -2539,30 +5551,19 @@ def get_hybrid_recommendations():
 # STUDENT DASHBOARD
 # ============================================
 
-@app.route('/api/student/dashboard', methods=['GET'])
-@require_auth
-def student_dashboard():
-    # Only allow students to access student dashboard
-    if request.current_user.get('role') == 'admin':
-        return jsonify({'error': 'This endpoint is for students only. Admins should use /api/admin/analytics'}), 403
-    
-    user_id = request.current_user['user_id']
-    
-    # Check cache (but allow cache bypass with query parameter)
-    cache_key = f"dashboard_{user_id}"
-    bypass_cache = request.args.get('t')  # Timestamp parameter bypasses cache
-    if not bypass_cache:
-        cached_dashboard = get_cached(cache_key)
-        if cached_dashboard is not None:
-            return jsonify(cached_dashboard)
-    
+def build_student_dashboard(user_id):
+    """Compute a student's dashboard (runs outside the request when refreshed in the background)"""
     conn = get_db()
+    try:
+        return _build_student_dashboard(conn, user_id)
+    finally:
+        conn.close()
+
+def _build_student_dashboard(conn, user_id):
     c = conn.cursor()
     
-    # Optimized: Single query for user subscription
-    c.execute('SELECT subscription_level FROM users WHERE id=?', (user_id,))
-    user_row = c.fetchone()
-    subscription_level = user_row['subscription_level'] or 'free' if user_row else 'free'
+    # User subscription from the user context cache (may also run outside a request)
+    subscription_level = get_user_context(user_id)['subscription_level']
     
     # Optimized: Use indexes for counts
     c.execute('SELECT COUNT(*) FROM search_history WHERE user_id=?', (user_id,))
@@ -2636,11 +5637,7 @@ def student_dashboard():
             
             if recent_book:
                 # Get content-based recommendations for recently read book
-                recommendations = get_recommendations(recent_book['book_id'])
-                if isinstance(recommendations, tuple):
-                    recommended_books = recommendations[0].json if hasattr(recommendations[0], 'json') else []
-                else:
-                    recommended_books = recommendations.json if hasattr(recommendations, 'json') else []
+                recommended_books = similar_books(conn, recent_book['book_id'])
     else:
         # Basic recommendations for Free users (content-based only)
         c.execute('''SELECT DISTINCT book_id FROM reading_history 
@@ -2649,11 +5646,7 @@ def student_dashboard():
         
         if recent_book:
             # Get content-based recommendations for recently read book
-            recommendations = get_recommendations(recent_book['book_id'])
-            if isinstance(recommendations, tuple):
-                recommended_books = recommendations[0].json if hasattr(recommendations[0], 'json') else []
-            else:
-                recommended_books = recommendations.json if hasattr(recommendations, 'json') else []
+            recommended_books = similar_books(conn, recent_book['book_id'])
     
     # Premium analytics (only for premium users) - BEFORE closing connection
     premium_analytics = None
@@ -2702,8 +5695,6 @@ def student_dashboard():
             traceback.print_exc()
             premium_analytics = None
     
-    conn.close()
-    
     dashboard_data = {
         'stats': {
             'total_searches': total_searches,
@@ -2721,8 +5712,24 @@ def student_dashboard():
         'premium_analytics': premium_analytics
     }
     
-    # Cache for shorter time (1 minute) since user activity changes frequently
-    set_cached(cache_key, dashboard_data)
+    return dashboard_data
+
+@app.route('/api/student/dashboard', methods=['GET'])
+@require_auth
+def student_dashboard():
+    # Only allow students to access student dashboard
+    if request.current_user.get('role') == 'admin':
+        return jsonify({'error': 'This endpoint is for students only. Admins should use /api/admin/analytics'}), 403
+    
+    user_id = request.current_user['user_id']
+    
+    # Cached for a shorter time (1 minute, dashboard_ namespace) since user activity changes frequently.
+    # A timestamp query parameter bypasses the cached copy.
+    dashboard_data = get_or_compute(f"dashboard_{user_id}",
+                                    lambda: build_student_dashboard(user_id),
+                                    tags=(user_cache_tag(user_id),),
+                                    stale_while_revalidate=True,
+                                    force=bool(request.args.get('t')))
     
     return jsonify(dashboard_data)
 
@@ -2783,86 +5790,98 @@ def elasticsearch_status():
 @app.route('/api/recommendations/collaborative', methods=['GET'])
 @require_auth
 def get_collaborative_recommendations():
-    """Get collaborative filtering recommendations based on similar users"""
+    """Get collaborative filtering recommendations based on similar users (or ALS factors with engine=als)"""
     user_id = request.current_user['user_id']
     top_k = request.args.get('top_k', 10, type=int)
+    engine = request.args.get('engine', 'knn')
+    # Optional narrowing of the popularity fallback for users without enough history
+    genre = request.args.get('genre')
+    academic_level = request.args.get('academic_level')
     
-    # Check cache
-    cache_key = f"collab_rec_{user_id}_{top_k}"
-    cached_recs = get_cached(cache_key)
-    if cached_recs is not None:
-        return jsonify(cached_recs)
-    
-    conn = get_db()
-    
-    # Build user-item matrix
-    matrix = collaborative_engine.build_user_item_matrix(conn)
-    
-    if not matrix:
-        conn.close()
-        return jsonify({
-            'recommendations': [],
-            'message': 'Not enough data for collaborative filtering'
-        })
-    
-    # Get collaborative recommendations
-    recs = collaborative_engine.get_collaborative_recommendations(user_id, top_k=top_k)
-    
-    if not recs:
-        conn.close()
-        return jsonify({
-            'recommendations': [],
-            'message': 'No recommendations found based on similar users'
-        })
-    
-    # Get book details for recommendations
-    book_ids = [rec['book_id'] for rec in recs]
-    placeholders = ','.join(['?'] * len(book_ids))
-    
-    c = conn.cursor()
-    c.execute(f'SELECT * FROM books WHERE id IN ({placeholders})', book_ids)
+    if engine not in ('knn', 'als'):
+        return jsonify({'error': "engine must be 'knn' or 'als'"}), 400
     
-    books_dict = {}
-    for row in c.fetchall():
-        books_dict[row['id']] = {
-            'id': row['id'],
-            'title': row['title'],
-            'author': row['author'],
-            'abstract': row['abstract'] if row['abstract'] else '',
-            'genre': row['genre'] if row['genre'] else '',
-            'academic_level': row['academic_level'] if row['academic_level'] else '',
-            'tags': row['tags'].split(',') if row['tags'] else [],
-            'cover_image': row_get(row, 'cover_image', 'book'),
-            'subscription_level': row_get(row, 'subscription_level', 'free'),
-            'pages': row_get(row, 'pages', 0)
+    def recommend(conn):
+        # Current user-item matrix (built in the background, then kept up to date incrementally)
+        matrix = collaborative_engine.refresh(conn, user_id)
+        
+        if not matrix and collaborative_engine.built_at is not None:
+            return {
+                'recommendations': [],
+                'message': 'Not enough data for collaborative filtering'
+            }
+        
+        # Get collaborative recommendations (ALS falls back to user-kNN until it can score this user,
+        # which serves popular books while the matrix is still being built)
+        recs = als_engine.recommend(user_id, top_k=top_k, matrix=matrix) if engine == 'als' and matrix else None
+        if not recs:
+            recs = collaborative_engine.get_collaborative_recommendations(user_id, top_k=top_k, genre=genre,
+                                                                           academic_level=academic_level)
+        
+        if not recs:
+            return {
+                'recommendations': [],
+                'message': 'No recommendations found based on similar users'
+            }
+        
+        # Get book details for recommendations
+        book_ids = [rec['book_id'] for rec in recs]
+        placeholders = ','.join(['?'] * len(book_ids))
+        
+        c = conn.cursor()
+        c.execute(f'SELECT * FROM books WHERE id IN ({placeholders})', book_ids)
+        
+        books_dict = {}
+        for row in c.fetchall():
+            books_dict[row['id']] = {
+                'id': row['id'],
+                'title': row['title'],
+                'author': row['author'],
+                'abstract': row['abstract'] if row['abstract'] else '',
+                'genre': row['genre'] if row['genre'] else '',
+                'academic_level': row['academic_level'] if row['academic_level'] else '',
+                'tags': row['tags'].split(',') if row['tags'] else [],
+                'cover_image': row_get(row, 'cover_image', 'book'),
+                'subscription_level': row_get(row, 'subscription_level', 'free'),
+                'pages': row_get(row, 'pages', 0)
+            }
+        
+        # Combine recommendations with book details
+        recommendations = []
+        recommendation_method = 'collaborative'
+        for rec in recs:
+            book_id = rec['book_id']
+            if book_id in books_dict:
+                method = rec.get('method', 'collaborative')
+                if method != 'collaborative':
+                    recommendation_method = method
+                recommendations.append({
+                    'book': books_dict[book_id],
+                    'collaborative_score': round(rec['score'], 4),
+                    'confidence_percentage': round(min(rec['score'] * 100, 100), 1),
+                    'method': method
+                })
+        
+        return {
+            'recommendations': recommendations,
+            'type': recommendation_method,
+            'total_count': len(recommendations)
         }
     
-    conn.close()
-    
-    # Combine recommendations with book details
-    recommendations = []
-    recommendation_method = 'collaborative'
-    for rec in recs:
-        book_id = rec['book_id']
-        if book_id in books_dict:
-            method = rec.get('method', 'collaborative')
-            if method != 'collaborative':
-                recommendation_method = method
-            recommendations.append({
-                'book': books_dict[book_id],
-                'collaborative_score': round(rec['score'], 4),
-                'confidence_percentage': round(min(rec['score'] * 100, 100), 1),
-                'method': method
-            })
-    
-    result = {
-        'recommendations': recommendations,
-        'type': recommendation_method,
-        'total_count': len(recommendations)
-    }
+    def compute():
+        # Also runs on a background refresh thread, so the connection is released on errors too
+        conn = get_db()
+        try:
+            return recommend(conn)
+        finally:
+            conn.close()
     
-    # Cache for 10 minutes (collaborative filtering is more stable)
-    set_cached(cache_key, result)
+    # Cached for 10 minutes (collab_rec_ namespace; collaborative filtering is more stable)
+    result = get_or_compute(f"collab_rec_{user_id}_{top_k}_{engine}_{genre or ''}_{academic_level or ''}",
+                            compute,
+                            tags=(user_cache_tag(user_id), 'collab'),
+                            stale_while_revalidate=True,
+                            cacheable=lambda result: bool(result['recommendations']))
     
     return jsonify(result)
 
@@ -2875,8 +5894,8 @@ def get_similar_users():
     
     conn = get_db()
     
-    # Build user-item matrix
-    matrix = collaborative_engine.build_user_item_matrix(conn)
+    # Current user-item matrix (built once, then kept up to date incrementally)
+    matrix = collaborative_engine.refresh(conn, user_id)
     
     if not matrix:
         conn.close()
@@ -3018,6 +6037,7 @@ def promote_to_admin():
         # Promote to admin
         c.execute("UPDATE users SET role = 'admin', subscription_level = 'premium' WHERE id = ?", (user_row['id'],))
         conn.commit()
+        invalidate_user_context(user_row['id'])
         conn.close()
         
         return jsonify({
@@ -3200,6 +6220,7 @@ def admin_user_detail(user_id):
         c.execute(query, params)
         conn.commit()
         conn.close()
+        invalidate_user_context(user_id)
         
         return jsonify({'success': True, 'message': 'User updated successfully'})
 
@@ -3233,8 +6254,10 @@ def admin_delete_user(user_id):
     
     # Delete user (cascade will handle related records if foreign keys are set up)
     c.execute('DELETE FROM users WHERE id=?', (user_id,))
+    c.execute('DELETE FROM user_profiles WHERE user_id=?', (user_id,))
     conn.commit()
     conn.close()
+    invalidate_user_context(user_id)
     
     return jsonify({'success': True, 'message': 'User deleted successfully'})
 
@@ -3261,6 +6284,7 @@ def admin_update_subscription(user_id):
     
     conn.commit()
     conn.close()
+    invalidate_user_context(user_id)
     
     return jsonify({'success': True, 'message': 'Subscription updated'})
 
@@ -3319,6 +6343,58 @@ def admin_user_traffic(user_id):
         'popular_books': popular_books
     })
 
+@app.route('/api/admin/jobs', methods=['GET'])
+@require_admin
+def admin_jobs():
+    """Get background job timings and the state of the artifacts they maintain"""
+    return jsonify({
+        'scheduler_running': scheduler.running,
+        'jobs': scheduler.stats(),
+        'collaborative_model': collaborative_engine.stats(),
+        'als_model': als_engine.stats(),
+        'book_neighbors': ai_engine.neighbors.stats(),
+        'popularity': popularity_index.stats(),
+        'ann_index': ai_engine.ann_index.stats(),
+        'event_writer': event_writer.stats()
+    })
+
+@app.route('/api/admin/jobs/<name>/run', methods=['POST'])
+@require_admin
+def run_admin_job(name):
+    """Trigger a background job now"""
+    if name not in [job['name'] for job in scheduler.stats()]:
+        return jsonify({'error': f'Unknown job: {name}'}), 404
+    
+    if scheduler.running:
+        scheduler.trigger(name)
+        return jsonify({'success': True, 'message': f'Job {name} scheduled'}), 202
+    
+    # No scheduler thread (e.g. background jobs disabled): run it here
+    success = scheduler.run_job(name)
+    return jsonify({
+        'success': success,
+        'job': next(job for job in scheduler.stats() if job['name'] == name)
+    }), 200 if success else 500
+
+@app.route('/api/admin/cache', methods=['GET', 'DELETE'])
+@require_admin
+def admin_cache():
+    """Get cache statistics, or clear the cache (optionally only ?tag= entries or keys containing ?pattern=)"""
+    if request.method == 'DELETE':
+        if request.args.get('tag'):
+            invalidate_tags(request.args['tag'])
+        else:
+            clear_cache(request.args.get('pattern') or None)
+        return jsonify({'success': True, 'message': 'Cache cleared'})
+    
+    return jsonify({'namespaces': cache_stats(), 'in_flight': len(_inflight)})
+
+@app.route('/api/admin/db-pool', methods=['GET'])
+@require_admin
+def admin_db_pool():
+    """Get database connection pool statistics"""
+    return jsonify({'requests': db_pool.stats(), 'background': background_db_pool.stats()})
+
 @app.route('/api/admin/analytics', methods=['GET'])
 @require_admin
 def admin_analytics():
@@ -3552,6 +6628,7 @@ def approve_subscription_request(request_id):
     
     conn.commit()
     conn.close()
+    invalidate_user_context(request_row['user_id'])
     
     return jsonify({'success': True, 'message': 'Subscription request approved'})
 
@@ -3597,8 +6674,7 @@ def user_subscription():
     conn = get_db()
     c = conn.cursor()
     
-    c.execute('SELECT subscription_level FROM users WHERE id=?', (user_id,))
-    subscription_level = c.fetchone()[0] or 'free'
+    subscription_level = request.user_context['subscription_level']
     
     c.execute('''SELECT * FROM subscription_requests
                  WHERE user_id = ?
@@ -3635,8 +6711,7 @@ def request_subscription_upgrade():
     c = conn.cursor()
     
     # Get current subscription
-    c.execute('SELECT subscription_level FROM users WHERE id=?', (user_id,))
-    current_level = c.fetchone()[0] or 'free'
+    current_level = request.user_context['subscription_level']
     
     # Create request
     c.execute('''INSERT INTO subscription_requests 
@@ -3769,21 +6844,31 @@ def toggle_book_like(book_id):
                          VALUES (?, ?)''', (user_id, book_id))
             conn.commit()
             action = 'liked'
+            user_profiles.record_like(conn, user_id, book_id)
         except sqlite3.IntegrityError:
             # Already liked
             conn.close()
             return jsonify({'success': True, 'message': 'Already liked', 'action': 'liked'})
     else:
-        # Unlike the book
+        # Unlike the book (the profile drops the like's contribution as of when it was made)
+        c.execute('''SELECT CAST(strftime('%s', created_at) AS REAL) as liked_at FROM book_likes
+                     WHERE user_id=? AND book_id=?''', (user_id, book_id))
+        like_row = c.fetchone()
         c.execute('DELETE FROM book_likes WHERE user_id=? AND book_id=?', (user_id, book_id))
         conn.commit()
         action = 'unliked'
+        if like_row:
+            user_profiles.record_like(conn, user_id, book_id, liked=False, liked_at=like_row['liked_at'])
     
     # Get updated count
     c.execute('SELECT COUNT(*) FROM book_likes WHERE book_id=?', (book_id,))
     total_likes = c.fetchone()[0]
     
     conn.close()
+    
+    # The like changed this user's taste profile: drop their cached dashboard and recommendations
+    invalidate_tags(user_cache_tag(user_id))
+    
     return jsonify({
         'success': True,
         'action': action,
@@ -3824,42 +6909,27 @@ def categories():
 @require_auth
 def get_books_by_category(category_name):
     """Get books by category name (genre match)"""
-    user_id = request.current_user['user_id']
-    
     # Get user subscription
+    user_subscription = request.user_context['subscription_level']
     conn = get_db()
-    c = conn.cursor()
-    c.execute('SELECT subscription_level FROM users WHERE id=?', (user_id,))
-    user_row = c.fetchone()
-    user_subscription = user_row['subscription_level'] or 'free' if user_row else 'free'
     
     # Build query with subscription filter
     if user_subscription == 'free':
-        base_query = "SELECT * FROM books WHERE genre = ? AND subscription_level = 'free'"
-        params = [category_name]
+        where = "genre = ? AND subscription_level = 'free'"
     elif user_subscription == 'basic':
-        base_query = "SELECT * FROM books WHERE genre = ? AND subscription_level IN ('free', 'basic')"
-        params = [category_name]
+        where = "genre = ? AND subscription_level IN ('free', 'basic')"
     else:
-        base_query = "SELECT * FROM books WHERE genre = ?"
-        params = [category_name]
-    
-    # Get pagination
-    page = int(request.args.get('page', 1))
-    per_page = int(request.args.get('per_page', 12))
-    offset = (page - 1) * per_page
-    
-    # Get total count
-    count_query = base_query.replace('SELECT *', 'SELECT COUNT(*)')
-    c.execute(count_query, params)
-    total_count = c.fetchone()[0]
+        where = "genre = ?"
     
-    # Get books with pagination
-    query = f"{base_query} ORDER BY created_at DESC LIMIT ? OFFSET ?"
-    c.execute(query, params + [per_page, offset])
+    # Get books by page or by cursor (see paginate_books)
+    try:
+        rows, pagination = paginate_books(conn, where, [category_name], request.args)
+    except ValueError as e:
+        conn.close()
+        return jsonify({'error': str(e)}), 400
     
     books = []
-    for row in c.fetchall():
+    for row in rows:
         books.append({
             'id': row['id'],
             'title': row['title'],
@@ -3876,16 +6946,9 @@ def get_books_by_category(category_name):
     
     conn.close()
     
-    total_pages = (total_count + per_page - 1) // per_page
-    
     return jsonify({
         'books': books,
-        'pagination': {
-            'page': page,
-            'per_page': per_page,
-            'total': total_count,
-            'total_pages': total_pages
-        },
+        'pagination': pagination,
         'category': category_name
     })
 
@@ -3942,6 +7005,10 @@ def admin_rename_genre():
         updated_count = c.rowcount
         conn.commit()
         
+        # Refresh the genre attribute used by filtered vector search
+        c.execute('SELECT id FROM books WHERE genre = ?', (new_genre,))
+        ai_engine.sync_books(conn, [row['id'] for row in c.fetchall()])
+        
         # Update Elasticsearch if enabled
         if es_service.enabled and updated_count > 0:
             c.execute('SELECT id FROM books WHERE genre = ?', (new_genre,))
@@ -3966,7 +7033,7 @@ def admin_rename_genre():
                     es_service.index_book(book_data)
         
         # Clear cache
-        clear_cache('books_')
+        invalidate_tags('books')
         
         conn.close()
         return jsonify({
@@ -4009,6 +7076,10 @@ def admin_merge_genres():
         total_updated = c.rowcount
         conn.commit()
         
+        # Refresh the genre attribute used by filtered vector search
+        c.execute('SELECT id FROM books WHERE genre = ?', (target_genre,))
+        ai_engine.sync_books(conn, [row['id'] for row in c.fetchall()])
+        
         # Update Elasticsearch if enabled
         if es_service.enabled and total_updated > 0:
             c.execute(f'SELECT id FROM books WHERE genre = ?', (target_genre,))
@@ -4033,7 +7104,7 @@ def admin_merge_genres():
                     es_service.index_book(book_data)
         
         # Clear cache
-        clear_cache('books_')
+        invalidate_tags('books')
         
         conn.close()
         return jsonify({
@@ -4076,6 +7147,9 @@ def admin_delete_genre():
         updated_count = c.rowcount
         conn.commit()
         
+        # Refresh the genre attribute used by filtered vector search
+        ai_engine.sync_books(conn, book_ids)
+        
         # Update Elasticsearch if enabled
         if es_service.enabled and updated_count > 0:
             for book_id in book_ids:
@@ -4097,7 +7171,7 @@ def admin_delete_genre():
                     es_service.index_book(book_data)
         
         # Clear cache
-        clear_cache('books_')
+        invalidate_tags('books')
         
         conn.close()
         return jsonify({
@@ -4312,6 +7386,7 @@ def user_profile():
             query = f"UPDATE users SET {', '.join(updates)} WHERE id=?"
             c.execute(query, params)
             conn.commit()
+            invalidate_user_context(user_id)
             
             # Get updated user data
             c.execute('''SELECT id, email, first_name, last_name, avatar, academic_level, 
@@ -4520,7 +7595,7 @@ def upload_book_file(book_id):
         conn.close()
         
         # Clear cache for this book
-        clear_cache('books_')
+        invalidate_tags('books')
         
         return jsonify({
             'success': True,
@@ -4566,7 +7641,7 @@ def upload_book_cover(book_id):
         conn.close()
         
         # Clear cache for this book
-        clear_cache('books_')
+        invalidate_tags('books')
         
         return jsonify({
             'success': True,
@@ -4597,11 +7672,9 @@ def download_book_file(filename):
         
         book_subscription = book_row['subscription_level'] or 'free'
         
-        # Get user subscription level from database
+        # Get user subscription level (database value, cached per user)
         user_id = request.current_user['user_id']
-        c.execute('SELECT subscription_level FROM users WHERE id=?', (user_id,))
-        user_row = c.fetchone()
-        user_subscription = user_row['subscription_level'] or 'free' if user_row else 'free'
+        user_subscription = request.user_context['subscription_level']
         
         # Check access rights
         if book_subscription == 'premium' and user_subscription != 'premium':
@@ -4643,11 +7716,9 @@ def preview_book(book_id):
         # Check access rights
         book_subscription = book_row['subscription_level'] or 'free'
         
-        # Get user subscription level from database
+        # Get user subscription level (database value, cached per user)
         user_id = request.current_user['user_id']
-        c.execute('SELECT subscription_level FROM users WHERE id=?', (user_id,))
-        user_row = c.fetchone()
-        user_subscription = user_row['subscription_level'] or 'free' if user_row else 'free'
+        user_subscription = request.user_context['subscription_level']
         
         if book_subscription == 'premium' and user_subscription != 'premium':
             conn.close()
@@ -4678,14 +7749,31 @@ def preview_book(book_id):
 @require_auth
 def submit_feedback():
     data = request.json
+    
+    # Model and popularity keys are integer book ids; a string "2" would be a second key
+    book_id = data.get('book_id')
+    if book_id is not None:
+        try:
+            if isinstance(book_id, bool):
+                raise ValueError
+            book_id = int(book_id)
+        except (TypeError, ValueError, OverflowError):
+            return jsonify({'error': 'book_id must be an integer'}), 400
+    
     conn = get_db()
     c = conn.cursor()
     
+    if book_id is not None:
+        c.execute('SELECT 1 FROM books WHERE id=?', (book_id,))
+        if not c.fetchone():
+            conn.close()
+            return jsonify({'error': 'Book not found'}), 404
+    
     c.execute('''INSERT INTO feedback 
                  (user_id, book_id, is_helpful, query, type, message, rating)
                  VALUES (?, ?, ?, ?, ?, ?, ?)''',
               (request.current_user['user_id'],
-               data.get('book_id'),
+               book_id,
                data.get('is_helpful', True),
                data.get('query', ''),
                data.get('type', 'general'),
@@ -4693,11 +7781,18 @@ def submit_feedback():
                data.get('rating', 0)))
     
     conn.commit()
+    collaborative_engine.apply_interaction(conn, request.current_user['user_id'], book_id)
+    # Ratings may arrive as strings ("5"); anything that is not a number only skips the popularity update
+    try:
+        rating = float(data.get('rating') or 0)
+    except (TypeError, ValueError):
+        rating = 0.0
+    if data.get('is_helpful', True) and np.isfinite(rating) and rating > 0:
+        popularity_index.record(conn, book_id, feedback_weight(rating))
     conn.close()
     
-    # Clear collaborative filtering cache when feedback changes
-    clear_cache('collab_rec_')
-    clear_cache('dashboard_')
+    # Clear this user's cached dashboard and recommendations when their feedback changes
+    invalidate_tags(user_cache_tag(request.current_user['user_id']))
     
     return jsonify({'success': True, 'message': 'Feedback submitted successfully'})
 
@@ -4795,6 +7890,13 @@ if __name__ == '__main__':
     print("Starting BookGenie Backend...")
     init_db()
     load_sample_data()
+    ai_engine.load_embeddings()
+    conn = get_db()
+    ai_engine.sync_books(conn)
+    collaborative_engine.rebuild(conn)
+    popularity_index.rebuild(conn)
+    als_engine.load()
+    conn.close()
     print("Database initialized with sample data")
     print("Sample books loaded")
     print("Pre-created users:")
@@ -87,6 +87,9 @@ export class BookGenieAPI {
     if (filters.academic_level) params.append('academic_level', filters.academic_level)
     if (filters.page) params.append('page', filters.page)
     if (filters.per_page) params.append('per_page', filters.per_page)
+    // Keyset pagination: pass pagination.next_cursor from the previous page
+    if (filters.cursor) params.append('cursor', filters.cursor)
+    if (filters.include_total) params.append('include_total', filters.include_total)
 
     try {
       const data = await this.request(`/books?${params}`, {
@@ -438,9 +441,27 @@ export class BookGenieAPI {
     })
   }
 
+  // Record several interactions and reading sessions in one request
+  // events: [{ book_id, type, value?, duration_minutes? (type 'read'), timestamp? (unix seconds) }]
+  async recordInteractionsBatch(events, token) {
+    return this.request('/interactions/batch', {
+      method: 'POST',
+      headers: {
+        'Authorization': `Bearer ${token}`,
+      },
+      body: JSON.stringify({ events }),
+    })
+  }
+
   // Get books by category
-  async getBooksByCategory(categoryName, token, page = 1, perPage = 12) {
-    return this.request(`/categories/${encodeURIComponent(categoryName)}/books?page=${page}&per_page=${perPage}`, {
+  async getBooksByCategory(categoryName, token, page = 1, perPage = 12, cursor = null) {
+    const params = new URLSearchParams({ per_page: perPage })
+    if (cursor) {
+      params.append('cursor', cursor)
+    } else {
+      params.append('page', page)
+    }
+    return this.request(`/categories/${encodeURIComponent(categoryName)}/books?${params}`, {
       headers: {
         'Authorization': `Bearer ${token}`,
       },